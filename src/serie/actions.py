@@ -1,28 +1,43 @@
 import asyncio
 import dataclasses
+import functools
 import logging
 import re
-from collections.abc import Sequence
+from collections.abc import Awaitable, Callable, Hashable, Sequence
+from typing import TypeVar
 
 from aiochris_oag import (
     Plugin,
     PluginInstance,
     PluginsApi,
     PluginInstanceRequest,
+    Pipeline,
+    PipelinesApi,
+    Workflow,
+    WorkflowRequest,
     ApiClient,
     DefaultApi,
     FeedRequest,
 )
-from serie.clients import Clients
+from serie import metrics
+from serie.clients import Clients, credential_digest
+from serie.dicom_header import DicomHeader
+from serie.plugin_catalog import PluginSpec
+from serie.plugin_parameters import ParameterSchema, check_params
 from serie.models import (
     ChrisRunnableRequest,
     RawPacsSeries,
     InvalidRunnable,
 )
+from serie.resilience import PartialResults
 from serie.resolved_pacs_series import ResolvedPacsSeries, resolve_series
+from serie.single_flight import SingleFlight
+from serie.task_graph import TaskGraph
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 _HARDCODED_RUNNABLES = [
     ChrisRunnableRequest(runnable_type="plugin", name="pl-dircopy"),
     ChrisRunnableRequest(runnable_type="plugin", name="pl-unstack-folders"),
@@ -33,6 +48,11 @@ The runnables which are needed to create feeds.
 
 _NOTE_ID_RE = re.compile(r"/api/v1/note(\d+)/")
 
+_MAX_WORKFLOW_TITLE_LENGTH = 100
+"""
+The maximum length of :class:`WorkflowRequest` titles.
+"""
+
 
 @dataclasses.dataclass(frozen=True)
 class FoundPlugin:
@@ -40,19 +60,18 @@ class FoundPlugin:
     A plugin which was found in CUBE, and the runnable request which requested it.
     """
 
-    plugin_api: PluginsApi
     plugin: Plugin
     runnable: ChrisRunnableRequest
 
-    async def create_instance(self, previous: PluginInstance) -> PluginInstance:
+    async def create_instance(
+        self, api_client: ApiClient, previous: PluginInstance
+    ) -> PluginInstance:
         """
         Run the plugin with the runnable's parameters on the data from the ``previous`` parameter.
         """
-        # WARNING:
-        #  - unrecognized parameters are silently ignored.
-        #  - unhandled error if parameter value is wrong type.
-
-        return await self.plugin_api.plugins_instances_create(
+        # parameters were checked by ClientActions._get_runnables, because
+        # CUBE silently ignores unrecognized parameters.
+        return await PluginsApi(api_client).plugins_instances_create(
             self.plugin.id,
             PluginInstanceRequest(
                 previous_id=previous.id, additional_properties=self.runnable.params
@@ -60,6 +79,34 @@ class FoundPlugin:
         )
 
 
+@dataclasses.dataclass(frozen=True)
+class FoundPipeline:
+    """
+    A pipeline which was found in CUBE, and the runnable request which requested it.
+    """
+
+    pipeline: Pipeline
+    runnable: ChrisRunnableRequest
+
+    async def create_instance(
+        self, api_client: ApiClient, previous: PluginInstance
+    ) -> Workflow:
+        """
+        Create a workflow of the pipeline on the data from the ``previous`` parameter.
+        All plugin instances of the pipeline are created by *CUBE* in one request.
+        """
+        # truncated, because an invalid title would only be noticed after
+        # dircopy and unstack were already created.
+        title = self.pipeline.name[:_MAX_WORKFLOW_TITLE_LENGTH]
+        return await PipelinesApi(api_client).pipelines_workflows_create(
+            self.pipeline.id,
+            WorkflowRequest(title=title, previous_plugin_inst_id=previous.id),
+        )
+
+
+FoundRunnable = FoundPlugin | FoundPipeline
+
+
 @dataclasses.dataclass(frozen=True)
 class ClientActions:
     """
@@ -69,83 +116,258 @@ class ClientActions:
     auth: str | None
     host: str
     clients: Clients
+    flights: SingleFlight
+    """
+    Coalesces identical operations which are requested concurrently by different
+    :class:`ClientActions` instances, so it should be shared between them.
+    """
+    partial_results: PartialResults
+    """
+    Operations of analyses which failed part way, so that they are resumed when
+    retried. Should be shared between :class:`ClientActions` instances.
+    """
 
     async def resolve_series(self, data: RawPacsSeries) -> ResolvedPacsSeries:
-        return await resolve_series(self._get_client(), data)
+        """
+        Get the series and its folder from *CUBE*, or from :attr:`Clients.resolved_series`.
+        """
+        # a series resolved using other credentials would hide that these are rejected
+        cache_key = (self.host, credential_digest(self.auth), data.id, data.folder_id)
+        if (cached := self.clients.resolved_series.get(cache_key)) is not None:
+            return cached
+        key = ("resolve_series", self.host, self.auth, data.id, data.folder_id)
+        with metrics.STAGE_DURATION.labels("resolve_series").time():
+            resolved = await self.flights.do(
+                key,
+                lambda: resolve_series(
+                    data, functools.partial(self.clients.read, self.host, self.auth)
+                ),
+            )
+        self.clients.resolved_series.put(cache_key, resolved)
+        return resolved
+
+    async def get_dicom_header(self, series: ResolvedPacsSeries) -> DicomHeader:
+        """
+        Get the DICOM header of a series, see :meth:`Clients.get_dicom_header`.
+        """
+        uid = series.series_instance_uid
+        key = ("dicom_header", self.host, self.auth, uid)
+        with metrics.STAGE_DURATION.labels("dicom_header").time():
+            return await self.flights.do(
+                key,
+                lambda: self.clients.get_dicom_header(
+                    self.host, self.auth, series.folder_id, uid
+                ),
+            )
 
     async def create_analysis(
         self,
-        series: ResolvedPacsSeries,
+        series: Sequence[ResolvedPacsSeries],
         runnables_request: Sequence[ChrisRunnableRequest],
         feed_name_template: str,
     ) -> str:
         """
-        Create a feed containing ``data_dir`` and run all of ``runnable_request``.
-        Set the name of the created feed using ``feed_name_template``.
+        Create a feed containing the folders of ``series`` and run all of ``runnable_request``.
+        Set the name of the created feed using ``feed_name_template``, which is
+        expanded with the metadata of the first series.
+
+        If the same analysis of the same series is already being created,
+        wait for it and return the same feed instead of creating another.
+        If the same analysis previously failed part way, it is resumed.
         """
-        pl_dircopy, pl_unstack_folders, plugins = await self._get_plugins(
-            runnables_request
+        key = (
+            "create_analysis",
+            self.host,
+            self.auth,
+            tuple(s.series_id for s in series),
+            tuple(runnable.model_dump_json() for runnable in runnables_request),
+            feed_name_template,
+        )
+        return await self.flights.do(
+            key,
+            lambda: self._create_analysis(
+                key, series, runnables_request, feed_name_template
+            ),
+        )
+
+    async def _create_analysis(
+        self,
+        key: Hashable,
+        series: Sequence[ResolvedPacsSeries],
+        runnables_request: Sequence[ChrisRunnableRequest],
+        feed_name_template: str,
+    ) -> str:
+        with metrics.STAGE_DURATION.labels("get_runnables").time():
+            pl_dircopy, pl_unstack_folders, runnables = await self._get_runnables(
+                runnables_request
+            )
+        feed_name = _expand_variables(feed_name_template, series[0])
+        # pl-dircopy copies every directory of a comma-separated list
+        data_dirs = ",".join(s.folder_path for s in series)
+
+        # the feed name only depends on dircopy, so it is set while unstack is created
+        graph = TaskGraph(observe=metrics.observe_stage)
+        graph.add(
+            "dircopy",
+            lambda: self._write(
+                lambda api_client: PluginsApi(api_client).plugins_instances_create(
+                    pl_dircopy.id,
+                    PluginInstanceRequest(
+                        additional_properties={"dir": data_dirs}
+                    ),
+                )
+            ),
         )
-        plugins_api = self._get_plugins_api()
-        dircopy_inst = await plugins_api.plugins_instances_create(
-            pl_dircopy.id,
-            PluginInstanceRequest(additional_properties={"dir": series.folder.path}),
+        graph.add(
+            "set_feed_name",
+            lambda dircopy_inst: self._set_feed_name(dircopy_inst, feed_name),
+            "dircopy",
         )
-        root_inst = await plugins_api.plugins_instances_create(
-            pl_unstack_folders.id, PluginInstanceRequest(previous_id=dircopy_inst.id)
+        graph.add(
+            "unstack",
+            lambda dircopy_inst: self._write(
+                lambda api_client: PluginsApi(api_client).plugins_instances_create(
+                    pl_unstack_folders.id,
+                    PluginInstanceRequest(previous_id=dircopy_inst.id),
+                )
+            ),
+            "dircopy",
         )
-        branches = (plugin.create_instance(root_inst) for plugin in plugins)
-        feed_name = _expand_variables(feed_name_template, series)
-        set_feed_name = self._set_feed_name(dircopy_inst, feed_name)
-        await asyncio.gather(set_feed_name, *branches)
-        return dircopy_inst.feed
+        for i, runnable in enumerate(runnables):
+            graph.add(
+                f"{runnable.runnable.runnable_type}[{i}]",
+                functools.partial(self._create_instance, runnable),
+                "unstack",
+            )
+        completed = self.partial_results.pop(key)
+        if completed is not None:
+            logger.info("Resuming analysis after %s", list(completed.keys()))
+        try:
+            results = await graph.run(completed)
+        except BaseException:
+            self.partial_results.put(key, graph.results)
+            raise
+        finally:
+            logger.debug("create_analysis latencies: %s", graph.latencies)
+        return results["dircopy"].feed
 
-    async def _get_plugins(
+    async def _get_runnables(
         self, runnables_request: Sequence[ChrisRunnableRequest]
-    ) -> tuple[Plugin, Plugin, Sequence[FoundPlugin]]:
+    ) -> tuple[Plugin, Plugin, Sequence[FoundRunnable]]:
         """
-        Get the plugins pl-dircopy, pl-unstack-folders, and any other plugins requested.
+        Get the plugins pl-dircopy, pl-unstack-folders, and any other plugins
+        or pipelines requested.
 
-        :raises InvalidRunnablesError: if any plugins cannot be found in CUBE.
+        :raises InvalidRunnablesError: if any runnables cannot be found in CUBE,
+                                       or the parameters of a plugin are invalid.
         """
-        if any(req.runnable_type != "plugin" for req in runnables_request):
-            raise NotImplementedError("Only plugins are supported for now")
+        requested = _HARDCODED_RUNNABLES + list(runnables_request)
+        plugin_indices = [
+            i for i, r in enumerate(requested) if r.runnable_type == "plugin"
+        ]
+        pipeline_indices = [
+            i for i, r in enumerate(requested) if r.runnable_type == "pipeline"
+        ]
+        plugins, pipelines = await asyncio.gather(
+            self.clients.get_plugins(
+                self.host, self.auth, _specs(requested, plugin_indices)
+            ),
+            self._get_pipelines(_specs(requested, pipeline_indices)),
+        )
+        found: list[Plugin | Pipeline | None] = [None] * len(requested)
+        for i, runnable in zip(plugin_indices + pipeline_indices, plugins + pipelines):
+            found[i] = runnable
 
-        needed_runnables = _HARDCODED_RUNNABLES + list(runnables_request)
-        plugin_requests = (
-            self.clients.get_plugin(
-                self.host, self.auth, runnable.name, runnable.version
-            )
-            for runnable in needed_runnables
+        # parameters are checked before anything is created, so that a typo does
+        # not leave behind a feed which is missing the analysis.
+        checked = [
+            i
+            for i in plugin_indices[len(_HARDCODED_RUNNABLES) :]
+            if found[i] is not None
+        ]
+        schemas = await asyncio.gather(
+            *(self._get_plugin_parameters(found[i]) for i in checked)
         )
-        plugins = await asyncio.gather(*plugin_requests)
-        missing_plugins = [
-            InvalidRunnable(runnable=runnable, reason="plugin not found")
-            for runnable, plugin in zip(needed_runnables, plugins)
-            if plugin is None
+        parameters = dict(zip(checked, schemas))
+        invalid = [
+            InvalidRunnable(runnable=runnable, reason=reason)
+            for i, (runnable, runnable_found) in enumerate(zip(requested, found))
+            if (reason := _invalid_reason(runnable, runnable_found, parameters.get(i)))
+            is not None
+        ]
+        if len(invalid) > 0:
+            raise InvalidRunnablesError(invalid)
+
+        pl_dircopy, pl_unstack_folders, *others = found
+        found_runnables = [
+            FoundPlugin(f, r) if r.runnable_type == "plugin" else FoundPipeline(f, r)
+            for f, r in zip(others, runnables_request)
         ]
-        if len(missing_plugins) > 0:
-            raise InvalidRunnablesError(missing_plugins)
-        pl_dircopy, pl_unstack_folders, *others = plugins  # noqa
-        pa = self._get_plugins_api()
-        found_plugins = [FoundPlugin(pa, p, r) for p, r in zip(others, runnables_request)]
-        return pl_dircopy, pl_unstack_folders, found_plugins
+        return pl_dircopy, pl_unstack_folders, found_runnables
+
+    async def _get_plugin_parameters(self, plugin: Plugin) -> ParameterSchema:
+        key = ("plugin_parameters", self.host, self.auth, plugin.id)
+        return await self.flights.do(
+            key,
+            lambda: self.clients.get_plugin_parameters(self.host, self.auth, plugin.id),
+        )
+
+    async def _get_pipelines(self, specs: Sequence[PluginSpec]) -> list[Pipeline | None]:
+        if len(specs) == 0:
+            return []
+        return await self.clients.get_pipelines(self.host, self.auth, specs)
 
     async def _set_feed_name(self, dircopy_inst: PluginInstance, name: str):
         """
         Set the feed name of a plugin instance.
         """
-        feeds_api = self._get_feeds_api()
-        await feeds_api.root_update(dircopy_inst.feed_id, FeedRequest(name=name))
+        await self._write(
+            lambda api_client: DefaultApi(api_client).root_update(
+                dircopy_inst.feed_id, FeedRequest(name=name)
+            )
+        )
+
+    async def _create_instance(
+        self, runnable: FoundRunnable, previous: PluginInstance
+    ) -> PluginInstance | Workflow:
+        return await self._write(
+            lambda api_client: runnable.create_instance(api_client, previous)
+        )
+
+    async def _write(self, fn: Callable[[ApiClient], Awaitable[T]]) -> T:
+        return await self.clients.write(self.host, self.auth, fn)
 
-    def _get_feeds_api(self) -> DefaultApi:
-        return DefaultApi(self._get_client())
 
-    def _get_plugins_api(self) -> PluginsApi:
-        return PluginsApi(self._get_client())
+def _specs(
+    runnables: Sequence[ChrisRunnableRequest], indices: Sequence[int]
+) -> list[PluginSpec]:
+    return [(runnables[i].name, runnables[i].version) for i in indices]
 
-    def _get_client(self) -> ApiClient:
-        return self.clients.get_api_client(self.host, self.auth)
+
+def _invalid_reason(
+    runnable: ChrisRunnableRequest,
+    found: Plugin | Pipeline | None,
+    parameters: ParameterSchema | None = None,
+) -> str | None:
+    """
+    :param parameters: parameters of the plugin, if they should be checked
+    :return: why a runnable cannot be run, or None if it can be run
+    """
+    if runnable.runnable_type == "plugin":
+        if found is None:
+            return "plugin not found"
+        if parameters is not None and (
+            problems := check_params(runnable.params, parameters)
+        ):
+            return "; ".join(problems)
+        return None
+    if runnable.version is not None:
+        return "pipelines do not have versions"
+    if found is None:
+        return "pipeline not found"
+    if len(runnable.params) > 0:
+        return "parameters are not supported for pipelines"
+    return None
 
 
 def _expand_variables(template: str, resolved: ResolvedPacsSeries) -> str:
@@ -157,7 +379,7 @@ def _expand_variables(template: str, resolved: ResolvedPacsSeries) -> str:
 
 class InvalidRunnablesError(Exception):
     """
-    CUBE is missing requested plugins or pipelines.
+    CUBE is missing requested plugins or pipelines, or their parameters are invalid.
     """
 
     def __init__(self, runnables: Sequence[InvalidRunnable]):
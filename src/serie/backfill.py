@@ -0,0 +1,289 @@
+"""
+Catch up on DICOM series which were received while *SERIE* was not running, or
+apply new rules to series which were already received.
+
+Series are listed from the *CUBE* API one page at a time, and handled according
+to the rules of ``RULES_FILE`` the same way as :mod:`serie.ingest`, so series
+which were already handled are skipped (see :mod:`serie.idempotency`). Progress
+is saved to a checkpoint file after every page, so an interrupted backfill can
+be resumed by running it again with the same arguments. If a series of a page
+could not be handled, e.g. because *CUBE* was unavailable, the backfill stops
+without saving progress past that page, see :class:`BackfillInterrupted`.
+
+Rules with a ``study_quiet_period`` cannot be backfilled, because the series of
+a study may be on different pages, so they would not be grouped into one feed.
+
+Series are skipped if they were handled by :mod:`serie.ingest` or a previous
+backfill, because their events have the same ID. Series which were handled
+through Hasura are only skipped if the idempotency store is shared with the
+server (``IDEMPOTENCY_STORE=sqlite`` with the same ``IDEMPOTENCY_SQLITE_PATH``)
+*and* ``INGEST_AUTHORIZATION`` is the same Authorization header which Hasura
+sends, because the credentials are part of the fingerprint of a series.
+
+Usage::
+
+    python -m serie.backfill --since 2024-01-01 --checkpoint backfill.json
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Optional
+
+from fastapi import status
+from pydantic import ValidationError
+
+from aiochris_oag import PacsApi, PACSSeries, PaginatedPACSSeriesList
+from serie.handler import EventHandler
+from serie.models import DicomSeriesEvent, RawPacsSeries, RuleOutcome
+from serie.settings import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+_FOLDER_ID_RE = re.compile(r"/api/v1/filebrowser/(\d+)/")
+
+
+class BackfillInterrupted(Exception):
+    """
+    Some series of a page could not be handled. The checkpoint is not advanced
+    past the page, so running the backfill again retries it.
+    """
+
+
+@dataclasses.dataclass
+class Checkpoint:
+    """
+    Progress of a backfill.
+
+    Series are listed in a fixed range of creation dates, so that series which
+    are created during the backfill do not shift the offsets of pages.
+    """
+
+    since: datetime.datetime
+    until: datetime.datetime
+    offset: int = 0
+    handled: int = 0
+    matched: int = 0
+
+    @classmethod
+    def load_or_create(
+        cls, path: Optional[Path], since: datetime.datetime, until: datetime.datetime
+    ) -> "Checkpoint":
+        """
+        Load the checkpoint from ``path`` if it has the same ``since``. The saved
+        ``until`` is kept, so that a resumed backfill lists the same series.
+        """
+        if path is not None and path.exists():
+            saved = json.loads(path.read_text())
+            checkpoint = cls(
+                since=datetime.datetime.fromisoformat(saved["since"]),
+                until=datetime.datetime.fromisoformat(saved["until"]),
+                offset=saved["offset"],
+                handled=saved["handled"],
+                matched=saved["matched"],
+            )
+            if checkpoint.since == since:
+                return checkpoint
+            logger.warning("Ignoring checkpoint %s for a different range", path)
+        return cls(since=since, until=until)
+
+    def save(self, path: Path):
+        data = dataclasses.asdict(self)
+        data["since"] = self.since.isoformat()
+        data["until"] = self.until.isoformat()
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(data))
+        tmp.replace(path)
+
+
+async def backfill(
+    handler: EventHandler,
+    authorization: str,
+    checkpoint: Checkpoint,
+    checkpoint_path: Optional[Path] = None,
+    page_size: int = 100,
+    concurrency: int = 8,
+    after_id: int = 0,
+) -> Checkpoint:
+    """
+    Handle every series created in the range of ``checkpoint``, starting from its offset.
+
+    The next page is fetched while the current page is handled, so at most two
+    pages of series are held in memory.
+
+    :param after_id: skip series with an ``id`` less than or equal to this
+    :raises BackfillInterrupted: if series of a page could not be handled
+    :raises ValueError: if a rule has a ``study_quiet_period``
+    """
+    study_rules = [
+        rule.name
+        for rule in handler.rule_index.rules
+        if rule.study_quiet_period is not None
+    ]
+    if study_rules:
+        raise ValueError(
+            f"Rules with study_quiet_period cannot be backfilled: {study_rules}"
+        )
+    host = handler.settings.get_host()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def fetch(offset: int) -> asyncio.Task[PaginatedPACSSeriesList]:
+        return asyncio.create_task(
+            handler.clients.read(
+                host,
+                authorization,
+                lambda api_client: PacsApi(api_client).pacs_series_search_list(
+                    min_creation_date=checkpoint.since,
+                    max_creation_date=checkpoint.until,
+                    limit=page_size,
+                    offset=offset,
+                ),
+            )
+        )
+
+    async def handle(series: RawPacsSeries, hits) -> list[RuleOutcome]:
+        async with semaphore:
+            event = DicomSeriesEvent.model_construct(
+                hasura_id=f"pacsseries:{series.id}", data=series
+            )
+            return await handler.handle_rule_hits(event, hits, authorization)
+
+    next_page = fetch(checkpoint.offset)
+    try:
+        while next_page is not None:
+            page = await next_page
+            results = page.results or []
+            if page.next is not None and len(results) > 0:
+                next_page = fetch(checkpoint.offset + len(results))
+            else:
+                next_page = None
+
+            rows = [
+                row
+                for row in map(to_raw_series, results)
+                if row is not None and row.id > after_id
+            ]
+            hits = [handler.rule_index.prematch(row) for row in rows]
+            matched = [(row, h) for row, h in zip(rows, hits) if len(h) > 0]
+            outcomes = await asyncio.gather(
+                *(handle(row, h) for row, h in matched), return_exceptions=True
+            )
+            failed = []
+            for (row, _), outcome in zip(matched, outcomes):
+                if isinstance(outcome, Exception):
+                    logger.error(
+                        "Failed to handle series id=%d", row.id, exc_info=outcome
+                    )
+                    failed.append(row.id)
+                elif any(
+                    o.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+                    for o in outcome
+                ):
+                    failed.append(row.id)
+            if failed:
+                raise BackfillInterrupted(
+                    f"Could not handle series {failed} "
+                    f"of the page at offset {checkpoint.offset}"
+                )
+
+            checkpoint.offset += len(results)
+            checkpoint.handled += len(rows)
+            checkpoint.matched += len(matched)
+            if checkpoint_path is not None:
+                checkpoint.save(checkpoint_path)
+            logger.info(
+                "Backfilled %d series (%d matched)",
+                checkpoint.handled,
+                checkpoint.matched,
+            )
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+    return checkpoint
+
+
+def to_raw_series(series: PACSSeries) -> Optional[RawPacsSeries]:
+    """
+    Convert a series from the *CUBE* API to the row which Hasura would send.
+
+    :return: None if the series is invalid, which is logged
+    """
+    folder_id = _FOLDER_ID_RE.search(series.folder)
+    if folder_id is None:
+        logger.error("Skipping series id=%d without a folder", series.id)
+        return None
+    data = series.model_dump(by_alias=True)
+    if series.patient_sex is not None:
+        data["PatientSex"] = series.patient_sex.to_dict()
+    # pacs_id is not available from the API, and is not used
+    data.update(folder_id=int(folder_id.group(1)), pacs_id=0)
+    try:
+        return RawPacsSeries.model_validate(data)
+    except ValidationError:
+        logger.exception("Skipping invalid series id=%d", series.id)
+        return None
+
+
+async def _main(args: argparse.Namespace, settings: Settings):
+    if settings.rules_file is None or settings.ingest_authorization is None:
+        raise SystemExit("RULES_FILE and INGEST_AUTHORIZATION must be set.")
+    # feeds are created synchronously so that progress is only saved after they exist
+    handler = EventHandler(settings.model_copy(update={"async_jobs": False}))
+    until = args.until or datetime.datetime.now(datetime.timezone.utc)
+    checkpoint = Checkpoint.load_or_create(args.checkpoint, args.since, until)
+    try:
+        await backfill(
+            handler,
+            settings.ingest_authorization.get_secret_value(),
+            checkpoint,
+            args.checkpoint,
+            page_size=args.page_size,
+            concurrency=args.concurrency,
+            after_id=args.after_id,
+        )
+    except BackfillInterrupted as e:
+        raise SystemExit(f"{e}, run the backfill again to retry.") from e
+    except ValueError as e:
+        raise SystemExit(str(e)) from e
+    finally:
+        await handler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Handle DICOM series which were already received by CUBE "
+        "according to the rules of RULES_FILE."
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        default=datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+        help="only series created at or after this time (ISO 8601)",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.datetime.fromisoformat,
+        help="only series created at or before this time (ISO 8601), default: now",
+    )
+    parser.add_argument(
+        "--after-id", type=int, default=0, help="only series with a greater id"
+    )
+    parser.add_argument(
+        "--checkpoint", type=Path, help="file to save progress to and resume from"
+    )
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="number of series to handle at a time"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args, get_settings()))
+
+
+if __name__ == "__main__":
+    main()
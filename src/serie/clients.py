@@ -1,36 +1,373 @@
-from typing import Optional
+import asyncio
+import contextlib
+import dataclasses
+import functools
+import hashlib
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Awaitable, Callable, Iterator, Sequence
+from typing import Optional, TypeVar
 
-import asyncstdlib
+from aiochris_oag import (
+    Configuration,
+    Plugin,
+    Pipeline,
+    ApiClient,
+    PluginsApi,
+    PipelinesApi,
+    FilebrowserApi,
+)
+from aiochris_oag.rest import RESTResponse
+from serie import event_log
+from serie.dicom_header import DicomHeader, parse_header, read_prefix
+from serie.limits import RequestLimiter
+from serie.plugin_catalog import PluginCatalog, PluginSpec
+from serie.plugin_parameters import ParameterSchema, ParameterSpec
+from serie.resilience import Resilience
+from serie.resolved_pacs_series import ResolvedPacsSeries
+from serie.ttl_cache import TtlCache
 
-from aiochris_oag import Configuration, Plugin, ApiClient, PluginsApi
+T = TypeVar("T")
+
+_PLUGINS_PAGE_SIZE = 500
+"""
+Number of plugins or pipelines to request per page when listing the catalog.
+"""
+
+
+@dataclasses.dataclass
+class _PooledClient:
+    api_client: ApiClient
+    last_used: float
 
 
 class Clients:
     """
-    Helper functions for getting client objects with LRU caching.
+    Helper functions for making requests to *CUBE*, and caches of what they get.
 
-    N.B.: instances cannot be shared across async event loops.
+    API clients are pooled by host and credentials. Each client owns an HTTP session
+    which keeps its connections alive, so reusing clients across requests avoids
+    paying for TCP and TLS setup on every call to *CUBE*. The pool is bounded: the
+    least recently used client is evicted when it is full, and clients which were
+    not used for ``idle_timeout`` are evicted too. An evicted client is closed as soon
+    as no call of :meth:`read` or :meth:`write` is using it.
 
-    Warning: graceful shutdown of clients not handled.
+    N.B.: instances cannot be shared across async event loops.
     """
 
-    @asyncstdlib.lru_cache(maxsize=64)
-    async def get_plugin(
-        self, host: str, auth: Optional[str], name: str, version: Optional[str]
-    ) -> Optional[Plugin]:
+    def __init__(
+        self,
+        max_clients: int = 16,
+        connections_per_client: int = 32,
+        idle_timeout: float = 300.0,
+        plugin_catalog: Optional[PluginCatalog[Plugin]] = None,
+        pipeline_catalog: Optional[PluginCatalog[Pipeline]] = None,
+        resilience: Optional[Resilience] = None,
+        limiter: Optional[RequestLimiter] = None,
+        dicom_headers: Optional[TtlCache[str, DicomHeader]] = None,
+        dicom_header_bytes: int = 65536,
+        resolved_series: Optional[TtlCache[tuple, ResolvedPacsSeries]] = None,
+        plugin_parameters: Optional[TtlCache[tuple, ParameterSchema]] = None,
+    ):
+        """
+        :param max_clients: maximum number of pooled clients. The least recently used client is evicted when full.
+        :param connections_per_client: maximum number of simultaneous connections of
+                                       each client, i.e. per host and credentials
+        :param idle_timeout: number of seconds after which an unused client is closed
+        :param plugin_catalog: cache for :meth:`get_plugins`
+        :param pipeline_catalog: cache for :meth:`get_pipelines`
+        :param resilience: retries and circuit breakers of calls to *CUBE*
+        :param limiter: limits of outstanding calls to *CUBE*
+        :param dicom_headers: cache for :meth:`get_dicom_header`
+        :param dicom_header_bytes: number of bytes of a DICOM file to read for :meth:`get_dicom_header`
+        :param resolved_series: cache of series by host, credentials, series ID and folder ID, see :attr:`resolved_series`
+        :param plugin_parameters: cache for :meth:`get_plugin_parameters`
+        """
+        self._max_clients = max_clients
+        self._connections_per_client = connections_per_client
+        self._idle_timeout = idle_timeout
+        self._pool: OrderedDict[tuple[str, Optional[str]], _PooledClient] = (
+            OrderedDict()
+        )
+        self._leases: Counter[ApiClient] = Counter()
+        self._retired: set[ApiClient] = set()
+        """Evicted clients which are still used by calls of :meth:`read` or :meth:`write`."""
+        self._closing: set[asyncio.Task] = set()
+        self._plugin_catalog = plugin_catalog or PluginCatalog()
+        self._pipeline_catalog = pipeline_catalog or PluginCatalog()
+        self.resilience = resilience or Resilience()
+        self._limiter = limiter or RequestLimiter()
+        self._dicom_headers = dicom_headers or TtlCache(kind="dicom_header")
+        self.resolved_series = resolved_series or TtlCache(kind="series")
+        """
+        Series which were resolved, by the digest of the credentials which were
+        used. Only series which were found are cached.
+        """
+        self._dicom_header_bytes = dicom_header_bytes
+        self._plugin_parameters = plugin_parameters or TtlCache(
+            kind="plugin_parameters"
+        )
+
+    async def get_plugins(
+        self, host: str, auth: Optional[str], specs: Sequence[PluginSpec]
+    ) -> list[Optional[Plugin]]:
+        """
+        Get *ChRIS* plugins by name and version.
+
+        Plugins are cached regardless of ``auth``, see :class:`PluginCatalog`.
+        """
+        return await self._plugin_catalog.get_many(
+            host, specs, lambda: self._list_plugins(host, auth)
+        )
+
+    async def get_pipelines(
+        self, host: str, auth: Optional[str], specs: Sequence[PluginSpec]
+    ) -> list[Optional[Pipeline]]:
+        """
+        Get *ChRIS* pipelines by name. Pipelines do not have versions, so a
+        spec which has a version is never found.
+
+        Unlike plugins, pipelines are cached by ``auth`` too, because a locked
+        pipeline is only visible to its owner.
+        """
+        return await self._pipeline_catalog.get_many(
+            (host, credential_digest(auth)),
+            specs,
+            lambda: self._list_pipelines(host, auth),
+        )
+
+    async def get_plugin_parameters(
+        self, host: str, auth: Optional[str], plugin_id: int
+    ) -> ParameterSchema:
+        """
+        Get the parameters of a *ChRIS* plugin. They are cached by plugin ID,
+        regardless of ``auth``.
+        """
+        schema = self._plugin_parameters.get((host, plugin_id))
+        if schema is not None:
+            return schema
+        parameters = await self.read(
+            host,
+            auth,
+            lambda api_client: _list_all(
+                functools.partial(
+                    PluginsApi(api_client).plugins_parameters_list, plugin_id
+                )
+            ),
+        )
+        schema = {p.name: ParameterSpec.from_api(p) for p in parameters}
+        self._plugin_parameters.put((host, plugin_id), schema)
+        return schema
+
+    async def get_dicom_header(
+        self,
+        host: str,
+        auth: Optional[str],
+        folder_id: int,
+        series_instance_uid: str,
+    ) -> DicomHeader:
+        """
+        Get the DICOM header of a series, by reading only the first bytes of one
+        of the files of its folder. Headers are cached by ``series_instance_uid``,
+        regardless of ``auth``.
+        """
+        header = self._dicom_headers.get(series_instance_uid)
+        if header is not None:
+            return header
+        files = await self.read(
+            host,
+            auth,
+            lambda api_client: FilebrowserApi(api_client).filebrowser_files_list(
+                folder_id, limit=1
+            ),
+        )
+        if not files.results:
+            header = {}
+        else:
+            url = files.results[0].file_resource
+            data = await self.read(
+                host,
+                auth,
+                lambda api_client: read_prefix(
+                    api_client, url, self._dicom_header_bytes
+                ),
+            )
+            header = parse_header(data)
+        self._dicom_headers.put(series_instance_uid, header)
+        return header
+
+    async def read(
+        self, host: str, auth: Optional[str], fn: Callable[[ApiClient], Awaitable[T]]
+    ) -> T:
         """
-        Get a *ChRIS* plugin.
+        Make a request to *CUBE* which only reads, using the pooled client of ``host``
+        and ``auth``. It is retried if it fails with a transient error, see
+        :meth:`Resilience.read`.
+        """
+        with self._lease(host, auth) as api_client:
+            return await self.resilience.read(
+                host, lambda: self._limited(host, auth, lambda: fn(api_client))
+            )
+
+    async def write(
+        self, host: str, auth: Optional[str], fn: Callable[[ApiClient], Awaitable[T]]
+    ) -> T:
+        """
+        Make a request to *CUBE* which creates or changes something, using the pooled
+        client of ``host`` and ``auth``. It is not retried, but it is rejected if
+        *CUBE* is down, see :meth:`Resilience.write`.
+        """
+        with self._lease(host, auth) as api_client:
+            return await self.resilience.write(
+                host, lambda: self._limited(host, auth, lambda: fn(api_client))
+            )
+
+    async def _limited(
+        self, host: str, auth: Optional[str], fn: Callable[[], Awaitable[T]]
+    ) -> T:
+        async with self._limiter.limit(host, auth):
+            return await fn()
+
+    @contextlib.contextmanager
+    def _lease(self, host: str, auth: Optional[str]) -> Iterator[ApiClient]:
+        """
+        Use a pooled client, so that it is not closed until it is no longer used.
         """
         api_client = self.get_api_client(host, auth)
-        plugins_api = PluginsApi(api_client)
-        res = await plugins_api.plugins_search_list(name=name, version=version)
-        if res.results is None or len(res.results) == 0:
-            return None
-        return res.results[0]
+        self._leases[api_client] += 1
+        try:
+            yield api_client
+        finally:
+            self._leases[api_client] -= 1
+            if self._leases[api_client] == 0:
+                del self._leases[api_client]
+                if api_client in self._retired:
+                    self._close(api_client)
+
+    async def _list_plugins(self, host: str, auth: Optional[str]) -> list[Plugin]:
+        """
+        List every plugin of *CUBE*.
+        """
+        return await self.read(
+            host,
+            auth,
+            lambda api_client: _list_all(PluginsApi(api_client).plugins_list),
+        )
+
+    async def _list_pipelines(self, host: str, auth: Optional[str]) -> list[Pipeline]:
+        """
+        List every pipeline of *CUBE*.
+        """
+        return await self.read(
+            host,
+            auth,
+            lambda api_client: _list_all(PipelinesApi(api_client).pipelines_list),
+        )
 
     def get_api_client(self, host: str, auth: Optional[str]) -> ApiClient:
+        """
+        Get a pooled client for the given host and credentials, creating it if needed.
+        It may be closed once it is evicted, so requests should be made using
+        :meth:`read` or :meth:`write` instead.
+        """
+        now = time.monotonic()
+        self._evict_idle(now)
+        key = (host, auth)
+        pooled = self._pool.get(key, None)
+        if pooled is None:
+            pooled = _PooledClient(self._create_api_client(host, auth), now)
+            self._pool[key] = pooled
+            while len(self._pool) > self._max_clients:
+                _, evicted = self._pool.popitem(last=False)
+                self._retire(evicted.api_client)
+        else:
+            pooled.last_used = now
+            self._pool.move_to_end(key)
+        return pooled.api_client
+
+    async def close(self):
+        """
+        Close all clients. Should be called when the application shuts down.
+        """
+        self._plugin_catalog.clear()
+        self._pipeline_catalog.clear()
+        self._dicom_headers.clear()
+        self._plugin_parameters.clear()
+        self.resolved_series.clear()
+        clients = [pooled.api_client for pooled in self._pool.values()]
+        clients.extend(self._retired)
+        self._pool.clear()
+        self._retired.clear()
+        await asyncio.gather(
+            *(client.close() for client in clients), *self._closing
+        )
+
+    def _create_api_client(self, host: str, auth: Optional[str]) -> ApiClient:
         config = Configuration(host=host)
+        config.connection_pool_maxsize = self._connections_per_client
         auth_params = (
             {"header_name": "Authorization", "header_value": auth} if auth else {}
         )
-        return ApiClient(config, **auth_params)
+        return _TracedApiClient(config, **auth_params)
+
+    def _evict_idle(self, now: float):
+        while len(self._pool) > 0:
+            key, oldest = next(iter(self._pool.items()))
+            if now - oldest.last_used < self._idle_timeout:
+                return
+            del self._pool[key]
+            self._retire(oldest.api_client)
+
+    def _retire(self, api_client: ApiClient):
+        """
+        Close an evicted client, once it is no longer used.
+        """
+        if api_client in self._leases:
+            self._retired.add(api_client)
+        else:
+            self._close(api_client)
+
+    def _close(self, api_client: ApiClient):
+        self._retired.discard(api_client)
+        task = asyncio.create_task(api_client.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+
+def credential_digest(auth: Optional[str]) -> Optional[str]:
+    """
+    Identify credentials without keeping them, e.g. in a cache key.
+    """
+    return None if auth is None else hashlib.sha256(auth.encode()).hexdigest()
+
+
+class _TracedApiClient(ApiClient):
+    """
+    An :class:`ApiClient` which records every call in the trace of the current
+    event, see :mod:`serie.event_log`.
+    """
+
+    async def call_api(self, method, url, *args, **kwargs) -> RESTResponse:
+        start = time.perf_counter()
+        status_code = None
+        try:
+            response = await super().call_api(method, url, *args, **kwargs)
+            status_code = response.status
+            return response
+        finally:
+            # until the response headers are received
+            duration = time.perf_counter() - start
+            event_log.record_cube_call(method, url, status_code, duration)
+
+
+async def _list_all(list_page) -> list:
+    """
+    Get every item of a paginated list endpoint.
+    """
+    items = []
+    while True:
+        res = await list_page(limit=_PLUGINS_PAGE_SIZE, offset=len(items))
+        items.extend(res.results or [])
+        if res.next is None or not res.results:
+            return items
+
@@ -0,0 +1,84 @@
+"""
+Reading the DICOM header of a series from *CUBE*, for matching on DICOM tags
+which are not columns of the pacsfiles_pacsseries table.
+
+Requires the optional dependency pydicom, e.g. ``pip install serie[dicom]``.
+"""
+
+import io
+from collections.abc import Mapping
+
+from aiochris_oag import ApiClient
+from aiochris_oag.exceptions import ApiException
+
+_SKIPPED_VRS = frozenset({"OB", "OD", "OF", "OL", "OV", "OW", "SQ", "UN"})
+"""
+Value representations of binary data and sequences, which are not matched on.
+"""
+
+DicomHeader = Mapping[str, str]
+"""
+Values of the top-level data elements of a DICOM header by keyword.
+Multiple values are joined by a backslash, like in DICOM, e.g. ``ORIGINAL\\PRIMARY``.
+"""
+
+
+def is_dicom_keyword(keyword: str) -> bool:
+    """
+    Whether ``keyword`` is the keyword of a tag of the DICOM data dictionary.
+
+    :raises ImportError: if pydicom is not installed
+    """
+    from pydicom.datadict import tag_for_keyword
+
+    return tag_for_keyword(keyword) is not None
+
+
+def parse_header(data: bytes) -> dict[str, str]:
+    """
+    Parse the data elements found in the first bytes of a DICOM file.
+    Elements which are cut off are ignored.
+    """
+    import pydicom
+
+    dataset = pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True, force=True)
+    header = {}
+    for element in dataset:
+        if element.VR in _SKIPPED_VRS or not element.keyword or element.value is None:
+            continue
+        if element.VM > 1:
+            header[element.keyword] = "\\".join(str(v) for v in element.value)
+        else:
+            header[element.keyword] = str(element.value)
+    return header
+
+
+async def read_prefix(api_client: ApiClient, url: str, size: int) -> bytes:
+    """
+    Download the first ``size`` bytes of a file. A ``Range`` header is sent, but
+    only ``size`` bytes are read even if *CUBE* responds with the whole file.
+
+    :raises ApiException: the subclass for the status of an error response
+    """
+    method, url, headers, body, post_params = api_client.param_serialize(
+        "GET", "", header_params={"Range": f"bytes=0-{size - 1}"}, _host=url
+    )
+    res = await api_client.call_api(method, url, headers, body, post_params)
+    response = res.response
+    try:
+        if response.status not in (200, 206):
+            # like the generated API methods, e.g. ServiceException for 5xx,
+            # so that errors of reading files are retried and reported alike
+            await res.read()
+            ApiException.from_response(
+                http_resp=res, body=res.data.decode(errors="replace"), data=None
+            )
+        data = bytearray()
+        while len(data) < size:
+            chunk = await response.content.read(size - len(data))
+            if not chunk:
+                break
+            data.extend(chunk)
+        return bytes(data)
+    finally:
+        response.release()
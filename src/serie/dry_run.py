@@ -0,0 +1,169 @@
+"""
+Find out how many of the DICOM series which are already in *CUBE* would be
+matched by some conditions, without creating anything, e.g. before adding
+an event trigger or a rule.
+
+Series are listed from the *CUBE* API one page at a time and evaluated with the
+compiled conditions, so only the current and next pages and a sample of the
+matching series are held in memory.
+
+Usage::
+
+    python -m serie.dry_run payload.json --since 2024-01-01 --sample-size 20
+
+where ``payload.json`` contains the ``match`` of a payload, see :class:`DryRunRequest`.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+from pathlib import Path
+
+from aiochris_oag import PacsApi, PaginatedPACSSeriesList
+from serie.backfill import to_raw_series
+from serie.clients import Clients
+from serie.limits import RequestLimiter
+from serie.match import RESOLVED_ONLY_TAGS, compile_matcher
+from serie.models import DryRunRequest, DryRunResult, RawPacsSeries
+from serie.resilience import Resilience
+from serie.settings import Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+async def dry_run(
+    clients: Clients,
+    host: str,
+    authorization: str,
+    request: DryRunRequest,
+    page_size: int = 500,
+) -> DryRunResult:
+    """
+    Evaluate the conditions of ``request`` against every series created in its
+    range of creation dates.
+
+    Conditions which cannot be evaluated using only the rows of the
+    ``pacsfiles_pacsseries`` table are skipped, and listed in :attr:`DryRunResult.unevaluated`.
+    """
+    matcher = compile_matcher(request.match)
+    unevaluated = sorted(
+        {c.key for c in matcher.conditions if c.is_header or c.tag in RESOLVED_ONLY_TAGS}
+    )
+    # the range is fixed, so that series created during the dry run do not shift the offsets of pages
+    until = request.until or datetime.datetime.now(datetime.timezone.utc)
+
+    def fetch(offset: int) -> asyncio.Task[PaginatedPACSSeriesList]:
+        return asyncio.create_task(
+            clients.read(
+                host,
+                authorization,
+                lambda api_client: PacsApi(api_client).pacs_series_search_list(
+                    min_creation_date=request.since,
+                    max_creation_date=until,
+                    limit=page_size,
+                    offset=offset,
+                ),
+            )
+        )
+
+    scanned = 0
+    matched = 0
+    offset = 0
+    sample: list[RawPacsSeries] = []
+    next_page = fetch(offset)
+    try:
+        while next_page is not None:
+            page = await next_page
+            results = page.results or []
+            offset += len(results)
+            if page.next is not None and len(results) > 0:
+                next_page = fetch(offset)
+            else:
+                next_page = None
+
+            rows = [row for row in map(to_raw_series, results) if row is not None]
+            hits = [row for row in rows if matcher.prematch(row)]
+            scanned += len(rows)
+            matched += len(hits)
+            sample.extend(hits[: request.sample_size - len(sample)])
+            logger.info("Evaluated %d series (%d matched)", scanned, matched)
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+    return DryRunResult(
+        scanned=scanned, matched=matched, sample=sample, unevaluated=unevaluated
+    )
+
+
+async def _main(args: argparse.Namespace, settings: Settings):
+    if settings.ingest_authorization is None:
+        raise SystemExit("INGEST_AUTHORIZATION must be set.")
+    spec = json.loads(args.spec.read_text())
+    overrides = {
+        "since": args.since,
+        "until": args.until,
+        "sample_size": args.sample_size,
+    }
+    request = DryRunRequest.model_validate(
+        {**spec, **{k: v for k, v in overrides.items() if v is not None}}
+    )
+    # only series are listed, so none of the caches of EventHandler are needed
+    clients = Clients(
+        max_clients=1,
+        connections_per_client=settings.client_connections_per_client,
+        resilience=Resilience(
+            attempts=settings.cube_retry_attempts,
+            base_delay=settings.cube_retry_base_delay,
+            max_delay=settings.cube_retry_max_delay,
+            failure_threshold=settings.cube_breaker_threshold,
+            reset_timeout=settings.cube_breaker_reset_timeout,
+        ),
+        limiter=RequestLimiter(
+            per_host=settings.cube_max_requests_per_host,
+            per_credential=settings.cube_max_requests_per_credential,
+        ),
+    )
+    try:
+        result = await dry_run(
+            clients,
+            settings.get_host(),
+            settings.ingest_authorization.get_secret_value(),
+            request,
+            page_size=args.page_size,
+        )
+    finally:
+        await clients.close()
+    print(result.model_dump_json(by_alias=True, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count the DICOM series already in CUBE which match the "
+        "conditions of a payload, without creating anything."
+    )
+    parser.add_argument(
+        "spec", type=Path, help="JSON file containing the `match` of a payload"
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.datetime.fromisoformat,
+        help="only series created at or after this time (ISO 8601)",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.datetime.fromisoformat,
+        help="only series created at or before this time (ISO 8601), default: now",
+    )
+    parser.add_argument(
+        "--sample-size", type=int, help="maximum number of matching series to print"
+    )
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(args, get_settings()))
+
+
+if __name__ == "__main__":
+    main()
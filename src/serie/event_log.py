@@ -0,0 +1,235 @@
+"""
+One structured log record per event, with the outcome of the event and the
+duration and status code of every call which was made to *CUBE*. An event is a
+request to ``/dicom_series/``, a row of a request to ``/dicom_series/batch/``,
+or a rule matched by a request to ``/dicom_series/rules/`` or by an ingested row.
+A series which matches no rule is one event.
+
+Records are logged as JSON lines by the ``serie.events`` logger. Its handler only
+puts records in a queue, and they are formatted and written by the thread of
+:class:`EventLogListener`, so logging does not block the event loop.
+
+The trace of the current event is found using a :class:`contextvars.ContextVar`,
+so it is carried into the tasks which are created while handling the event.
+Calls which are shared by several events, e.g. coalesced by :class:`serie.single_flight.SingleFlight`
+or made for a whole study, are only recorded in the trace of one of them.
+"""
+
+import contextlib
+import contextvars
+import dataclasses
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import urllib.parse
+from collections.abc import Awaitable, Callable, Iterator
+from typing import IO, Optional
+
+from fastapi import status
+from pydantic import BaseModel
+
+from serie.models import CreatedFeed
+
+logger = logging.getLogger("serie.events")
+logger.propagate = False
+# enabled by EventLogListener.start
+logger.setLevel(logging.WARNING)
+
+_current: contextvars.ContextVar[Optional["EventTrace"]] = contextvars.ContextVar(
+    "serie_event_trace", default=None
+)
+
+
+@dataclasses.dataclass
+class EventTrace:
+    """
+    What happened while handling an event.
+    """
+
+    hasura_id: str
+    series_id: int
+    start: float = dataclasses.field(default_factory=time.perf_counter)
+    matched: Optional[bool] = None
+    """Whether the series matched, according to the conditions which were evaluated so far."""
+    status_code: Optional[int] = None
+    feed: Optional[str] = None
+    error: Optional[str] = None
+    deferred: bool = False
+    """Whether the trace is logged by :func:`continue_in` instead of :func:`trace_event`."""
+    cube_calls: list[tuple[str, str, Optional[int], float]] = dataclasses.field(
+        default_factory=list
+    )
+    """Method, path, status code (``None`` if there was no response) and duration of calls to *CUBE*."""
+    cache: dict[str, dict[str, int]] = dataclasses.field(default_factory=dict)
+    """Number of cache lookups by kind of cache and hit, miss or stale."""
+
+    def to_dict(self) -> dict:
+        return {
+            "hasura_id": self.hasura_id,
+            "series_id": self.series_id,
+            "matched": self.matched,
+            "status_code": self.status_code,
+            "feed": self.feed,
+            "error": self.error,
+            "duration": round(time.perf_counter() - self.start, 6),
+            "cube_calls": [
+                {
+                    "method": method,
+                    "path": path,
+                    "status": status_code,
+                    "duration": round(duration, 6),
+                }
+                for method, path, status_code, duration in self.cube_calls
+            ],
+            "cache": {kind: dict(counts) for kind, counts in self.cache.items()},
+        }
+
+
+@contextlib.contextmanager
+def trace_event(hasura_id: str, series_id: int) -> Iterator[Optional[EventTrace]]:
+    """
+    Trace the handling of an event, and log the trace when done. An event which
+    was accepted as an asynchronous job is logged when the job is done instead,
+    see :func:`continue_in`.
+
+    Nothing is traced if the ``serie.events`` logger is disabled.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        yield None
+        return
+    trace = EventTrace(hasura_id=hasura_id, series_id=series_id)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        if not (trace.deferred and trace.status_code == status.HTTP_202_ACCEPTED):
+            _log(trace)
+
+
+def continue_in(
+    fn: Callable[[], Awaitable[tuple[int, Optional[BaseModel]]]],
+) -> Callable[[], Awaitable[tuple[int, Optional[BaseModel]]]]:
+    """
+    Continue the trace of the current event in ``fn``, e.g. an asynchronous job
+    which is run by a worker, and log the trace with the outcome of ``fn`` when it is done.
+    ``fn`` must be run if the event is accepted.
+    """
+    trace = _current.get()
+    if trace is None:
+        return fn
+    trace.deferred = True
+
+    async def traced() -> tuple[int, Optional[BaseModel]]:
+        token = _current.set(trace)
+        try:
+            outcome = await fn()
+            record_outcome(*outcome)
+            return outcome
+        except BaseException as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            _log(trace)
+
+    return traced
+
+
+def record_match(matched: bool):
+    """
+    Record whether the series of the current event matched.
+    """
+    if (trace := _current.get()) is not None:
+        trace.matched = matched
+
+
+def record_outcome(status_code: int, body: Optional[BaseModel]):
+    """
+    Record the HTTP status code and response body of the current event.
+    """
+    if (trace := _current.get()) is not None:
+        trace.status_code = status_code
+        if isinstance(body, CreatedFeed):
+            trace.feed = str(body.feed)
+
+
+def record_cube_call(
+    method: str, url: str, status_code: Optional[int], duration: float
+):
+    """
+    Record a call to *CUBE* which was made for the current event.
+    """
+    if (trace := _current.get()) is not None:
+        path = urllib.parse.urlsplit(url).path
+        trace.cube_calls.append((method, path, status_code, duration))
+
+
+def record_cache(kind: str, state: str, count: int = 1):
+    """
+    Record lookups of a cache which were made for the current event.
+
+    :param state: "hit", "miss" or "stale"
+    """
+    if (trace := _current.get()) is not None:
+        counts = trace.cache.setdefault(kind, {})
+        counts[state] = counts.get(state, 0) + count
+
+
+def _log(trace: EventTrace):
+    logger.info("dicom_series event", extra={"event_trace": trace.to_dict()})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the records of :func:`trace_event` as one line of JSON.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        created = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+        data = {"time": created.isoformat(), "event": "dicom_series"}
+        data.update(getattr(record, "event_trace", {"message": record.getMessage()}))
+        return json.dumps(data, separators=(",", ":"))
+
+
+class EventLogListener:
+    """
+    Writes the records of the ``serie.events`` logger to ``stream`` in a
+    background thread. Events are only traced while the listener is started.
+    """
+
+    def __init__(self, stream: Optional[IO[str]] = None):
+        self._queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._handler = logging.handlers.QueueHandler(self._queue)
+
+        self._started = False
+
+    def start(self):
+        # idempotent, because FastAPI may call the startup handlers of an included router twice
+        if self._started:
+            return
+        self._started = True
+        self._listener.start()
+        logger.addHandler(self._handler)
+        logger.setLevel(logging.INFO)
+
+    def stop(self):
+        """
+        Stop logging events, and wait for queued records to be written.
+        """
+        if not self._started:
+            return
+        self._started = False
+        logger.removeHandler(self._handler)
+        logger.setLevel(logging.WARNING)
+        self._listener.stop()
@@ -0,0 +1,458 @@
+import asyncio
+import dataclasses
+import logging
+from collections.abc import Callable, Sequence
+from typing import Optional
+
+from fastapi import status
+
+from aiochris_oag.exceptions import (
+    ForbiddenException,
+    NotFoundException,
+    UnauthorizedException,
+)
+from serie import event_log, metrics
+from serie.actions import ClientActions, InvalidRunnablesError
+from serie.clients import Clients, credential_digest
+from serie.idempotency import (
+    IdempotencyStore,
+    MemoryIdempotencyStore,
+    SqliteIdempotencyStore,
+    fingerprint,
+)
+from serie.jobs import JobQueue
+from serie.limits import AdmissionController, RequestLimiter
+from serie.match import Matcher
+from serie.models import (
+    DicomSeriesEvent,
+    DicomSeriesPayload,
+    RoutingRule,
+    RuleOutcome,
+    InvalidRunnableList,
+    CreatedFeed,
+    BadRequestResponse,
+    JobAccepted,
+    JobStatus,
+)
+from serie.plugin_catalog import PluginCatalog
+from serie.resolved_pacs_series import ResolvedPacsSeries
+from serie.resilience import (
+    TRANSIENT_ERRORS,
+    CircuitOpenError,
+    PartialResults,
+    Resilience,
+)
+from serie.rules import RuleIndex, load_rules
+from serie.settings import Settings
+from serie.single_flight import SingleFlight
+from serie.study_groups import StudyGrouper
+from serie.ttl_cache import TtlCache
+
+logger = logging.getLogger(__name__)
+
+Outcome = tuple[int, CreatedFeed | BadRequestResponse | JobAccepted | None]
+"""
+HTTP status code and response body.
+"""
+
+
+class EventHandler:
+    """
+    Handles DICOM series events, whether they come from the web hooks of
+    :func:`serie.get_router`, from :mod:`serie.ingest`, or from :mod:`serie.backfill`.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        job_url: Callable[[str], str] = lambda hasura_id: hasura_id,
+    ):
+        """
+        :param job_url: get the URL of the status of an asynchronous job
+        """
+        catalog_settings = dict(
+            ttl=settings.plugin_cache_ttl,
+            negative_ttl=settings.plugin_cache_negative_ttl,
+            max_stale=settings.plugin_cache_max_stale,
+            maxsize=settings.plugin_cache_size,
+        )
+        self.settings = settings
+        self.clients = Clients(
+            max_clients=settings.client_pool_size,
+            connections_per_client=settings.client_connections_per_client,
+            idle_timeout=settings.client_idle_timeout,
+            plugin_catalog=PluginCatalog(**catalog_settings, kind="plugin"),
+            pipeline_catalog=PluginCatalog(**catalog_settings, kind="pipeline"),
+            dicom_headers=TtlCache(
+                maxsize=settings.dicom_header_cache_size,
+                ttl=settings.dicom_header_cache_ttl,
+                kind="dicom_header",
+            ),
+            dicom_header_bytes=settings.dicom_header_bytes,
+            resolved_series=TtlCache(
+                maxsize=settings.series_cache_size,
+                ttl=settings.series_cache_ttl,
+                kind="series",
+            ),
+            # plugins never change, so their parameters are cached like plugins
+            plugin_parameters=TtlCache(
+                maxsize=settings.plugin_cache_size,
+                ttl=settings.plugin_cache_ttl,
+                kind="plugin_parameters",
+            ),
+            resilience=Resilience(
+                attempts=settings.cube_retry_attempts,
+                base_delay=settings.cube_retry_base_delay,
+                max_delay=settings.cube_retry_max_delay,
+                failure_threshold=settings.cube_breaker_threshold,
+                reset_timeout=settings.cube_breaker_reset_timeout,
+            ),
+            limiter=RequestLimiter(
+                per_host=settings.cube_max_requests_per_host,
+                per_credential=settings.cube_max_requests_per_credential,
+            ),
+        )
+        self.admission = AdmissionController(
+            max_concurrent=settings.admission_max_concurrent,
+            max_queue=settings.admission_max_queue,
+            max_wait=settings.admission_max_wait,
+        )
+        self.flights = SingleFlight()
+        self.partial_results = PartialResults()
+        self.jobs: Optional[JobQueue] = (
+            JobQueue(
+                workers=settings.job_workers,
+                maxsize=settings.job_queue_size,
+                history=settings.job_history_size,
+            )
+            if settings.async_jobs
+            else None
+        )
+        self.idempotency: IdempotencyStore = (
+            SqliteIdempotencyStore(settings.idempotency_sqlite_path)
+            if settings.idempotency_store == "sqlite"
+            else MemoryIdempotencyStore(settings.idempotency_max_entries)
+        )
+        self.study_groups: StudyGrouper[tuple, _StudyMember, dict[str, Outcome]] = (
+            StudyGrouper(self._process_study, max_delay=settings.study_max_delay)
+        )
+        self.rule_index = RuleIndex(
+            [] if settings.rules_file is None else load_rules(settings.rules_file)
+        )
+        self._job_url = job_url
+
+    async def close(self):
+        await self.study_groups.close()
+        if self.jobs is not None:
+            await self.jobs.close(self.settings.job_shutdown_timeout)
+        await self.clients.close()
+        await self.idempotency.close()
+
+    async def handle_rules(
+        self, event: DicomSeriesEvent, authorization: str
+    ) -> list[RuleOutcome] | None:
+        """
+        Handle an event according to the rules of ``RULES_FILE``.
+
+        :return: outcome of every rule which matched, or None if no rule matched
+        """
+        with metrics.STAGE_DURATION.labels("match").time():
+            hits = self.rule_index.prematch(event.data)
+        if len(hits) == 0:
+            metrics.EVENT_OUTCOMES.labels(status.HTTP_204_NO_CONTENT).inc()
+            with event_log.trace_event(event.hasura_id, event.data.id):
+                event_log.record_match(False)
+                event_log.record_outcome(status.HTTP_204_NO_CONTENT, None)
+            return None
+        return await self.handle_rule_hits(event, hits, authorization)
+
+    async def handle_rule_hits(
+        self,
+        event: DicomSeriesEvent,
+        hits: Sequence[tuple[RoutingRule, Matcher]],
+        authorization: str,
+    ) -> list[RuleOutcome]:
+        """
+        Handle an event for the rules which it was already prematched with,
+        see :meth:`RuleIndex.prematch`. The outcome of every rule is traced
+        separately, see :mod:`serie.event_log`.
+        """
+        # fields were already validated, by DicomSeriesEvent and RuleTable
+        payloads = (
+            DicomSeriesPayload.model_construct(
+                hasura_id=f"{event.hasura_id}:{rule.name}",
+                data=event.data,
+                match=rule.match,
+                jobs=rule.jobs,
+                feed_name_template=rule.feed_name_template,
+                study_quiet_period=rule.study_quiet_period,
+            )
+            for rule, _ in hits
+        )
+
+        async def handle_rule(payload: DicomSeriesPayload, matcher: Matcher) -> Outcome:
+            with event_log.trace_event(payload.hasura_id, payload.data.id):
+                event_log.record_match(True)
+                outcome = await self.handle_matched(payload, matcher, authorization)
+                event_log.record_outcome(*outcome)
+                return outcome
+
+        # resolve_series is called once for all rules, thanks to SingleFlight
+        outcomes = await asyncio.gather(
+            *(
+                handle_rule(payload, matcher)
+                for payload, (_, matcher) in zip(payloads, hits)
+            )
+        )
+        return [
+            RuleOutcome(rule=rule.name, status_code=status_code, result=body)
+            for (rule, _), (status_code, body) in zip(hits, outcomes)
+        ]
+
+    async def handle_matched(
+        self, payload: DicomSeriesPayload, matcher: Matcher, authorization: str
+    ) -> Outcome:
+        """
+        Handle an event which passed :meth:`Matcher.prematch`.
+
+        :return: HTTP status code and response body
+        """
+        series_fingerprint = fingerprint(
+            payload.data.series_instance_uid, payload.jobs, authorization
+        )
+        if previous := await self.idempotency.get(
+            payload.hasura_id, series_fingerprint
+        ):
+            metrics.EVENT_OUTCOMES.labels(status.HTTP_200_OK).inc()
+            return status.HTTP_200_OK, previous
+
+        if payload.study_quiet_period is not None:
+            return await self._handle_study_member(
+                _StudyMember(payload, matcher, series_fingerprint), authorization
+            )
+
+        process = _EventProcessor(
+            self._actions(authorization),
+            payload,
+            matcher,
+            self.idempotency,
+            series_fingerprint,
+        )
+        if self.jobs is None:
+            return await process()
+
+        job = process
+        if self.jobs.accepts(payload.hasura_id):
+            # otherwise the job was already submitted, and is not run again
+            job = event_log.continue_in(process)
+        owner = credential_digest(authorization)
+        if not self.jobs.submit(payload.hasura_id, job, owner):
+            metrics.EVENT_OUTCOMES.labels(status.HTTP_503_SERVICE_UNAVAILABLE).inc()
+            return status.HTTP_503_SERVICE_UNAVAILABLE, None
+        return self._accepted(payload.hasura_id)
+
+    async def _handle_study_member(
+        self, member: "_StudyMember", authorization: str
+    ) -> Outcome:
+        """
+        Add a series to the group of its study, see :class:`StudyGrouper`.
+        """
+        payload = member.payload
+        if self.jobs is not None:
+            if not self.jobs.accepts(payload.hasura_id):
+                # the event was already added to a group, which is not done again
+                return self._accepted(payload.hasura_id)
+            if self.jobs.closed:
+                return status.HTTP_503_SERVICE_UNAVAILABLE, None
+        key = (
+            authorization,
+            payload.data.study_instance_uid,
+            tuple(job.model_dump_json() for job in payload.jobs),
+            payload.feed_name_template,
+        )
+        outcomes = self.study_groups.add(
+            key, payload.hasura_id, member, payload.study_quiet_period
+        )
+
+        async def wait_for_study() -> Outcome:
+            # shielded so that a cancelled caller does not cancel the group for others
+            return (await asyncio.shield(outcomes))[payload.hasura_id]
+
+        if self.jobs is None:
+            return await wait_for_study()
+        self.jobs.watch(
+            payload.hasura_id,
+            event_log.continue_in(wait_for_study),
+            credential_digest(authorization),
+        )
+        return self._accepted(payload.hasura_id)
+
+    def job_status(self, hasura_id: str, authorization: str) -> Optional[JobStatus]:
+        """
+        Get the status of an asynchronous job, if it was submitted using the same ``authorization``.
+        """
+        if self.jobs is None:
+            return None
+        return self.jobs.status(hasura_id, credential_digest(authorization))
+
+    async def _process_study(
+        self, key: tuple, members: list["_StudyMember"]
+    ) -> dict[str, Outcome]:
+        """
+        Create one analysis of all the matching series of a study.
+        """
+        authorization = key[0]
+        with metrics.EVENTS_IN_PROGRESS.track_inprogress():
+            outcomes = await _process_study(self._actions(authorization), members)
+        for member, (status_code, body) in zip(members, outcomes):
+            metrics.EVENT_OUTCOMES.labels(status_code).inc()
+            if isinstance(body, CreatedFeed):
+                await self.idempotency.put(
+                    member.payload.hasura_id, member.series_fingerprint, body
+                )
+        return {
+            member.payload.hasura_id: outcome
+            for member, outcome in zip(members, outcomes)
+        }
+
+    def _actions(self, authorization: str) -> ClientActions:
+        return ClientActions(
+            auth=authorization,
+            host=self.settings.get_host(),
+            clients=self.clients,
+            flights=self.flights,
+            partial_results=self.partial_results,
+        )
+
+    def _accepted(self, hasura_id: str) -> Outcome:
+        return status.HTTP_202_ACCEPTED, JobAccepted(
+            hasura_id=hasura_id, status=self._job_url(hasura_id)
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class _StudyMember:
+    """
+    A series which is buffered until the other series of its study are received.
+    """
+
+    payload: DicomSeriesPayload
+    matcher: Matcher
+    series_fingerprint: str
+
+
+@dataclasses.dataclass(frozen=True)
+class _EventProcessor:
+    """
+    Create the analysis of a DICOM series if it matches, and record the created feed.
+    """
+
+    actions: ClientActions
+    payload: DicomSeriesPayload
+    matcher: Matcher
+    idempotency: IdempotencyStore
+    series_fingerprint: str
+
+    async def __call__(self) -> tuple[int, CreatedFeed | BadRequestResponse | None]:
+        """
+        :return: HTTP status code and response body
+        """
+        with metrics.EVENTS_IN_PROGRESS.track_inprogress():
+            status_code, body = await _process_event(
+                self.actions, self.payload, self.matcher
+            )
+        metrics.EVENT_OUTCOMES.labels(status_code).inc()
+        if isinstance(body, CreatedFeed):
+            await self.idempotency.put(
+                self.payload.hasura_id, self.series_fingerprint, body
+            )
+        return status_code, body
+
+
+async def _process_event(
+    actions: ClientActions, payload: DicomSeriesPayload, matcher: Matcher
+) -> tuple[int, CreatedFeed | BadRequestResponse | None]:
+    """
+    Create the analysis of a DICOM series if it matches.
+
+    If *CUBE* is down, 503 is returned so that the event is retried later.
+    An analysis which failed part way is resumed when the event is retried.
+
+    :return: HTTP status code and response body
+    """
+    resolved = await _resolve_and_match(actions, payload, matcher)
+    if isinstance(resolved, tuple):
+        return resolved
+    return await _create_analysis(actions, [resolved], payload)
+
+
+async def _process_study(
+    actions: ClientActions, members: Sequence[_StudyMember]
+) -> list[tuple[int, CreatedFeed | BadRequestResponse | None]]:
+    """
+    Create one analysis of all the series of a study which match.
+
+    :return: HTTP status code and response body for every series
+    """
+    resolved = await asyncio.gather(
+        *(_resolve_and_match(actions, m.payload, m.matcher) for m in members)
+    )
+    matched = [r for r in resolved if not isinstance(r, tuple)]
+    if len(matched) == 0:
+        return resolved
+    outcome = await _create_analysis(actions, matched, members[0].payload)
+    return [r if isinstance(r, tuple) else outcome for r in resolved]
+
+
+async def _resolve_and_match(
+    actions: ClientActions, payload: DicomSeriesPayload, matcher: Matcher
+) -> ResolvedPacsSeries | tuple[int, BadRequestResponse | None]:
+    """
+    :return: the resolved series if it matches, otherwise HTTP status code and response body
+    """
+    try:
+        resolved = await actions.resolve_series(payload.data)
+        with metrics.STAGE_DURATION.labels("match").time():
+            matched = matcher.postmatch(resolved)
+        if matched and matcher.needs_header:
+            header = await actions.get_dicom_header(resolved)
+            with metrics.STAGE_DURATION.labels("match").time():
+                matched = matcher.match_header(header)
+    except (UnauthorizedException, ForbiddenException) as e:
+        return e.status, None
+    except NotFoundException:
+        return status.HTTP_400_BAD_REQUEST, BadRequestResponse(
+            error="DICOM series not found", data=payload.data
+        )
+    except (CircuitOpenError, *TRANSIENT_ERRORS):
+        logger.exception("Could not resolve series id=%d", payload.data.id)
+        return status.HTTP_503_SERVICE_UNAVAILABLE, None
+
+    event_log.record_match(matched)
+    if not matched:
+        return status.HTTP_204_NO_CONTENT, None
+    return resolved
+
+
+async def _create_analysis(
+    actions: ClientActions,
+    series: Sequence[ResolvedPacsSeries],
+    payload: DicomSeriesPayload,
+) -> tuple[int, CreatedFeed | BadRequestResponse | None]:
+    try:
+        feed_url = await actions.create_analysis(
+            series, payload.jobs, payload.feed_name_template
+        )
+    except InvalidRunnablesError as e:
+        return status.HTTP_400_BAD_REQUEST, BadRequestResponse(
+            error="Invalid runnables", data=InvalidRunnableList(errors=e.runnables)
+        )
+    except (UnauthorizedException, ForbiddenException) as e:
+        return e.status, None
+    except (CircuitOpenError, *TRANSIENT_ERRORS):
+        logger.exception("Could not create analysis of series id=%d", payload.data.id)
+        return status.HTTP_503_SERVICE_UNAVAILABLE, None
+
+    return status.HTTP_201_CREATED, CreatedFeed(feed=feed_url)
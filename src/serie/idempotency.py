@@ -0,0 +1,137 @@
+import abc
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Optional
+
+from serie.models import ChrisRunnableRequest, CreatedFeed
+
+
+class IdempotencyStore(abc.ABC):
+    """
+    Records which events were already handled, so that redelivered or replayed
+    events do not create duplicate feeds.
+
+    Feeds are recorded under two keys: the ID of the event from Hasura, and a
+    fingerprint of the series and jobs (see :func:`fingerprint`).
+    """
+
+    @abc.abstractmethod
+    async def get(self, event_id: str, series_fingerprint: str) -> Optional[CreatedFeed]:
+        """
+        Get the feed previously created for either the event or the fingerprint.
+        """
+        ...
+
+    @abc.abstractmethod
+    async def put(self, event_id: str, series_fingerprint: str, feed: CreatedFeed):
+        """
+        Record the feed created for an event.
+        """
+        ...
+
+    async def close(self):
+        pass
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    An :class:`IdempotencyStore` which remembers the most recent events in memory.
+    Only suitable when *SERIE* runs as a single process.
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self._maxsize = maxsize
+        self._feeds: OrderedDict[str, CreatedFeed] = OrderedDict()
+
+    async def get(self, event_id: str, series_fingerprint: str) -> Optional[CreatedFeed]:
+        for key in (_event_key(event_id), _series_key(series_fingerprint)):
+            feed = self._feeds.get(key, None)
+            if feed is not None:
+                self._feeds.move_to_end(key)
+                return feed
+        return None
+
+    async def put(self, event_id: str, series_fingerprint: str, feed: CreatedFeed):
+        for key in (_event_key(event_id), _series_key(series_fingerprint)):
+            self._feeds[key] = feed
+            self._feeds.move_to_end(key)
+        while len(self._feeds) > self._maxsize:
+            self._feeds.popitem(last=False)
+
+
+class SqliteIdempotencyStore(IdempotencyStore):
+    """
+    An :class:`IdempotencyStore` backed by a SQLite database file, which can be
+    shared by several *SERIE* worker processes on the same host.
+    """
+
+    def __init__(self, path: str | Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS serie_feeds ("
+                "key TEXT PRIMARY KEY, feed TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    async def get(self, event_id: str, series_fingerprint: str) -> Optional[CreatedFeed]:
+        return await asyncio.to_thread(self._get, event_id, series_fingerprint)
+
+    async def put(self, event_id: str, series_fingerprint: str, feed: CreatedFeed):
+        await asyncio.to_thread(self._put, event_id, series_fingerprint, feed)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _get(self, event_id: str, series_fingerprint: str) -> Optional[CreatedFeed]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT feed FROM serie_feeds WHERE key IN (?, ?) LIMIT 1",
+                (_event_key(event_id), _series_key(series_fingerprint)),
+            ).fetchone()
+        return None if row is None else CreatedFeed(feed=row[0])
+
+    def _put(self, event_id: str, series_fingerprint: str, feed: CreatedFeed):
+        now = time.time()
+        rows = [
+            (_event_key(event_id), str(feed.feed), now),
+            (_series_key(series_fingerprint), str(feed.feed), now),
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO serie_feeds (key, feed, created) VALUES (?, ?, ?)",
+                rows,
+            )
+
+
+def fingerprint(
+    series_instance_uid: str,
+    jobs: Sequence[ChrisRunnableRequest],
+    auth: Optional[str] = None,
+) -> str:
+    """
+    Compute a fingerprint of a series and the set of jobs to run on it.
+
+    The credentials are included so that a feed created by one user is never
+    returned to another.
+    """
+    job_set = sorted(json.dumps(job.model_dump(), sort_keys=True) for job in jobs)
+    canonical = json.dumps([series_instance_uid, job_set, auth])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _event_key(event_id: str) -> str:
+    return f"event:{event_id}"
+
+
+def _series_key(series_fingerprint: str) -> str:
+    return f"series:{series_fingerprint}"
@@ -0,0 +1,172 @@
+import asyncio
+import dataclasses
+import logging
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Optional
+
+from pydantic import BaseModel
+
+from serie.models import JobState, JobStatus
+
+logger = logging.getLogger(__name__)
+
+JobFunction = Callable[[], Awaitable[tuple[int, Optional[BaseModel]]]]
+"""
+The work of a job. Returns an HTTP status code and response body.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class _Entry:
+    status: JobStatus
+    owner: Optional[str]
+    """Digest of the credentials of whoever submitted the job."""
+
+
+class JobQueue:
+    """
+    A bounded queue of jobs which are processed by a pool of in-process workers.
+
+    Workers are started when the first job is submitted.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(self, workers: int = 8, maxsize: int = 1000, history: int = 10000):
+        """
+        :param workers: number of jobs to process concurrently
+        :param maxsize: maximum number of jobs waiting to be processed
+        :param history: maximum number of job statuses to remember
+        """
+        self._num_workers = workers
+        self._queue: asyncio.Queue[tuple[str, JobFunction, Optional[str]]] = (
+            asyncio.Queue(maxsize)
+        )
+        self._history = history
+        self._statuses: OrderedDict[str, _Entry] = OrderedDict()
+        self._workers: list[asyncio.Task] = []
+        self._watched: set[asyncio.Task] = set()
+        self._closed = False
+
+    def submit(self, job_id: str, fn: JobFunction, owner: Optional[str] = None) -> bool:
+        """
+        Submit a job. If a job with the same ID was already submitted, nothing is
+        done, unless it failed or finished with ``503``, see :meth:`accepts`.
+
+        :param owner: digest of the credentials which may get the status of the job
+        :return: False if the queue is full or closed
+        """
+        if not self.accepts(job_id):
+            return True
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait((job_id, fn, owner))
+        except asyncio.QueueFull:
+            return False
+        self._set_status(JobStatus(hasura_id=job_id, state=JobState.queued), owner)
+        self._start_workers()
+        return True
+
+    def watch(self, job_id: str, fn: JobFunction, owner: Optional[str] = None) -> bool:
+        """
+        Record the status of a job which waits for work done outside of the queue,
+        e.g. by :class:`serie.study_groups.StudyGrouper`. It does not occupy a worker.
+
+        :return: False if the queue is closed
+        """
+        if not self.accepts(job_id):
+            return True
+        if self._closed:
+            return False
+        self._set_status(JobStatus(hasura_id=job_id, state=JobState.queued), owner)
+        task = asyncio.create_task(self._run(job_id, fn, owner))
+        self._watched.add(task)
+        task.add_done_callback(self._watched.discard)
+        return True
+
+    @property
+    def closed(self) -> bool:
+        """
+        Whether jobs are no longer accepted, see :meth:`close`.
+        """
+        return self._closed
+
+    def accepts(self, job_id: str) -> bool:
+        """
+        Whether a job with this ID would be run if it were submitted: it is unknown,
+        or it failed or finished with ``503``, so that its event can be sent again.
+        """
+        entry = self._statuses.get(job_id, None)
+        if entry is None:
+            return True
+        return entry.status.state == JobState.failed or entry.status.status_code == 503
+
+    def status(self, job_id: str, owner: Optional[str] = None) -> Optional[JobStatus]:
+        """
+        Get the status of a job, or ``None`` if it is unknown or was submitted by another owner.
+        """
+        entry = self._statuses.get(job_id, None)
+        if entry is None or entry.owner != owner:
+            return None
+        return entry.status
+
+    async def close(self, timeout: float = 30.0):
+        """
+        Stop accepting jobs, and wait up to ``timeout`` seconds for the submitted
+        jobs to finish. Jobs which are still not finished are abandoned and logged,
+        so that their events can be sent again.
+        """
+        self._closed = True
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(self._queue.join(), *self._watched), timeout
+            )
+        except asyncio.TimeoutError:
+            pass
+        for job_id, entry in self._statuses.items():
+            if entry.status.state in (JobState.queued, JobState.running):
+                logger.error("Abandoned job %s, its event must be sent again", job_id)
+        for task in (*self._workers, *self._watched):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._watched, return_exceptions=True)
+        self._workers.clear()
+
+    def _start_workers(self):
+        while len(self._workers) < self._num_workers:
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def _work(self):
+        while True:
+            job_id, fn, owner = await self._queue.get()
+            try:
+                await self._run(job_id, fn, owner)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, fn: JobFunction, owner: Optional[str]):
+        self._set_status(JobStatus(hasura_id=job_id, state=JobState.running), owner)
+        try:
+            status_code, result = await fn()
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self._set_status(
+                JobStatus(hasura_id=job_id, state=JobState.failed, error=str(e)), owner
+            )
+            return
+        self._set_status(
+            JobStatus(
+                hasura_id=job_id,
+                state=JobState.finished,
+                status_code=status_code,
+                result=result,
+            ),
+            owner,
+        )
+
+    def _set_status(self, status: JobStatus, owner: Optional[str]):
+        self._statuses[status.hasura_id] = _Entry(status, owner)
+        self._statuses.move_to_end(status.hasura_id)
+        while len(self._statuses) > self._history:
+            self._statuses.popitem(last=False)
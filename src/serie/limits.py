@@ -0,0 +1,113 @@
+import asyncio
+import contextlib
+import math
+import time
+from collections.abc import AsyncIterator
+from typing import Optional
+
+from serie import metrics
+
+
+class RequestLimiter:
+    """
+    Limits the number of outstanding requests to *CUBE*, per host and per credentials,
+    so that a burst of events does not overwhelm *CUBE*.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(self, per_host: int = 64, per_credential: int = 16):
+        """
+        :param per_host: maximum number of outstanding requests to a host
+        :param per_credential: maximum number of outstanding requests to a host using the same credentials
+        """
+        self._per_host = per_host
+        self._per_credential = per_credential
+        self._hosts: dict[str, asyncio.Semaphore] = {}
+        self._credentials: dict[tuple[str, Optional[str]], asyncio.Semaphore] = {}
+
+    @contextlib.asynccontextmanager
+    async def limit(self, host: str, auth: Optional[str]) -> AsyncIterator[None]:
+        """
+        Wait until a request to ``host`` using ``auth`` may be made.
+        """
+        # the narrower limit is acquired first, so that requests which are waiting
+        # for their credentials' turn do not hold slots of the host.
+        credential = _get_semaphore(self._credentials, (host, auth), self._per_credential)
+        async with credential, _get_semaphore(self._hosts, host, self._per_host):
+            yield
+
+
+def _get_semaphore(semaphores: dict, key, value: int) -> asyncio.Semaphore:
+    semaphore = semaphores.get(key, None)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(value)
+        semaphores[key] = semaphore
+    return semaphore
+
+
+class Overloaded(Exception):
+    """
+    Too many requests are waiting to be handled.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+        """Suggested number of seconds to wait before retrying."""
+
+
+class AdmissionController:
+    """
+    Sheds load when *SERIE* is handling more events than it can keep up with.
+
+    At most ``max_concurrent`` requests are handled at a time. Others wait in a
+    queue, unless it is longer than ``max_queue``, or until they have waited for
+    ``max_wait`` seconds, in which case they are rejected with :class:`Overloaded`.
+    Rejected requests should be retried after :attr:`Overloaded.retry_after`,
+    which is estimated from the recent durations of requests.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(
+        self, max_concurrent: int = 64, max_queue: int = 256, max_wait: float = 10.0
+    ):
+        self._max_concurrent = max_concurrent
+        self._max_queue = max_queue
+        self._max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._mean_duration = 1.0
+        """Exponentially weighted moving average of the durations of requests."""
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """
+        Wait for a turn to handle a request.
+
+        :raises Overloaded: if the request should be retried later
+        """
+        if self._semaphore.locked() and self._waiting >= self._max_queue:
+            raise self._reject("queue")
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject("wait") from None
+        finally:
+            self._waiting -= 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+            duration = time.monotonic() - start
+            self._mean_duration += 0.1 * (duration - self._mean_duration)
+
+    def _reject(self, reason: str) -> Overloaded:
+        metrics.ADMISSIONS_REJECTED.labels(reason).inc()
+        # time for the queue to drain
+        drain = self._mean_duration * (self._waiting + 1) / self._max_concurrent
+        return Overloaded(reason, max(1, math.ceil(drain)))
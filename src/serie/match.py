@@ -1,21 +1,245 @@
+import dataclasses
 import re
-from collections.abc import Sequence
+import re._parser as sre_parse  # noqa
+from collections.abc import Mapping, Sequence
 
-from aiochris_oag import PACSSeries
-from serie.dicom_series_metadata import DicomSeriesMetadata
-from serie.models import DicomSeriesMatcher
+from serie.dicom_series_metadata import DicomSeriesMetadata, DicomSeriesMetadataName
+from serie.models import DicomSeriesMatcher, RawPacsSeries
+from serie.resolved_pacs_series import ResolvedPacsSeries
 
+RESOLVED_ONLY_TAGS = frozenset(
+    {DicomSeriesMetadataName.pacs_identifier, DicomSeriesMetadataName.series_dir}
+)
+"""
+Tags which are not found in :class:`RawPacsSeries`, and can only be matched on
+after the series is resolved using the *CUBE* API.
+"""
 
-def is_match(series: PACSSeries, conditions: Sequence[DicomSeriesMatcher]) -> bool:
+
+@dataclasses.dataclass(frozen=True)
+class CompiledCondition:
+    """
+    A :class:`DicomSeriesMatcher` prepared for fast evaluation.
+    """
+
+    tag: DicomSeriesMetadataName | str
+    """
+    A :class:`DicomSeriesMetadataName`, or the keyword of a DICOM header tag.
+    """
+    regex: re.Pattern
+    """
+    The regular expression, with :data:`re.IGNORECASE` if the condition is not case-sensitive.
+    """
+    required: tuple[str, ...]
+    """
+    Substrings which every matching value must contain. Lowercase if ``ignore_case``,
+    in which case they are only checked in ASCII values.
+    """
+    ignore_case: bool
+    key: str
+    """
+    The name of the tag, as a key of :class:`DicomSeriesMetadata` or of the DICOM header.
+    """
+
+    @property
+    def is_header(self) -> bool:
+        """
+        Whether the tag is only found in the DICOM header, see :mod:`serie.dicom_header`.
+        """
+        return not isinstance(self.tag, DicomSeriesMetadataName)
+
+    @classmethod
+    def compile(cls, condition: DicomSeriesMatcher) -> "CompiledCondition":
+        regex = condition.regex
+        if not condition.case_sensitive:
+            regex = re.compile(regex.pattern, regex.flags | re.IGNORECASE)
+        ignore_case = bool(regex.flags & re.IGNORECASE)
+        required = required_literals(regex)
+        if ignore_case:
+            # str.lower is not equivalent to re.IGNORECASE for non-ASCII characters
+            required = tuple(s.lower() for s in required if s.isascii())
+        key = condition.tag if isinstance(condition.tag, str) else condition.tag.value
+        return cls(condition.tag, regex, required, ignore_case, key)
+
+    def __call__(self, metadata: DicomSeriesMetadata | Mapping[str, str]) -> bool:
+        value = metadata.get(self.key, None)
+        if value is None:
+            return False
+        value = str(value)
+        # re.IGNORECASE matches e.g. "ſ" to "s", but str.lower does not,
+        # so required substrings are not checked in other values.
+        if self.required and (not self.ignore_case or value.isascii()):
+            haystack = value.lower() if self.ignore_case else value
+            if not all(s in haystack for s in self.required):
+                return False
+        return self.regex.fullmatch(value) is not None
+
+    def cost(self) -> tuple[int, int, int]:
+        """
+        Sort key for evaluating conditions which are cheap and likely to fail first.
+        """
+        longest = max((len(s) for s in self.required), default=0)
+        return 0 if self.required else 1, -longest, len(self.regex.pattern)
+
+
+class Matcher:
+    """
+    A compiled list of :class:`DicomSeriesMatcher`, joined by AND.
+
+    Conditions are evaluated in order of :meth:`CompiledCondition.cost` and
+    evaluation stops at the first condition which fails.
+    """
+
+    def __init__(self, conditions: Sequence[DicomSeriesMatcher]):
+        compiled = sorted(
+            map(CompiledCondition.compile, conditions), key=CompiledCondition.cost
+        )
+        self.conditions: tuple[CompiledCondition, ...] = tuple(compiled)
+        self._raw = tuple(
+            c for c in compiled if not c.is_header and c.tag not in RESOLVED_ONLY_TAGS
+        )
+        self._resolved_only = tuple(c for c in compiled if c.tag in RESOLVED_ONLY_TAGS)
+        self._header = tuple(c for c in compiled if c.is_header)
+
+    def __call__(self, metadata: DicomSeriesMetadata) -> bool:
+        """
+        :return: True if the series matches the conditions
+        """
+        return all(cond(metadata) for cond in self.conditions)
+
+    def prematch(self, data: RawPacsSeries) -> bool:
+        """
+        Evaluate the conditions which can be checked using only the row from the database.
+        Conditions on tags in :data:`RESOLVED_ONLY_TAGS` and on DICOM header tags are skipped.
+
+        :return: False if the series definitely does not match the conditions
+        """
+        return self.prematch_metadata(data.to_dicom_metadata())
+
+    def prematch_metadata(self, metadata: DicomSeriesMetadata) -> bool:
+        """
+        Like :meth:`prematch`, for metadata which was already gotten from the row.
+        """
+        return all(cond(metadata) for cond in self._raw)
+
+    @property
+    def needs_header(self) -> bool:
+        """
+        Whether there are conditions on DICOM header tags, see :meth:`match_header`.
+        """
+        return len(self._header) > 0
+
+    def match_header(self, header: Mapping[str, str]) -> bool:
+        """
+        Evaluate the conditions on DICOM header tags, see :mod:`serie.dicom_header`.
+        """
+        return all(cond(header) for cond in self._header)
+
+    def postmatch(self, resolved: ResolvedPacsSeries) -> bool:
+        """
+        Evaluate the conditions which were skipped by :meth:`prematch`,
+        except for the conditions on DICOM header tags.
+        """
+        if len(self._resolved_only) == 0:
+            return True
+        metadata = resolved.to_dicom_metadata()
+        return all(cond(metadata) for cond in self._resolved_only)
+
+
+def compile_matcher(conditions: Sequence[DicomSeriesMatcher]) -> Matcher:
+    """
+    Compile conditions into a reusable :class:`Matcher`.
+    """
+    return Matcher(conditions)
+
+
+def literal_prefix(pattern: re.Pattern) -> str:
+    """
+    Get the literal string which every match of ``pattern`` must start with.
+    Returns an empty string if the pattern does not start with a literal.
+    """
+    parsed = _parse(pattern)
+    if parsed is None:
+        return ""
+    prefix, _ = _leading_literals(parsed)
+    return prefix
+
+
+def required_literals(pattern: re.Pattern) -> tuple[str, ...]:
     """
-    :return: True if the series matches the conditions
+    Get literal strings which every match of ``pattern`` must contain, longest first.
+
+    E.g. every match of ``.*(Chest CT).*`` contains "Chest CT".
+    """
+    parsed = _parse(pattern)
+    if parsed is None:
+        return ()
+    runs: list[str] = []
+    _collect_literal_runs(parsed, runs)
+    longest_first = sorted(dict.fromkeys(filter(None, runs)), key=len, reverse=True)
+    required: list[str] = []
+    for run in longest_first:
+        # a run which is a substring of a longer run is redundant
+        if not any(run in longer for longer in required):
+            required.append(run)
+    return tuple(required)
+
+
+def _parse(pattern: re.Pattern):
+    try:
+        return sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        # re._parser is private, so don't let changes to it break matching
+        return None
+
+
+def _is_plain_group(op, av) -> bool:
+    """
+    Whether a parsed item is a group without any inline flags, e.g. ``(abc)``.
     """
-    return all(_matches(cond, series.to_dict()) for cond in conditions)
+    return op is sre_parse.SUBPATTERN and av[1] == 0 and av[2] == 0
 
 
-def _matches(condition: DicomSeriesMatcher, series_dict: DicomSeriesMetadata) -> bool:
-    if condition.tag.value not in series_dict:
-        return False
-    value = series_dict[condition.tag.value]
-    flag = re.IGNORECASE if condition.case_sensitive else re.NOFLAG
-    return condition.regex.fullmatch(value) is not None
+def _leading_literals(items) -> tuple[str, bool]:
+    """
+    :return: the leading literal characters of a parsed regex, and whether the
+             entire regex is literal characters
+    """
+    chars = []
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars.append(chr(av))
+        elif _is_plain_group(op, av):
+            inner, complete = _leading_literals(av[3])
+            chars.append(inner)
+            if not complete:
+                return "".join(chars), False
+        else:
+            return "".join(chars), False
+    return "".join(chars), True
+
+
+def _collect_literal_runs(items, runs: list[str]):
+    """
+    Append to ``runs`` the sequences of consecutive literal characters which
+    are required by a parsed regex.
+    """
+    current = []
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            current.append(chr(av))
+            continue
+        if _is_plain_group(op, av):
+            inner, complete = _leading_literals(av[3])
+            if complete:
+                current.append(inner)
+                continue
+            runs.append("".join(current))
+            current = []
+            _collect_literal_runs(av[3], runs)
+            continue
+        runs.append("".join(current))
+        current = []
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            _collect_literal_runs(av[2], runs)
+    runs.append("".join(current))
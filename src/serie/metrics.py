@@ -0,0 +1,70 @@
+"""
+Prometheus metrics of *SERIE*, served at ``/metrics``.
+
+Metrics are only aggregated in memory when they are recorded, and are only
+serialized when ``/metrics`` is scraped.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_DURATION = Histogram(
+    "serie_stage_duration_seconds",
+    "Duration of each stage of handling a DICOM series event.",
+    ["stage"],
+)
+"""
+Stages are: ``validate``, ``resolve_series``, ``dicom_header``, ``match``, ``get_runnables``,
+``dircopy``, ``set_feed_name``, ``unstack``, ``plugin`` and ``pipeline``.
+"""
+
+EVENT_OUTCOMES = Counter(
+    "serie_event_outcomes_total",
+    "Number of handled DICOM series events by HTTP status code.",
+    ["status_code"],
+)
+
+CATALOG_LOOKUPS = Counter(
+    "serie_catalog_lookups_total",
+    "Number of lookups of cached plugins, plugin parameters, pipelines, series and DICOM headers by whether they were cached.",
+    ["kind", "result"],
+)
+"""
+Kind is ``plugin``, ``plugin_parameters``, ``pipeline``, ``series`` or ``dicom_header``. Result is ``hit``, ``stale`` or ``miss``.
+"""
+
+CUBE_CALLS_RETRIED = Counter(
+    "serie_cube_calls_retried_total",
+    "Number of calls to CUBE which were retried after a transient error.",
+)
+
+CUBE_CALLS_REJECTED = Counter(
+    "serie_cube_calls_rejected_total",
+    "Number of calls to CUBE which were not attempted because its circuit breaker was open.",
+)
+
+ADMISSIONS_REJECTED = Counter(
+    "serie_admissions_rejected_total",
+    "Number of requests which were rejected with 503 because too many requests were waiting.",
+    ["reason"],
+)
+"""
+Reason is ``queue`` if too many requests were waiting, or ``wait`` if the request waited for too long.
+"""
+
+REQUESTS_IN_PROGRESS = Gauge(
+    "serie_requests_in_progress",
+    "Number of HTTP requests which are being handled.",
+    ["handler"],
+)
+
+EVENTS_IN_PROGRESS = Gauge(
+    "serie_events_in_progress",
+    "Number of matched DICOM series events which are being processed.",
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """
+    Record the duration of a stage. An index suffix, e.g. ``plugin[2]``, is removed.
+    """
+    STAGE_DURATION.labels(stage.partition("[")[0]).observe(seconds)
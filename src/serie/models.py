@@ -1,19 +1,26 @@
+import datetime
+import enum
 import re
 from collections.abc import Sequence
-from typing import Literal, Optional, Any
+from typing import Annotated, Literal, Optional, Any
 
 from pydantic import (
+    AfterValidator,
     BaseModel,
     ConfigDict,
     NonNegativeInt,
     NonNegativeFloat,
     PastDatetime,
+    PositiveFloat,
     Field,
-    HttpUrl
+    HttpUrl,
+    ModelWrapValidatorHandler,
+    model_validator,
 )
 
 from aiochris_oag import PatientSexEnum
-from serie.dicom_series_metadata import DicomSeriesMetadataName
+from serie.dicom_series_metadata import DicomSeriesMetadataName, DicomSeriesMetadata
+from serie.metrics import STAGE_DURATION
 
 
 class RawPacsSeries(BaseModel):
@@ -41,34 +48,92 @@ class RawPacsSeries(BaseModel):
     folder_id: NonNegativeInt
     pacs_id: NonNegativeInt
 
+    def to_dicom_metadata(self) -> DicomSeriesMetadata:
+        """
+        Get the metadata which is available from the row itself.
+
+        ``pacs_identifier`` and ``series_dir`` are not columns of the
+        ``pacsfiles_pacsseries`` table, so they are absent from the returned value.
+        """
+        return DicomSeriesMetadata(
+            PatientID=self.patient_id,
+            PatientName=self.patient_name,
+            PatientBirthDate=_isodate(self.patient_birth_date),
+            PatientSex=None if self.patient_sex is None else self.patient_sex.value,
+            StudyDate=_isodate(self.study_date),
+            AccessionNumber=self.accession_number,
+            Modality=self.modality,
+            ProtocolName=self.protocol_name,
+            StudyInstanceUID=self.study_instance_uid,
+            StudyDescription=self.study_description,
+            SeriesInstanceUID=self.series_instance_uid,
+            SeriesDescription=self.series_description,
+        )
+
+
 
 class ChrisRunnableRequest(BaseModel):
     """
-    Identifying details of a _ChRIS_ plugin.
+    Identifying details of a _ChRIS_ plugin or pipeline.
 
-    (Only plugins supported for now. Support for pipelines is a potential future feature.)
+    A pipeline is created as a single workflow, which is fewer requests to *CUBE*
+    than creating each of its plugin instances one at a time.
     """
 
     model_config = ConfigDict(frozen=True)
 
-    runnable_type: Literal["plugin"] = Field(
+    runnable_type: Literal["plugin", "pipeline"] = Field(
         alias="type", title="Type of runnable", default="plugin"
     )
-    name: str = Field(title="Plugin name", examples=["pl-dylld", "pl-dcm2niix"])
+    name: str = Field(
+        title="Plugin or pipeline name",
+        examples=["pl-dylld", "pl-dcm2niix", "Leg Length Discrepency inference"],
+    )
     version: Optional[str] = Field(
-        title="Plugin version", examples=["1.2.3"], default=None
+        title="Plugin version (pipelines do not have versions)",
+        examples=["1.2.3"],
+        default=None,
     )
     params: dict[str, int | float | bool | str] = Field(
         title="Plugin parameters", default_factory=dict
     )
 
 
+def _check_dicom_keyword(keyword: str) -> str:
+    from serie.dicom_header import is_dicom_keyword
+
+    try:
+        valid = is_dicom_keyword(keyword)
+    except ImportError:
+        raise ValueError(
+            "matching on DICOM header tags requires pydicom, "
+            "install it using `pip install serie[dicom]`"
+        )
+    if not valid:
+        raise ValueError(f"{keyword} is not a DICOM keyword")
+    return keyword
+
+
+DicomKeyword = Annotated[str, AfterValidator(_check_dicom_keyword)]
+"""
+Keyword of any tag of the DICOM data dictionary, e.g. ``BodyPartExamined``.
+"""
+
+
 class DicomSeriesMatcher(BaseModel):
     """
     A regular expression to be applied to a DICOM series metadata field.
     """
 
-    tag: DicomSeriesMetadataName = Field(title="Tag of field to match")
+    tag: DicomSeriesMetadataName | DicomKeyword = Field(
+        title="Tag of field to match",
+        description=(
+            "Tags which are not stored by CUBE, e.g. BodyPartExamined, are read from "
+            "the header of one DICOM file of the series. Multiple values are joined "
+            "by a backslash, e.g. ORIGINAL\\PRIMARY."
+        ),
+        union_mode="left_to_right",
+    )
     regex: re.Pattern = Field(
         title="Regular expression matching the value", examples=[r".*(Chest CT).*"]
     )
@@ -77,7 +142,19 @@ class DicomSeriesMatcher(BaseModel):
     )
 
 
-class DicomSeriesPayload(BaseModel):
+class _TimedValidation(BaseModel):
+    """
+    Records the duration of validation as the ``validate`` stage of handling an event.
+    """
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _time_validation(cls, data: Any, handler: ModelWrapValidatorHandler):
+        with STAGE_DURATION.labels("validate").time():
+            return handler(data)
+
+
+class DicomSeriesPayload(_TimedValidation):
     """
     The payload sent from Hasura each time a row is inserted into the ``pacsfiles_pacsfile`` table.
     """
@@ -104,6 +181,94 @@ class DicomSeriesPayload(BaseModel):
             r'SERIE analysis: MRN="{PatientID}" description="{SeriesDescription}"'
         ],
     )
+    study_quiet_period: Optional[PositiveFloat] = Field(
+        default=None,
+        title="Create one feed per study",
+        description=(
+            "If set, matching series of the same study (StudyInstanceUID) are buffered until "
+            "no other series of the study was received for this many seconds, then one feed "
+            "is created with pl-dircopy over all of them. Requires ASYNC_JOBS."
+        ),
+        examples=[30.0],
+    )
+
+
+class RoutingRule(BaseModel):
+    """
+    Which analysis to run on which DICOM series.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    name: str = Field(title="Unique name of the rule", examples=["lld"])
+    match: Sequence[DicomSeriesMatcher] = Field(
+        title="Which DICOM series to include. Conditions are joined by AND."
+    )
+    jobs: Sequence[ChrisRunnableRequest] = Field(
+        title="Plugins or pipelines to run on the series data"
+    )
+    feed_name_template: str = Field(
+        title="Template for how to create the feed name",
+        description="See `DicomSeriesPayload.feed_name_template`",
+    )
+    study_quiet_period: Optional[PositiveFloat] = Field(
+        default=None,
+        title="Create one feed per study",
+        description="See `DicomSeriesPayload.study_quiet_period`",
+    )
+
+
+class RuleTable(BaseModel):
+    """
+    Contents of the file specified by the ``RULES_FILE`` setting.
+    """
+
+    rules: list[RoutingRule] = Field(title="Rules, evaluated against every DICOM series")
+
+    @model_validator(mode="after")
+    def _check_unique_names(self) -> "RuleTable":
+        # the name of a rule is part of the ID of its events, see serie.idempotency
+        names = [rule.name for rule in self.rules]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"rule names must be unique, duplicates: {duplicates}")
+        return self
+
+
+class DicomSeriesEvent(_TimedValidation):
+    """
+    The payload sent from Hasura each time a row is inserted into the ``pacsfiles_pacsseries`` table,
+    to be handled according to the rules of ``RULES_FILE``.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    hasura_id: str = Field(title="ID of event from Hasura")
+    data: RawPacsSeries = Field(title="The inserted DICOM file metadata")
+
+
+class DicomSeriesBatch(_TimedValidation):
+    """
+    Many rows of the ``pacsfiles_pacsseries`` table, to be handled using the same conditions and jobs.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    hasura_id: str = Field(
+        title="ID of the batch",
+        description="The event ID of each row is `{hasura_id}:{id}`",
+    )
+    data: list[RawPacsSeries] = Field(title="The inserted DICOM series metadata")
+    match: Sequence[DicomSeriesMatcher] = Field(
+        title="Which DICOM series to include. Conditions are joined by AND."
+    )
+    jobs: Sequence[ChrisRunnableRequest] = Field(
+        title="Plugins or pipelines to run on the series data"
+    )
+    feed_name_template: str = Field(
+        title="Template for how to create the feed name",
+        description="See `DicomSeriesPayload.feed_name_template`",
+    )
 
 
 class CreatedFeed(BaseModel):
@@ -139,3 +304,115 @@ class InvalidRunnableList(BaseModel):
 class BadRequestResponse(BaseModel):
     error: str = Field(title="Error message", examples=['error message'])
     data: Any = Field(examples=[{'id': 5}])
+
+
+class JobAccepted(BaseModel):
+    hasura_id: str = Field(title="ID of event from Hasura")
+    status: str = Field(
+        title="URL path where the status of the job can be checked",
+        examples=["/dicom_series/jobs/8765-4321"],
+    )
+
+
+class RuleOutcome(BaseModel):
+    """
+    What happened for a rule which matched a DICOM series.
+    """
+
+    rule: str = Field(title="Name of the rule")
+    status_code: int = Field(
+        title="HTTP status code which would have been returned by `/dicom_series/`",
+        examples=[201],
+    )
+    result: Optional[CreatedFeed | BadRequestResponse | JobAccepted] = Field(
+        default=None, title="Response body which would have been returned by `/dicom_series/`"
+    )
+
+
+class SeriesOutcome(BaseModel):
+    """
+    What happened for a DICOM series of a :class:`DicomSeriesBatch`.
+    """
+
+    id: int = Field(title="ID of the row of the pacsfiles_pacsseries table")
+    status_code: int = Field(
+        title="HTTP status code which would have been returned by `/dicom_series/`",
+        examples=[201, 204],
+    )
+    result: Optional[CreatedFeed | BadRequestResponse | JobAccepted] = Field(
+        default=None, title="Response body which would have been returned by `/dicom_series/`"
+    )
+
+
+class DryRunRequest(BaseModel):
+    """
+    Conditions to evaluate against the DICOM series which are already in *CUBE*,
+    e.g. the ``match`` of a :class:`DicomSeriesPayload`. Other fields are ignored.
+    """
+
+    match: Sequence[DicomSeriesMatcher] = Field(
+        title="Which DICOM series to include. Conditions are joined by AND."
+    )
+    since: Optional[datetime.datetime] = Field(
+        default=None, title="Only series created at or after this time"
+    )
+    until: Optional[datetime.datetime] = Field(
+        default=None, title="Only series created at or before this time, default: now"
+    )
+    sample_size: int = Field(
+        default=10, ge=0, le=1000, title="Maximum number of matching series to return"
+    )
+
+
+class DryRunResult(BaseModel):
+    """
+    How many DICOM series already in *CUBE* match the conditions of a :class:`DryRunRequest`.
+    """
+
+    scanned: int = Field(title="Number of series which were evaluated")
+    matched: int = Field(
+        title="Number of series which matched",
+        description="Conditions on the tags of `unevaluated` are not evaluated, "
+        "so series which match the other conditions are counted.",
+    )
+    sample: list[RawPacsSeries] = Field(title="The first series which matched")
+    unevaluated: list[str] = Field(
+        title="Tags of conditions which were not evaluated",
+        description="Tags which are not stored in the pacsfiles_pacsseries table, "
+        "e.g. SeriesDir or DICOM header tags, would need a request per series.",
+    )
+
+
+class JobState(enum.Enum):
+    """
+    State of an event which is processed asynchronously.
+    """
+
+    queued = "queued"
+    running = "running"
+    finished = "finished"
+    failed = "failed"
+
+
+class JobStatus(BaseModel):
+    """
+    Status of an event which is processed asynchronously.
+    """
+
+    hasura_id: str = Field(title="ID of event from Hasura")
+    state: JobState = Field(title="State of the job")
+    status_code: Optional[int] = Field(
+        default=None,
+        title="HTTP status code which would have been returned if the event were processed synchronously",
+        examples=[201],
+    )
+    result: Optional[CreatedFeed | BadRequestResponse] = Field(
+        default=None, title="Created feed or error response"
+    )
+    error: Optional[str] = Field(
+        default=None, title="Error message if the job failed unexpectedly"
+    )
+
+
+def _isodate(value: Optional[datetime.datetime]) -> Optional[str]:
+    return None if value is None else value.date().isoformat()
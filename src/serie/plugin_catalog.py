@@ -0,0 +1,197 @@
+import asyncio
+import dataclasses
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Iterable, Sequence
+from typing import Generic, Optional, Protocol, TypeVar
+
+from serie import event_log
+from serie.metrics import CATALOG_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogItem(Protocol):
+    """
+    A plugin or pipeline. (Pipelines do not have a version.)
+    """
+
+    name: str
+    creation_date: datetime.datetime
+
+
+T = TypeVar("T", bound=CatalogItem)
+
+PluginSpec = tuple[str, Optional[str]]
+"""
+Plugin (or pipeline) name and version. A version of ``None`` means the newest version.
+"""
+
+PluginKey = tuple[Hashable, str, Optional[str]]
+"""
+Scope (see :meth:`PluginCatalog.get_many`), plugin name, and plugin version.
+"""
+
+CatalogFetcher = Callable[[], Awaitable[Sequence[T]]]
+"""
+A function which lists every plugin (or pipeline) of a *CUBE*.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class _Entry(Generic[T]):
+    plugin: Optional[T]
+    fetched_at: float
+
+
+class PluginCatalog(Generic[T]):
+    """
+    A cache of plugins (or pipelines) found (or not found) in *CUBE*.
+
+    Instead of searching for plugins one at a time, the catalog of every plugin
+    in *CUBE* is listed once for all the plugins which are missing. Only the plugins
+    which were looked up are cached, so that the most used ones are not evicted
+    by the rest of a large catalog.
+
+    Entries are keyed by a scope, name and version. The scope is the host of *CUBE*,
+    and also the credentials if what they can see differs, e.g. for pipelines.
+
+    - A found plugin is fresh for ``ttl`` seconds. After that, it is served stale
+      for up to ``max_stale`` more seconds while the catalog is refreshed in the background.
+    - A plugin which was not found is remembered for ``negative_ttl`` seconds,
+      and is never served stale.
+    - Concurrent lookups which need to list the catalog of the same host share one listing.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        negative_ttl: float = 30.0,
+        max_stale: float = 3600.0,
+        maxsize: int = 1024,
+        kind: str = "plugin",
+    ):
+        """
+        :param kind: what is cached, used as a label of metrics
+        """
+        self._kind = kind
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_stale = max_stale
+        self._maxsize = maxsize
+        self._entries: OrderedDict[PluginKey, _Entry[T]] = OrderedDict()
+        self._loads: dict[str, asyncio.Task[dict[PluginKey, T]]] = {}
+
+    async def get_many(
+        self, scope: Hashable, specs: Sequence[PluginSpec], fetch: CatalogFetcher[T]
+    ) -> list[Optional[T]]:
+        """
+        Get plugins from the cache. If any of them are missing or expired,
+        the catalog is listed by calling ``fetch`` (at most once).
+
+        :param scope: what ``fetch`` lists the catalog of, e.g. the host of *CUBE*
+        """
+        keys = [(scope, name, version) for name, version in specs]
+        now = time.monotonic()
+        states = [self._lookup(key, now) for key in keys]
+        for state in (_FRESH, _STALE, _MISS):
+            if count := states.count(state):
+                CATALOG_LOOKUPS.labels(self._kind, state).inc(count)
+                event_log.record_cache(self._kind, state, count)
+        if any(state == _MISS for state in states):
+            # shielded so that a cancelled caller does not cancel the listing for others
+            index = await asyncio.shield(self._load(scope, fetch))
+            plugins = [index.get(key, None) for key in keys]
+            now = time.monotonic()
+            for key, plugin in zip(keys, plugins):
+                self._store(key, _Entry(plugin, now))
+            return plugins
+        if any(state == _STALE for state in states):
+            self._load(scope, fetch).add_done_callback(_log_refresh_error)
+        return [self._entries[key].plugin for key in keys]
+
+    def clear(self):
+        """
+        Forget all cached plugins and cancel background refreshes.
+        """
+        for task in self._loads.values():
+            task.cancel()
+        self._loads.clear()
+        self._entries.clear()
+
+    def _lookup(self, key: PluginKey, now: float) -> str:
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return _MISS
+        age = now - entry.fetched_at
+        if entry.plugin is None:
+            return _FRESH if age < self._negative_ttl else _MISS
+        self._entries.move_to_end(key)
+        if age < self._ttl:
+            return _FRESH
+        if age < self._ttl + self._max_stale:
+            return _STALE
+        return _MISS
+
+    def _load(
+        self, scope: Hashable, fetch: CatalogFetcher[T]
+    ) -> asyncio.Task[dict[PluginKey, T]]:
+        """
+        List the catalog and refresh the cached plugins. If the catalog of ``scope``
+        is already being listed, the in-flight task is returned instead.
+        """
+        task = self._loads.get(scope, None)
+        if task is None:
+            task = asyncio.create_task(self._fetch_and_refresh(scope, fetch))
+            self._loads[scope] = task
+            task.add_done_callback(lambda _: self._loads.pop(scope, None))
+        return task
+
+    async def _fetch_and_refresh(
+        self, scope: Hashable, fetch: CatalogFetcher[T]
+    ) -> dict[PluginKey, T]:
+        index = _index_catalog(scope, await fetch())
+        now = time.monotonic()
+        for key, plugin in index.items():
+            # plugins which were not looked up are left to whoever looks them up
+            if key in self._entries:
+                self._entries[key] = _Entry(plugin, now)
+        return index
+
+    def _store(self, key: PluginKey, entry: _Entry[T]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+
+_MISS = "miss"
+_STALE = "stale"
+_FRESH = "hit"
+
+
+def _index_catalog(scope: Hashable, plugins: Iterable[T]) -> dict[PluginKey, T]:
+    """
+    Index plugins by name and version. Each plugin is also indexed with a version
+    of ``None`` if it is the newest version of its name.
+    """
+    index: dict[PluginKey, T] = {}
+    for plugin in plugins:
+        version = getattr(plugin, "version", None)
+        if version is not None:
+            index[(scope, plugin.name, version)] = plugin
+        newest = index.get((scope, plugin.name, None), None)
+        if newest is None or plugin.creation_date > newest.creation_date:
+            index[(scope, plugin.name, None)] = plugin
+    return index
+
+
+def _log_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(
+            "Background refresh of plugin catalog failed", exc_info=task.exception()
+        )
@@ -0,0 +1,74 @@
+import dataclasses
+from collections.abc import Mapping
+
+from aiochris_oag import PluginParameter
+
+_TYPES: Mapping[str, tuple[type, ...]] = {
+    "string": (str,),
+    "path": (str,),
+    "unextpath": (str,),
+    "integer": (int,),
+    "float": (int, float),
+    "boolean": (bool,),
+}
+"""
+Python types of values which *CUBE* accepts for each type of plugin parameter.
+"""
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ParameterSpec:
+    """
+    The fields of a :class:`PluginParameter` which are needed to check a value for it.
+    """
+
+    name: str
+    type: str
+    required: bool
+
+    @classmethod
+    def from_api(cls, parameter: PluginParameter) -> "ParameterSpec":
+        return cls(
+            name=parameter.name,
+            type=parameter.type.value if parameter.type is not None else "string",
+            required=parameter.optional is False,
+        )
+
+
+ParameterSchema = Mapping[str, ParameterSpec]
+"""
+The parameters of a plugin by name.
+"""
+
+
+def check_params(
+    params: Mapping[str, int | float | bool | str], schema: ParameterSchema
+) -> list[str]:
+    """
+    Check the parameters of a plugin instance before it is created.
+
+    :return: why ``params`` are invalid, or an empty list if they are valid
+    """
+    problems = []
+    for name, value in params.items():
+        spec = schema.get(name, None)
+        if spec is None:
+            problems.append(f"`{name}` is not a valid parameter")
+        elif not _is_type(value, spec.type):
+            problems.append(
+                f"`{value}` is not a valid argument for parameter `{name}` of type {spec.type}"
+            )
+    for spec in schema.values():
+        if spec.required and spec.name not in params:
+            problems.append(f"parameter `{spec.name}` is required")
+    return problems
+
+
+def _is_type(value: int | float | bool | str, parameter_type: str) -> bool:
+    types = _TYPES.get(parameter_type, None)
+    if types is None:
+        return True
+    # bool is a subclass of int, but CUBE does not accept booleans for numbers
+    if isinstance(value, bool) and bool not in types:
+        return False
+    return isinstance(value, types)
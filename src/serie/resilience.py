@@ -0,0 +1,182 @@
+import asyncio
+import enum
+import random
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, Optional, TypeVar
+
+import aiohttp
+
+from aiochris_oag.exceptions import ServiceException
+from serie import metrics
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """
+    *CUBE* is failing, so calls to it are rejected without being attempted.
+    """
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit breaker for {host} is open")
+        self.host = host
+        self.retry_after = retry_after
+        """Number of seconds until a call will be attempted again."""
+
+
+TRANSIENT_ERRORS = (ServiceException, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+"""
+Errors from calling *CUBE* which might not happen again if the call is retried.
+"""
+
+
+def is_transient(e: BaseException) -> bool:
+    return isinstance(e, TRANSIENT_ERRORS)
+
+
+class _State(enum.Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Fails fast when *CUBE* is down.
+
+    After ``failure_threshold`` consecutive transient failures, the circuit opens
+    and calls are rejected with :class:`CircuitOpenError` for ``reset_timeout``
+    seconds. Then one trial call is let through: if it succeeds the circuit
+    closes, otherwise it opens again.
+    """
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self._host = host
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._state = _State.closed
+        self._failures = 0
+        self._opened_at = 0.0
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        self._before_call()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            if self._state is _State.half_open:
+                # the outcome of the trial call is unknown, so let another one through
+                self._state = _State.open
+            raise
+        except Exception as e:
+            if is_transient(e):
+                self._on_failure()
+            elif self._state is _State.half_open:
+                # the trial call did not fail because of CUBE being down
+                self._on_success()
+            raise
+        self._on_success()
+        return result
+
+    def _before_call(self):
+        if self._state is _State.closed:
+            return
+        elapsed = time.monotonic() - self._opened_at
+        if self._state is _State.open and elapsed >= self._reset_timeout:
+            self._state = _State.half_open
+            return
+        metrics.CUBE_CALLS_REJECTED.inc()
+        raise CircuitOpenError(self._host, max(self._reset_timeout - elapsed, 0.0))
+
+    def _on_success(self):
+        self._state = _State.closed
+        self._failures = 0
+
+    def _on_failure(self):
+        self._failures += 1
+        if self._state is _State.half_open or self._failures >= self._failure_threshold:
+            self._state = _State.open
+            self._opened_at = time.monotonic()
+
+
+class Resilience:
+    """
+    Wraps calls to *CUBE* with a circuit breaker per host. Reads, which are
+    idempotent, are also retried with exponential backoff and full jitter, so
+    that retries from many concurrent events are spread out.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base_delay: float = 0.1,
+        max_delay: float = 2.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        """
+        :param attempts: maximum number of attempts of a read
+        :param base_delay: maximum number of seconds to wait before the first retry
+        :param max_delay: maximum number of seconds to wait before any retry
+        :param failure_threshold: see :class:`CircuitBreaker`
+        :param reset_timeout: see :class:`CircuitBreaker`
+        """
+        self._attempts = attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host, None)
+        if breaker is None:
+            breaker = CircuitBreaker(host, self._failure_threshold, self._reset_timeout)
+            self._breakers[host] = breaker
+        return breaker
+
+    async def read(self, host: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call ``fn``, retrying it if it fails with a transient error.
+        """
+        breaker = self.breaker(host)
+        for attempt in range(self._attempts):
+            try:
+                return await breaker.call(fn)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if not is_transient(e) or attempt == self._attempts - 1:
+                    raise
+            metrics.CUBE_CALLS_RETRIED.inc()
+            ceiling = min(self._max_delay, self._base_delay * 2**attempt)
+            await asyncio.sleep(random.uniform(0, ceiling))
+        raise AssertionError("unreachable")
+
+    async def write(self, host: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call ``fn`` once. Writes are not retried, since they might have succeeded.
+        """
+        return await self.breaker(host).call(fn)
+
+
+class PartialResults:
+    """
+    Remembers the results of the operations of a :class:`serie.task_graph.TaskGraph`
+    which failed, so that when it is retried, the operations which succeeded are not
+    done again (e.g. a feed is resumed instead of being created again).
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._maxsize = maxsize
+        self._results: OrderedDict[Hashable, dict[str, Any]] = OrderedDict()
+
+    def pop(self, key: Hashable) -> Optional[dict[str, Any]]:
+        return self._results.pop(key, None)
+
+    def put(self, key: Hashable, results: dict[str, Any]):
+        self._results[key] = results
+        self._results.move_to_end(key)
+        while len(self._results) > self._maxsize:
+            self._results.popitem(last=False)
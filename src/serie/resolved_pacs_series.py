@@ -1,43 +1,94 @@
 import asyncio
-from typing import Optional
-
-from pydantic import BaseModel
+import dataclasses
+import datetime
+from collections.abc import Awaitable, Callable
+from typing import Any, Optional
 
 from aiochris_oag import PACSSeries, FileBrowserFolder, FilebrowserApi, ApiClient, PacsApi
 from serie.dicom_series_metadata import DicomSeriesMetadata
 from serie.models import RawPacsSeries
 
 
-class ResolvedPacsSeries(BaseModel):
-    series: PACSSeries
-    folder: FileBrowserFolder
+@dataclasses.dataclass(frozen=True, slots=True)
+class ResolvedPacsSeries:
+    """
+    The fields of a :class:`PACSSeries` and its :class:`FileBrowserFolder` which
+    are used by *SERIE*. They are copied out of the API models, so that cached
+    series do not keep the API models in memory.
+    """
+
+    series_id: int
+    folder_id: int
+    folder_path: str
+    patient_id: str
+    patient_name: Optional[str]
+    patient_birth_date: Optional[datetime.date]
+    patient_sex: Any
+    study_date: datetime.date
+    accession_number: Optional[str]
+    modality: Optional[str]
+    protocol_name: Optional[str]
+    study_instance_uid: str
+    study_description: Optional[str]
+    series_instance_uid: str
+    series_description: Optional[str]
+    pacs_identifier: str
+
+    @classmethod
+    def from_api(
+        cls, series: PACSSeries, folder: FileBrowserFolder
+    ) -> "ResolvedPacsSeries":
+        return cls(
+            series_id=series.id,
+            folder_id=folder.id,
+            folder_path=folder.path,
+            patient_id=series.patient_id,
+            patient_name=series.patient_name,
+            patient_birth_date=series.patient_birth_date,
+            patient_sex=series.patient_sex,
+            study_date=series.study_date,
+            accession_number=series.accession_number,
+            modality=series.modality,
+            protocol_name=series.protocol_name,
+            study_instance_uid=series.study_instance_uid,
+            study_description=series.study_description,
+            series_instance_uid=series.series_instance_uid,
+            series_description=series.series_description,
+            pacs_identifier=series.pacs_identifier,
+        )
 
     def to_dicom_metadata(self) -> DicomSeriesMetadata:
         return DicomSeriesMetadata(
-            PatientID=self.series.patient_id,
-            PatientName=self.series.patient_name,
-            PatientBirthDate=self.series.patient_birth_date,
-            PatientSex=self.series.patient_sex,
-            StudyDate=self.series.study_date,
-            AccessionNumber=self.series.accession_number,
-            Modality=self.series.modality,
-            ProtocolName=self.series.protocol_name,
-            StudyInstanceUID=self.series.study_instance_uid,
-            StudyDescription=self.series.study_description,
-            SeriesInstanceUID=self.series.series_instance_uid,
-            SeriesDescription=self.series.series_description,
-            pacs_identifier=self.series.pacs_identifier,
-            series_dir=self.folder.path,
+            PatientID=self.patient_id,
+            PatientName=self.patient_name,
+            PatientBirthDate=self.patient_birth_date,
+            PatientSex=self.patient_sex,
+            StudyDate=self.study_date,
+            AccessionNumber=self.accession_number,
+            Modality=self.modality,
+            ProtocolName=self.protocol_name,
+            StudyInstanceUID=self.study_instance_uid,
+            StudyDescription=self.study_description,
+            SeriesInstanceUID=self.series_instance_uid,
+            SeriesDescription=self.series_description,
+            pacs_identifier=self.pacs_identifier,
+            series_dir=self.folder_path,
         )
 
 
 async def resolve_series(
-    api_client: ApiClient, data: RawPacsSeries
+    data: RawPacsSeries,
+    read: Callable[[Callable[[ApiClient], Awaitable]], Awaitable],
 ) -> Optional[ResolvedPacsSeries]:
-    pacs_api = PacsApi(api_client)
-    folder_api = FilebrowserApi(api_client)
+    """
+    :param read: makes a request to *CUBE* using a client, e.g. with retries (see :meth:`serie.clients.Clients.read`)
+    """
     series, folder = await asyncio.gather(
-        pacs_api.pacs_series_retrieve(data.id),
-        folder_api.filebrowser_retrieve(data.folder_id),
+        read(lambda api_client: PacsApi(api_client).pacs_series_retrieve(data.id)),
+        read(
+            lambda api_client: FilebrowserApi(api_client).filebrowser_retrieve(
+                data.folder_id
+            )
+        ),
     )
-    return ResolvedPacsSeries(series=series, folder=folder)
+    return ResolvedPacsSeries.from_api(series, folder)
@@ -1,13 +1,37 @@
-from typing import Annotated, Union
+import asyncio
+import json
+import logging
+from typing import Annotated, Any
 
-from fastapi import Response, status, Header, APIRouter
+from fastapi import Request, Response, status, Header, APIRouter, HTTPException
+from fastapi.exceptions import RequestValidationError
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, ValidationError
 
-from aiochris_oag.exceptions import UnauthorizedException, NotFoundException
-from serie.actions import ClientActions, InvalidRunnablesError
-from serie.clients import Clients
-from serie.match import is_match
-from serie.models import DicomSeriesPayload, InvalidRunnableList, CreatedFeed, BadRequestResponse
+from serie import event_log, metrics
+from serie.dry_run import dry_run
+from serie.handler import EventHandler, Outcome
+from serie.ingest import Ingester, RowNotHandled, open_row_source
+from serie.limits import Overloaded
+from serie.match import Matcher, compile_matcher
+from serie.models import (
+    DicomSeriesBatch,
+    DicomSeriesEvent,
+    DicomSeriesPayload,
+    DryRunRequest,
+    DryRunResult,
+    RawPacsSeries,
+    RuleOutcome,
+    SeriesOutcome,
+    CreatedFeed,
+    BadRequestResponse,
+    JobAccepted,
+    JobStatus,
+)
 from serie.settings import get_settings
+from serie.spec_cache import SpecCache
+
+logger = logging.getLogger(__name__)
 
 
 def get_router() -> APIRouter:
@@ -18,8 +42,65 @@ def get_router() -> APIRouter:
     (This happens if you use a global router object in pytest.)
     """
 
-    clients = Clients()
-    router = APIRouter()
+    settings = get_settings()
+    handler = EventHandler(
+        settings,
+        job_url=lambda hasura_id: router.url_path_for(
+            "dicom_series_job", hasura_id=hasura_id
+        ),
+    )
+    if not settings.async_jobs and any(
+        rule.study_quiet_period is not None for rule in handler.rule_index.rules
+    ):
+        # Hasura does not retry web hooks which time out
+        raise ValueError(
+            "study_quiet_period of rules in RULES_FILE requires ASYNC_JOBS"
+        )
+    on_startup = []
+    on_shutdown = [handler.close]
+    if settings.ingest_database_url is not None:
+        if settings.rules_file is None or settings.ingest_authorization is None:
+            raise ValueError(
+                "INGEST_DATABASE_URL requires RULES_FILE and INGEST_AUTHORIZATION"
+            )
+        ingest_authorization = settings.ingest_authorization.get_secret_value()
+
+        async def ingest_row(row: RawPacsSeries):
+            outcomes = await handler.handle_rules(
+                DicomSeriesEvent.model_construct(
+                    hasura_id=f"pacsseries:{row.id}", data=row
+                ),
+                ingest_authorization,
+            )
+            unavailable = [
+                o.rule
+                for o in outcomes
+                if o.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+            ]
+            if unavailable:
+                raise RowNotHandled(f"CUBE was unavailable for rules {unavailable}")
+
+        ingester = Ingester(
+            open_row_source(settings.ingest_database_url, settings.ingest_channel),
+            ingest_row,
+            batch_size=settings.ingest_batch_size,
+            poll_interval=settings.ingest_poll_interval,
+            start_after=settings.ingest_start_after,
+            state_path=settings.ingest_state_file,
+        )
+        on_startup.append(ingester.start)
+        on_shutdown.insert(0, ingester.close)
+    if settings.log_events:
+        event_log_listener = event_log.EventLogListener()
+        on_startup.append(event_log_listener.start)
+        # after everything else, so that the events of jobs which are finished on shutdown are logged
+        on_shutdown.append(event_log_listener.stop)
+    router = APIRouter(on_startup=on_startup, on_shutdown=on_shutdown)
+    specs = SpecCache()
+
+    _overloaded_response = {
+        "description": "Too many requests are waiting to be handled, retry after the number of seconds of the Retry-After header"
+    }
 
     @router.post(
         "/dicom_series/",
@@ -28,6 +109,10 @@ def get_router() -> APIRouter:
             "CUBE database's pacsfiles_pacsseries table."
         ),
         responses={
+            status.HTTP_200_OK: {
+                "description": "Event or series was already handled, returns the previously created feed",
+                "model": CreatedFeed,
+            },
             status.HTTP_201_CREATED: {
                 "description": "Feed created",
                 "model": CreatedFeed,
@@ -40,48 +125,302 @@ def get_router() -> APIRouter:
             },
             status.HTTP_401_UNAUTHORIZED: {
                 "model": None
-            }
+            },
+            status.HTTP_202_ACCEPTED: {
+                "description": "DICOM series matched and will be processed in the background",
+                "model": JobAccepted,
+            },
+            status.HTTP_503_SERVICE_UNAVAILABLE: {
+                "description": "CUBE is unavailable, or too many events or jobs are waiting to be processed. "
+                "If the Retry-After header is set, retry after that many seconds."
+            },
         },
-        status_code=status.HTTP_201_CREATED
+        status_code=status.HTTP_201_CREATED,
+        # the body is parsed by SpecCache instead of FastAPI
+        openapi_extra=_request_body(DicomSeriesPayload),
     )
     async def dicom_series(
-        payload: DicomSeriesPayload,
+        request: Request,
         authorization: Annotated[str, Header()],
         response: Response,
     ):
         """
         Create *ChRIS* plugin instances and/or workflows on DICOM series data when an entire DICOM series is received.
         On success, returns the URL of the created feed.
+
+        If ``ASYNC_JOBS`` is enabled, matching series are processed in the background instead,
+        and the status of the job can be checked at ``/dicom_series/jobs/{hasura_id}``.
         """
-        settings = get_settings()
-        actions = ClientActions(
-            auth=authorization, host=settings.get_host(), clients=clients
-        )
-        try:
-            resolved = await actions.resolve_series(payload.data)
-        except UnauthorizedException as e:
-            response.status_code = e.status
-            return None
-        except NotFoundException as e:
-            response.status_code = status.HTTP_400_BAD_REQUEST
-            return BadRequestResponse(error="DICOM series not found", data=payload.data)
-
-        if not is_match(resolved.series, payload.match):
+        with metrics.REQUESTS_IN_PROGRESS.labels("dicom_series").track_inprogress():
+            payload, matcher = await _parse_payload(specs, request)
+            if payload.study_quiet_period is not None and handler.jobs is None:
+                raise _requires_async_jobs()
+            with event_log.trace_event(payload.hasura_id, payload.data.id):
+                with metrics.STAGE_DURATION.labels("match").time():
+                    matched = matcher.prematch(payload.data)
+                event_log.record_match(matched)
+                if not matched:
+                    metrics.EVENT_OUTCOMES.labels(status.HTTP_204_NO_CONTENT).inc()
+                    event_log.record_outcome(status.HTTP_204_NO_CONTENT, None)
+                    response.status_code = status.HTTP_204_NO_CONTENT
+                    return None
+                try:
+                    async with handler.admission.admit():
+                        response.status_code, body = await handler.handle_matched(
+                            payload, matcher, authorization
+                        )
+                except Overloaded as e:
+                    event_log.record_outcome(status.HTTP_503_SERVICE_UNAVAILABLE, None)
+                    raise _service_unavailable(e)
+                event_log.record_outcome(response.status_code, body)
+                return body
+
+    @router.post(
+        "/dicom_series/rules/",
+        description=(
+            "A web hook which should be called when a row is inserted into "
+            "CUBE database's pacsfiles_pacsseries table. The series is handled "
+            "according to every rule of RULES_FILE which it matches."
+        ),
+        responses={
+            status.HTTP_200_OK: {
+                "description": "Outcome of every rule which the series matched",
+                "model": list[RuleOutcome],
+            },
+            status.HTTP_204_NO_CONTENT: {
+                "description": "DICOM series did not match any rule"
+            },
+            status.HTTP_503_SERVICE_UNAVAILABLE: _overloaded_response,
+        },
+    )
+    async def dicom_series_rules(
+        event: DicomSeriesEvent,
+        authorization: Annotated[str, Header()],
+        response: Response,
+    ) -> list[RuleOutcome] | None:
+        """
+        Create a feed for every rule of ``RULES_FILE`` which matches the DICOM series.
+        """
+        with metrics.REQUESTS_IN_PROGRESS.labels("dicom_series_rules").track_inprogress():
+            try:
+                async with handler.admission.admit():
+                    outcomes = await handler.handle_rules(event, authorization)
+            except Overloaded as e:
+                raise _service_unavailable(e)
+        if outcomes is None:
             response.status_code = status.HTTP_204_NO_CONTENT
-            return None
+        return outcomes
 
-        try:
-            feed_url = await actions.create_analysis(
-                resolved, payload.jobs, payload.feed_name_template
-            )
-        except InvalidRunnablesError as e:
-            response.status_code = status.HTTP_400_BAD_REQUEST
-            return BadRequestResponse(
-                error="Invalid runnables",
-                data=InvalidRunnableList(errors=e.runnables)
+    @router.post(
+        "/dicom_series/batch/",
+        description=(
+            "Handle many rows of CUBE database's pacsfiles_pacsseries table "
+            "using the same conditions and jobs."
+        ),
+        responses={
+            status.HTTP_200_OK: {
+                "description": "Outcome of every series, in the same order as the request",
+                "model": list[SeriesOutcome],
+            },
+            status.HTTP_503_SERVICE_UNAVAILABLE: _overloaded_response,
+        },
+    )
+    async def dicom_series_batch(
+        batch: DicomSeriesBatch,
+        authorization: Annotated[str, Header()],
+    ) -> list[SeriesOutcome]:
+        """
+        Like ``/dicom_series/``, for every series of ``data``. The conditions are
+        compiled once, and at most ``BATCH_CONCURRENCY`` matching series are
+        handled at a time. A batch is admitted as one request, see ``ADMISSION_*``.
+        If handling a series fails unexpectedly, its status code is 500, and the
+        other series are still handled.
+        """
+        with metrics.STAGE_DURATION.labels("match").time():
+            matcher = compile_matcher(batch.match)
+            matched = [matcher.prematch(row) for row in batch.data]
+        semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+        async def handle_row(row: RawPacsSeries) -> Outcome:
+            # fields were already validated, by DicomSeriesBatch
+            payload = DicomSeriesPayload.model_construct(
+                hasura_id=f"{batch.hasura_id}:{row.id}",
+                data=row,
+                match=batch.match,
+                jobs=batch.jobs,
+                feed_name_template=batch.feed_name_template,
             )
+            async with semaphore:
+                with event_log.trace_event(payload.hasura_id, row.id) as trace:
+                    event_log.record_match(True)
+                    try:
+                        outcome = await handler.handle_matched(
+                            payload, matcher, authorization
+                        )
+                    except Exception as e:
+                        logger.exception(
+                            "Failed to handle series id=%d of batch %s",
+                            row.id,
+                            batch.hasura_id,
+                        )
+                        metrics.EVENT_OUTCOMES.labels(
+                            status.HTTP_500_INTERNAL_SERVER_ERROR
+                        ).inc()
+                        if trace is not None:
+                            trace.error = type(e).__name__
+                        outcome = status.HTTP_500_INTERNAL_SERVER_ERROR, None
+                    event_log.record_outcome(*outcome)
+                    return outcome
+
+        with metrics.REQUESTS_IN_PROGRESS.labels("dicom_series_batch").track_inprogress():
+            try:
+                async with handler.admission.admit():
+                    outcomes = await asyncio.gather(
+                        *(handle_row(row) for row, m in zip(batch.data, matched) if m)
+                    )
+            except Overloaded as e:
+                raise _service_unavailable(e)
+        outcomes_iter = iter(outcomes)
+        results = []
+        for row, m in zip(batch.data, matched):
+            if m:
+                status_code, body = next(outcomes_iter)
+            else:
+                metrics.EVENT_OUTCOMES.labels(status.HTTP_204_NO_CONTENT).inc()
+                status_code, body = status.HTTP_204_NO_CONTENT, None
+                with event_log.trace_event(f"{batch.hasura_id}:{row.id}", row.id):
+                    event_log.record_match(False)
+                    event_log.record_outcome(status_code, body)
+            results.append(SeriesOutcome(id=row.id, status_code=status_code, result=body))
+        return results
+
+    @router.post(
+        "/dicom_series/dry_run/",
+        description=(
+            "Count the DICOM series which are already in CUBE and match some "
+            "conditions, without creating anything."
+        ),
+        responses={status.HTTP_503_SERVICE_UNAVAILABLE: _overloaded_response},
+    )
+    async def dicom_series_dry_run(
+        request: DryRunRequest,
+        authorization: Annotated[str, Header()],
+    ) -> DryRunResult:
+        """
+        Evaluate ``match`` against every series created between ``since`` and ``until``,
+        e.g. before adding it to a Hasura event trigger or to ``RULES_FILE``.
+        The series are listed from CUBE one page at a time, so a dry run over many series
+        takes a while. For those, consider ``python -m serie.dry_run`` instead.
+        A dry run is admitted as one request, see ``ADMISSION_*``.
+        """
+        try:
+            async with handler.admission.admit():
+                return await dry_run(
+                    handler.clients, settings.get_host(), authorization, request
+                )
+        except Overloaded as e:
+            raise _service_unavailable(e)
 
-        response.status_code = status.HTTP_201_CREATED
-        return CreatedFeed(feed=feed_url)
+    @router.get(
+        "/dicom_series/jobs/{hasura_id}",
+        name="dicom_series_job",
+        description="Get the status of an event which is processed asynchronously.",
+        responses={
+            status.HTTP_404_NOT_FOUND: {
+                "description": "Unknown job, or submitted using another Authorization"
+            }
+        },
+    )
+    async def dicom_series_job(
+        hasura_id: str, authorization: Annotated[str, Header()]
+    ) -> JobStatus:
+        """
+        Only the same ``Authorization`` as the event's can get the status of its job.
+        """
+        job_status = handler.job_status(hasura_id, authorization)
+        if job_status is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        return job_status
+
+    @router.get("/metrics", include_in_schema=False)
+    def prometheus_metrics() -> Response:
+        """
+        Metrics in the Prometheus text format, see :mod:`serie.metrics`.
+        """
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
     return router
+
+
+def _request_body(model: type[BaseModel]) -> dict[str, Any]:
+    """
+    OpenAPI documentation of a JSON request body which is parsed by the endpoint.
+    """
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    schema.pop("$defs", None)
+    return {
+        "requestBody": {
+            "content": {"application/json": {"schema": schema}},
+            "required": True,
+        }
+    }
+
+
+async def _parse_payload(
+    specs: SpecCache, request: Request
+) -> tuple[DicomSeriesPayload, Matcher]:
+    """
+    Parse the body of a request to ``/dicom_series/``.
+
+    :raises RequestValidationError: if the body is invalid, like FastAPI would
+    """
+    try:
+        body = json.loads(await request.body())
+    except json.JSONDecodeError as e:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "json_invalid",
+                    "loc": ("body", e.pos),
+                    "msg": "JSON decode error",
+                    "input": {},
+                    "ctx": {"error": e.msg},
+                }
+            ]
+        )
+    try:
+        return specs.parse(body)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]
+        )
+
+
+def _requires_async_jobs() -> RequestValidationError:
+    """
+    Without ``ASYNC_JOBS``, the web hook request would wait for the study, and
+    Hasura does not retry web hooks which time out.
+    """
+    return RequestValidationError(
+        [
+            {
+                "type": "value_error",
+                "loc": ("body", "study_quiet_period"),
+                "msg": "study_quiet_period requires ASYNC_JOBS",
+                "input": None,
+            }
+        ]
+    )
+
+
+def _service_unavailable(e: Overloaded) -> HTTPException:
+    metrics.EVENT_OUTCOMES.labels(status.HTTP_503_SERVICE_UNAVAILABLE).inc()
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
@@ -0,0 +1,113 @@
+from collections import defaultdict
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Optional
+
+from serie.dicom_series_metadata import DicomSeriesMetadataName
+from serie.match import RESOLVED_ONLY_TAGS, CompiledCondition, Matcher, literal_prefix
+from serie.models import RawPacsSeries, RoutingRule, RuleTable
+
+
+class RuleIndex:
+    """
+    A compiled index of :class:`RoutingRule`, for finding which rules
+    (might) match a DICOM series without testing every rule.
+
+    Each rule is indexed by one of its conditions which has a literal prefix,
+    e.g. the rule with the condition ``{"tag": "Modality", "regex": "CR"}`` is
+    only considered when the Modality of a series starts with "CR".
+    Rules without any such condition are always considered.
+    """
+
+    def __init__(self, rules: Sequence[RoutingRule]):
+        self.rules = list(rules)
+        self.matchers = [Matcher(rule.match) for rule in self.rules]
+        self._unindexed: list[int] = []
+        self._index: dict[DicomSeriesMetadataName, _PrefixIndex] = defaultdict(
+            _PrefixIndex
+        )
+        for i, matcher in enumerate(self.matchers):
+            key = _choose_index_key(matcher.conditions)
+            if key is None:
+                self._unindexed.append(i)
+            else:
+                tag, prefix, ignore_case = key
+                self._index[tag].add(prefix, ignore_case, i)
+
+    def prematch(self, data: RawPacsSeries) -> list[tuple[RoutingRule, Matcher]]:
+        """
+        Find the rules whose conditions on the row from the database are satisfied.
+
+        Conditions on tags in :data:`RESOLVED_ONLY_TAGS` are not evaluated, see
+        :func:`serie.match.prematch`.
+        """
+        metadata = data.to_dicom_metadata()
+        candidates = set(self._unindexed)
+        for tag, prefixes in self._index.items():
+            value = metadata.get(tag.value, None)
+            if value is not None:
+                candidates.update(prefixes.lookup(str(value)))
+        return [
+            (self.rules[i], self.matchers[i])
+            for i in sorted(candidates)
+            if self.matchers[i].prematch_metadata(metadata)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+class _PrefixIndex:
+    """
+    Finds which literal prefixes a string starts with, using one dict lookup
+    per distinct prefix length.
+    """
+
+    def __init__(self):
+        self._by_length: dict[tuple[int, bool], dict[str, list[int]]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+
+    def add(self, prefix: str, ignore_case: bool, rule: int):
+        key = prefix.lower() if ignore_case else prefix
+        self._by_length[(len(prefix), ignore_case)][key].append(rule)
+
+    def lookup(self, value: str) -> list[int]:
+        found = []
+        for (length, ignore_case), prefixes in self._by_length.items():
+            head = value[:length]
+            if not ignore_case:
+                found.extend(prefixes.get(head, ()))
+            elif head.isascii():
+                found.extend(prefixes.get(head.lower(), ()))
+            else:
+                # re.IGNORECASE matches e.g. "ſ" to "s", but str.lower does not,
+                # so every rule with a prefix of this length might match.
+                for rules in prefixes.values():
+                    found.extend(rules)
+        return found
+
+
+def load_rules(path: str | Path) -> list[RoutingRule]:
+    """
+    Load a rule table from a JSON file.
+    """
+    return RuleTable.model_validate_json(Path(path).read_text()).rules
+
+
+def _choose_index_key(
+    conditions: Sequence[CompiledCondition],
+) -> Optional[tuple[DicomSeriesMetadataName, str, bool]]:
+    """
+    Choose the condition with the longest literal prefix to index a rule by.
+    """
+    best = None
+    for condition in conditions:
+        if condition.is_header or condition.tag in RESOLVED_ONLY_TAGS:
+            continue
+        prefix = literal_prefix(condition.regex)
+        if prefix and (best is None or len(prefix) > len(best[1])):
+            if condition.ignore_case and not prefix.isascii():
+                continue
+            best = (condition.tag, prefix, condition.ignore_case)
+    return best
@@ -1,5 +1,15 @@
+from pathlib import Path
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings
-from pydantic import HttpUrl
+from pydantic import (
+    HttpUrl,
+    NonNegativeFloat,
+    NonNegativeInt,
+    PositiveInt,
+    PositiveFloat,
+    SecretStr,
+)
 import functools
 
 
@@ -8,6 +18,109 @@ class Settings(BaseSettings):
 
     chris_host: HttpUrl
 
+    log_events: bool = True
+    """Log one JSON line per event to stderr, see :mod:`serie.event_log`."""
+
+    client_pool_size: PositiveInt = 16
+    """Maximum number of pooled CUBE API clients (one per distinct credential)."""
+    client_connections_per_client: PositiveInt = 32
+    """
+    Maximum number of simultaneous connections of each pooled client, i.e. per CUBE
+    host and credentials. Requests to a host are limited by ``cube_max_requests_per_host``.
+    """
+    client_idle_timeout: PositiveFloat = 300.0
+    """Number of seconds after which an unused pooled client is closed."""
+
+    plugin_cache_ttl: PositiveFloat = 300.0
+    """Number of seconds a found plugin is cached before it is refreshed."""
+    plugin_cache_negative_ttl: PositiveFloat = 30.0
+    """Number of seconds to remember that a plugin was not found."""
+    plugin_cache_max_stale: PositiveFloat = 3600.0
+    """Number of seconds past its TTL that a plugin may be served while it is refreshed in the background."""
+    plugin_cache_size: PositiveInt = 1024
+    """Maximum number of cached plugins."""
+
+    series_cache_size: PositiveInt = 4096
+    """Maximum number of resolved DICOM series to cache."""
+    series_cache_ttl: PositiveFloat = 300.0
+    """Number of seconds a resolved DICOM series is cached."""
+
+    dicom_header_bytes: PositiveInt = 65536
+    """Number of bytes to read from the start of a DICOM file, to match on tags of its header."""
+    dicom_header_cache_size: PositiveInt = 4096
+    """Maximum number of DICOM headers to cache."""
+    dicom_header_cache_ttl: PositiveFloat = 3600.0
+    """Number of seconds a DICOM header is cached."""
+
+    cube_retry_attempts: PositiveInt = 3
+    """Maximum number of attempts of a request which reads from CUBE, if it fails with a 5xx error or times out."""
+    cube_retry_base_delay: PositiveFloat = 0.1
+    """Maximum number of seconds to wait before the first retry. The maximum doubles for every retry."""
+    cube_retry_max_delay: PositiveFloat = 2.0
+    """Maximum number of seconds to wait before any retry."""
+    cube_breaker_threshold: PositiveInt = 5
+    """Number of consecutive failed requests to a CUBE host after which requests to it fail fast."""
+    cube_breaker_reset_timeout: PositiveFloat = 30.0
+    """Number of seconds to fail fast before trying a request to a CUBE host again."""
+
+    cube_max_requests_per_host: PositiveInt = 64
+    """Maximum number of outstanding requests to a CUBE host."""
+    cube_max_requests_per_credential: PositiveInt = 16
+    """Maximum number of outstanding requests to a CUBE host using the same Authorization header."""
+
+    admission_max_concurrent: PositiveInt = 64
+    """Maximum number of web hook requests which are handled at a time. Others wait in a queue."""
+    admission_max_queue: NonNegativeInt = 256
+    """Maximum number of web hook requests waiting to be handled. Beyond it, requests are rejected with 503 and Retry-After."""
+    admission_max_wait: PositiveFloat = 10.0
+    """Maximum number of seconds a web hook request may wait to be handled before it is rejected with 503 and Retry-After."""
+
+    async_jobs: bool = False
+    """Respond to events immediately with 202 Accepted and create feeds in the background."""
+    job_workers: PositiveInt = 8
+    """Number of background jobs to process concurrently."""
+    job_queue_size: PositiveInt = 1000
+    """Maximum number of background jobs waiting to be processed."""
+    job_history_size: PositiveInt = 10000
+    """Maximum number of background job statuses to remember."""
+    job_shutdown_timeout: NonNegativeFloat = 30.0
+    """Number of seconds to wait for background jobs to finish on shutdown. Jobs which are still not finished are logged."""
+
+    idempotency_store: Literal["memory", "sqlite"] = "memory"
+    """Where to record handled events. Use "sqlite" when running multiple worker processes."""
+    idempotency_sqlite_path: Path = Path("serie-idempotency.sqlite3")
+    """Path of the SQLite database file, if ``idempotency_store="sqlite"``."""
+    idempotency_max_entries: PositiveInt = 100000
+    """Maximum number of events to remember, if ``idempotency_store="memory"``."""
+
+    batch_concurrency: PositiveInt = 8
+    """Maximum number of matching series of a request to ``/dicom_series/batch/`` to handle concurrently."""
+
+    study_max_delay: PositiveFloat = 600.0
+    """Maximum number of seconds to buffer the series of a study, see ``study_quiet_period`` of :class:`serie.models.DicomSeriesPayload`."""
+
+    rules_file: Optional[Path] = None
+    """JSON file of routing rules used by ``/dicom_series/rules/``, see :class:`serie.models.RuleTable`."""
+
+    ingest_database_url: Optional[str] = None
+    """
+    URL of the database of CUBE, e.g. ``postgresql://chris:chris1234@db:5432/chris``.
+    If set, new rows of the pacsfiles_pacsseries table are read from the database and
+    handled according to ``rules_file``, without Hasura. See :mod:`serie.ingest`.
+    """
+    ingest_authorization: Optional[SecretStr] = None
+    """Value of the Authorization header used to call CUBE for ingested and backfilled rows."""
+    ingest_channel: str = "serie_pacsseries"
+    """PostgreSQL channel to LISTEN on for new rows."""
+    ingest_poll_interval: PositiveFloat = 5.0
+    """Maximum number of seconds between checks for new rows."""
+    ingest_batch_size: PositiveInt = 100
+    """Maximum number of rows to read and handle at a time."""
+    ingest_start_after: Optional[NonNegativeInt] = None
+    """Handle rows with an ``id`` greater than this. By default, only rows inserted after startup are handled."""
+    ingest_state_file: Optional[Path] = None
+    """File where the ``id`` of the last handled row is saved, so that ingestion resumes from it after a restart."""
+
     def get_host(self) -> str:
         # remove the trailing flash which is added by pydantic.HttpUrl
         return str(self.chris_host)[:-1]
@@ -0,0 +1,34 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Coalesces concurrent calls: while a call for a key is in flight, other calls
+    for the same key wait for it and share its outcome (result or exception)
+    instead of calling again.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(self):
+        self._inflight: dict[K, asyncio.Task[V]] = {}
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        """
+        Call ``fn``, unless a call for ``key`` is already in flight.
+        """
+        task = self._inflight.get(key, None)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shielded so that a cancelled caller does not cancel the call for others
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,99 @@
+import dataclasses
+import json
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any, Optional
+
+from serie.match import Matcher, compile_matcher
+from serie.models import (
+    ChrisRunnableRequest,
+    DicomSeriesEvent,
+    DicomSeriesMatcher,
+    DicomSeriesPayload,
+)
+
+_SPEC_FIELDS = ("match", "jobs", "feed_name_template", "study_quiet_period")
+"""
+Fields of :class:`DicomSeriesPayload` which are the same in every event sent by
+the same Hasura event trigger.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class CompiledSpec:
+    """
+    The validated fields :data:`_SPEC_FIELDS` of a :class:`DicomSeriesPayload`,
+    and its compiled conditions.
+    """
+
+    match: Sequence[DicomSeriesMatcher]
+    jobs: Sequence[ChrisRunnableRequest]
+    feed_name_template: str
+    study_quiet_period: Optional[float]
+    matcher: Matcher
+
+
+class SpecCache:
+    """
+    Parses the bodies of requests to ``/dicom_series/``.
+
+    Every event from the same Hasura event trigger has the same ``match``, ``jobs``
+    and ``feed_name_template``, so they are validated and compiled once and cached
+    by their content. Only ``hasura_id`` and ``data`` are validated for every event.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self._maxsize = maxsize
+        self._specs: OrderedDict[str, CompiledSpec] = OrderedDict()
+
+    def parse(self, body: Any) -> tuple[DicomSeriesPayload, Matcher]:
+        """
+        Validate the body of a request.
+
+        :raises pydantic.ValidationError: if the body is invalid
+        """
+        if not isinstance(body, dict):
+            DicomSeriesPayload.model_validate(body)  # raises
+        key = json.dumps(
+            [body.get(field, None) for field in _SPEC_FIELDS],
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        spec = self._specs.get(key, None)
+        if spec is None:
+            payload = DicomSeriesPayload.model_validate(body)
+            self._put(key, _compile(payload))
+            return payload, self._specs[key].matcher
+
+        self._specs.move_to_end(key)
+        event = DicomSeriesEvent.model_validate(
+            {field: body[field] for field in ("hasura_id", "data") if field in body}
+        )
+        # fields were already validated, by DicomSeriesEvent and when spec was cached
+        payload = DicomSeriesPayload.model_construct(
+            hasura_id=event.hasura_id,
+            data=event.data,
+            match=spec.match,
+            jobs=spec.jobs,
+            feed_name_template=spec.feed_name_template,
+            study_quiet_period=spec.study_quiet_period,
+        )
+        return payload, spec.matcher
+
+    def _put(self, key: str, spec: CompiledSpec):
+        self._specs[key] = spec
+        while len(self._specs) > self._maxsize:
+            self._specs.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+
+def _compile(payload: DicomSeriesPayload) -> CompiledSpec:
+    return CompiledSpec(
+        match=payload.match,
+        jobs=payload.jobs,
+        feed_name_template=payload.feed_name_template,
+        study_quiet_period=payload.study_quiet_period,
+        matcher=compile_matcher(payload.match),
+    )
@@ -0,0 +1,96 @@
+import asyncio
+import dataclasses
+import time
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Generic, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclasses.dataclass
+class _Group(Generic[T, R]):
+    items: dict[str, T]
+    future: asyncio.Future[R]
+    deadline: float
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class StudyGrouper(Generic[K, T, R]):
+    """
+    Buffers items, e.g. the series of a study, until no item was added to their
+    group for a quiet period, then handles the whole group at once.
+
+    N.B.: instances cannot be shared across async event loops.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[K, list[T]], Awaitable[R]],
+        max_delay: float = 600.0,
+    ):
+        """
+        :param flush: handles a group
+        :param max_delay: maximum number of seconds a group is buffered, even if items keep being added to it
+        """
+        self._flush = flush
+        self._max_delay = max_delay
+        self._groups: dict[K, _Group[T, R]] = {}
+        self._flushing: set[asyncio.Task] = set()
+
+    def add(
+        self, key: K, item_id: str, item: T, quiet_period: float
+    ) -> asyncio.Future[R]:
+        """
+        Add an item to its group, and wait ``quiet_period`` more seconds before
+        handling the group. An item which is already in the group is not added again.
+
+        :return: the outcome of handling the group
+        """
+        now = time.monotonic()
+        group = self._groups.get(key, None)
+        if group is None:
+            group = _Group(
+                items={},
+                future=asyncio.get_running_loop().create_future(),
+                deadline=now + self._max_delay,
+            )
+            self._groups[key] = group
+        group.items.setdefault(item_id, item)
+        if group.timer is not None:
+            group.timer.cancel()
+        delay = min(quiet_period, group.deadline - now)
+        group.timer = asyncio.get_running_loop().call_later(
+            delay, self._start_flush, key
+        )
+        return group.future
+
+    async def close(self):
+        """
+        Handle every buffered group now, and wait for all groups to be handled.
+        """
+        for key in list(self._groups.keys()):
+            self._start_flush(key)
+        await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    def _start_flush(self, key: K):
+        group = self._groups.pop(key)
+        if group.timer is not None:
+            group.timer.cancel()
+        task = asyncio.create_task(self._flush(key, list(group.items.values())))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+        task.add_done_callback(lambda t: _copy_outcome(t, group.future))
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+
+def _copy_outcome(task: asyncio.Task, future: asyncio.Future):
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
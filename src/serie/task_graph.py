@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, Optional
+
+
+class TaskGraph:
+    """
+    Runs async operations as a dependency graph: every operation starts as soon
+    as the operations it depends on have finished, and is given their results.
+
+    The latency of every operation is recorded in :attr:`latencies`, and the
+    result of every operation which finished is recorded in :attr:`results`,
+    even if the graph failed, so that a failed graph can be resumed. Operations
+    which already started when another failed are not cancelled, because e.g. a
+    request which creates something in *CUBE* may succeed even if it is cancelled.
+    """
+
+    def __init__(self, observe: Optional[Callable[[str, float], None]] = None):
+        """
+        :param observe: called with the name and latency of every operation when it finishes
+        """
+        self._observe = observe
+        self._nodes: dict[str, tuple[Callable[..., Awaitable[Any]], tuple[str, ...]]] = {}
+        self.latencies: dict[str, float] = {}
+        """
+        Number of seconds each operation took, not including time spent waiting for its dependencies.
+        """
+        self.results: dict[str, Any] = {}
+        """
+        Result of each operation which finished.
+        """
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], *deps: str):
+        """
+        Add an operation. ``fn`` is called with the results of ``deps``, in order.
+        Dependencies must be added before their dependents.
+        """
+        if name in self._nodes:
+            raise ValueError(f"Duplicate operation: {name}")
+        if missing := [dep for dep in deps if dep not in self._nodes]:
+            raise ValueError(f"Unknown dependencies of {name}: {missing}")
+        self._nodes[name] = (fn, deps)
+
+    async def run(self, completed: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+        """
+        Run all operations. If any operation fails, no more operations are started,
+        but the operations which already started are awaited, so that their results
+        are recorded in :attr:`results`. Then the first exception is raised.
+
+        :param completed: results of operations which already finished in a previous
+                          run of the same graph. They are given to their dependents
+                          instead of being run again.
+        :return: result of every operation
+        """
+        completed = completed or {}
+        self.results.update(completed)
+        failures: list[BaseException] = []
+        tasks: dict[str, asyncio.Future] = {}
+        for name, (fn, deps) in self._nodes.items():
+            if name in completed:
+                tasks[name] = asyncio.get_running_loop().create_future()
+                tasks[name].set_result(completed[name])
+                continue
+            inputs = [tasks[dep] for dep in deps]
+            tasks[name] = asyncio.create_task(
+                self._run_node(name, fn, inputs, failures)
+            )
+        try:
+            results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        except BaseException:
+            # the run itself was cancelled
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        if failures:
+            raise failures[0]
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(tasks.keys(), results))
+
+    async def _run_node(
+        self,
+        name: str,
+        fn: Callable[..., Awaitable[Any]],
+        inputs: list[asyncio.Future],
+        failures: list[BaseException],
+    ) -> Any:
+        args = [await task for task in inputs]
+        if failures:
+            raise _NotStarted(name)
+        start = time.monotonic()
+        try:
+            result = await fn(*args)
+        except Exception as e:
+            failures.append(e)
+            raise
+        self.results[name] = result
+        self.latencies[name] = time.monotonic() - start
+        if self._observe is not None:
+            self._observe(name, self.latencies[name])
+        return result
+
+
+class _NotStarted(Exception):
+    """
+    An operation was not started because another operation failed.
+    """
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Generic, Optional, TypeVar
+
+from serie import event_log, metrics
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TtlCache(Generic[K, V]):
+    """
+    A bounded cache of values which expire after a number of seconds.
+    The least recently used value is evicted when full.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 300.0, kind: str = ""):
+        """
+        :param kind: what is cached, used to label :data:`metrics.CATALOG_LOOKUPS`
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._kind = kind
+        self._values: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._values.get(key, None)
+        if entry is not None and time.monotonic() >= entry[0]:
+            del self._values[key]
+            entry = None
+        if entry is None:
+            metrics.CATALOG_LOOKUPS.labels(self._kind, "miss").inc()
+            event_log.record_cache(self._kind, "miss")
+            return None
+        metrics.CATALOG_LOOKUPS.labels(self._kind, "hit").inc()
+        event_log.record_cache(self._kind, "hit")
+        self._values.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: K, value: V):
+        self._values[key] = (time.monotonic() + self._ttl, value)
+        self._values.move_to_end(key)
+        while len(self._values) > self._maxsize:
+            self._values.popitem(last=False)
+
+    def clear(self):
+        self._values.clear()
+
+    def __len__(self) -> int:
+        return len(self._values)
@@ -0,0 +1,436 @@
+"""
+An in-process stand-in for the *CUBE* API, for testing and benchmarking *SERIE*
+without miniChRIS.
+
+Only the endpoints which *SERIE* calls are implemented, and only the fields of
+responses which *SERIE* reads are meaningful. Latency and errors can be injected.
+"""
+
+import asyncio
+import dataclasses
+import datetime
+import enum
+import random
+import types
+import typing
+from collections import Counter
+from collections.abc import Mapping
+from typing import Any, Optional
+
+from aiohttp import web
+from pydantic import BaseModel
+
+from aiochris_oag import (
+    Feed,
+    FileBrowserFile,
+    FileBrowserFolder,
+    PACSSeries,
+    Pipeline,
+    Plugin,
+    PluginInstance,
+    PluginParameter,
+    Workflow,
+)
+
+_CREATION_DATE = "2024-07-25T11:59:49.004096-04:00"
+
+
+@dataclasses.dataclass
+class FakeCube:
+    """
+    A fake *CUBE* server. Use it as an async context manager to start it, and
+    set the ``CHRIS_HOST`` setting of *SERIE* to :attr:`url`.
+    """
+
+    latency: float = 0.0
+    """Number of seconds to wait before every response."""
+    error_rate: float = 0.0
+    """Probability of responding to any request with 500 Internal Server Error."""
+    errors: dict[str, int] = dataclasses.field(default_factory=dict)
+    """Status codes to always respond with, by operation name, e.g. ``{"root_update": 500}``."""
+    seed: int = 0
+
+    url: str = dataclasses.field(init=False, default="")
+    calls: Counter[str] = dataclasses.field(init=False, default_factory=Counter)
+    """Number of requests received by operation name."""
+    series: dict[int, dict] = dataclasses.field(init=False, default_factory=dict)
+    folders: dict[int, dict] = dataclasses.field(init=False, default_factory=dict)
+    plugins: dict[int, dict] = dataclasses.field(init=False, default_factory=dict)
+    plugin_parameters: dict[int, list[dict]] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    """Parameters of every plugin, by plugin ID."""
+    pipelines: dict[int, dict] = dataclasses.field(init=False, default_factory=dict)
+    plugin_instances: dict[int, dict] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    feeds: dict[int, dict] = dataclasses.field(init=False, default_factory=dict)
+    workflows: dict[int, dict] = dataclasses.field(init=False, default_factory=dict)
+    files: dict[int, bytes] = dataclasses.field(init=False, default_factory=dict)
+    """Contents of the one file of every series folder which has a file, by folder ID."""
+    request_bodies: dict[tuple[str, int], dict] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    """Bodies of requests which created plugin instances and workflows, by operation name and ID of what was created."""
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.add_plugin("pl-dircopy", "2.1.2", plugin_type="fs")
+        self.add_plugin("pl-unstack-folders", "1.0.0")
+
+    async def __aenter__(self) -> "FakeCube":
+        app = web.Application(middlewares=[self._inject_faults])
+        app.add_routes(
+            [
+                web.get(
+                    "/api/v1/pacs/series/search/",
+                    self._pacs_series_search_list,
+                    name="pacs_series_search_list",
+                ),
+                web.get(
+                    "/api/v1/pacs/series/{id}/",
+                    self._pacs_series_retrieve,
+                    name="pacs_series_retrieve",
+                ),
+                web.get(
+                    "/api/v1/filebrowser/{id}/",
+                    self._filebrowser_retrieve,
+                    name="filebrowser_retrieve",
+                ),
+                web.get(
+                    "/api/v1/filebrowser/{id}/files/",
+                    self._filebrowser_files_list,
+                    name="filebrowser_files_list",
+                ),
+                web.get(
+                    "/api/v1/files/{id}/{fname}",
+                    self._file_resource,
+                    name="file_resource",
+                ),
+                web.get("/api/v1/plugins/", self._plugins_list, name="plugins_list"),
+                web.get(
+                    "/api/v1/plugins/search/",
+                    self._plugins_search_list,
+                    name="plugins_search_list",
+                ),
+                web.get(
+                    "/api/v1/plugins/{id}/parameters/",
+                    self._plugins_parameters_list,
+                    name="plugins_parameters_list",
+                ),
+                web.get(
+                    "/api/v1/pipelines/", self._pipelines_list, name="pipelines_list"
+                ),
+                web.post(
+                    "/api/v1/plugins/{id}/instances/",
+                    self._plugins_instances_create,
+                    name="plugins_instances_create",
+                ),
+                web.post(
+                    "/api/v1/pipelines/{id}/workflows/",
+                    self._pipelines_workflows_create,
+                    name="pipelines_workflows_create",
+                ),
+                web.put("/api/v1/{id}/", self._root_update, name="root_update"),
+            ]
+        )
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def __aexit__(self, *_):
+        await self._runner.cleanup()
+
+    def add_series(self, **tags) -> dict:
+        """
+        Add a DICOM series and its folder.
+
+        :param tags: DICOM tags of the series, which override the example values
+        :return: the row of the ``pacsfiles_pacsseries`` table which Hasura would send
+        """
+        series_id = len(self.series) + 1
+        row = {
+            "id": series_id,
+            "creation_date": _CREATION_DATE,
+            "PatientID": "1449c1d",
+            "PatientName": "anonymized",
+            "PatientBirthDate": "2009-07-01",
+            "PatientAge": 1096,
+            "PatientSex": "M",
+            "StudyDate": "2013-03-08",
+            "AccessionNumber": "98edede8b2",
+            "Modality": "MR",
+            "ProtocolName": "SAG MPRAGE 220 FOV",
+            "StudyInstanceUID": "1.2.840.113845.11.1000000001785349915.20130308061609.6346698",
+            "StudyDescription": "MR-Brain w/o Contrast",
+            "SeriesInstanceUID": f"1.3.12.2.1107.5.2.19.45152.2013030808061520200285270.0.0.{series_id}",
+            "SeriesDescription": "SAG MPRAGE 220 FOV",
+            "folder_id": series_id,
+            "pacs_id": 1,
+            **tags,
+        }
+        path = f"SERVICES/PACS/FAKE/{row['PatientID']}/{row['SeriesInstanceUID']}"
+        self.folders[series_id] = _resource(
+            FileBrowserFolder, id=series_id, path=path
+        )
+        series = {k: v for k, v in row.items() if k not in ("folder_id", "pacs_id")}
+        self.series[series_id] = _resource(
+            PACSSeries,
+            **series,
+            pacs_identifier="FAKE",
+            folder=f"{self.url}/api/v1/filebrowser/{series_id}/",
+        )
+        return row
+
+    def add_file(self, folder_id: int, data: bytes):
+        """
+        Add a file to the folder of a series, e.g. a DICOM file.
+        """
+        self.files[folder_id] = data
+
+    def add_plugin(
+        self,
+        name: str,
+        version: str,
+        plugin_type: str = "ds",
+        parameters: Optional[Mapping[str, str]] = None,
+    ) -> dict:
+        """
+        Add a plugin.
+
+        :param parameters: types of the optional parameters of the plugin by name, e.g. ``{"threshold": "float"}``
+        """
+        plugin_id = len(self.plugins) + 1
+        self.plugin_parameters[plugin_id] = [
+            _resource(
+                PluginParameter,
+                id=plugin_id * 100 + i,
+                name=param_name,
+                type=param_type,
+                optional=True,
+                flag=f"--{param_name}",
+                plugin=f"{self.url}/api/v1/plugins/{plugin_id}/",
+            )
+            for i, (param_name, param_type) in enumerate((parameters or {}).items())
+        ]
+        plugin = _resource(
+            Plugin,
+            id=plugin_id,
+            name=name,
+            version=version,
+            type=plugin_type,
+            creation_date=_CREATION_DATE,
+        )
+        self.plugins[plugin_id] = plugin
+        return plugin
+
+    def add_pipeline(self, name: str) -> dict:
+        pipeline_id = len(self.pipelines) + 1
+        pipeline = _resource(
+            Pipeline, id=pipeline_id, name=name, creation_date=_CREATION_DATE
+        )
+        self.pipelines[pipeline_id] = pipeline
+        return pipeline
+
+    @web.middleware
+    async def _inject_faults(self, request: web.Request, handler):
+        operation = request.match_info.route.name
+        self.calls[operation] += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if "Authorization" not in request.headers:
+            return web.json_response({"detail": "Unauthorized"}, status=401)
+        if status := self.errors.get(operation, None):
+            return web.json_response({"detail": "Injected error"}, status=status)
+        if self._random.random() < self.error_rate:
+            return web.json_response({"detail": "Injected error"}, status=500)
+        return await handler(request)
+
+    async def _pacs_series_retrieve(self, request: web.Request) -> web.Response:
+        return _get_or_404(self.series, request)
+
+    async def _pacs_series_search_list(self, request: web.Request) -> web.Response:
+        since = request.query.get("min_creation_date", None)
+        until = request.query.get("max_creation_date", None)
+        series = [
+            s
+            for s in self.series.values()
+            if (since is None or _parse_date(since) <= _parse_date(s["creation_date"]))
+            and (until is None or _parse_date(s["creation_date"]) <= _parse_date(until))
+        ]
+        return _paginate(request, series)
+
+    async def _filebrowser_retrieve(self, request: web.Request) -> web.Response:
+        return _get_or_404(self.folders, request)
+
+    async def _filebrowser_files_list(self, request: web.Request) -> web.Response:
+        folder_id = int(request.match_info["id"])
+        if folder_id not in self.folders:
+            return web.json_response({"detail": "Not found."}, status=404)
+        files = []
+        if folder_id in self.files:
+            files.append(
+                _resource(
+                    FileBrowserFile,
+                    id=folder_id,
+                    fname=f"{self.folders[folder_id]['path']}/0001.dcm",
+                    fsize=len(self.files[folder_id]),
+                    file_resource=f"{self.url}/api/v1/files/{folder_id}/0001.dcm",
+                )
+            )
+        return _paginate(request, files)
+
+    async def _file_resource(self, request: web.Request) -> web.Response:
+        data = self.files.get(int(request.match_info["id"]), None)
+        if data is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        if request.http_range.stop is None:
+            return web.Response(body=data)
+        return web.Response(body=data[request.http_range], status=206)
+
+    async def _plugins_list(self, request: web.Request) -> web.Response:
+        return _paginate(request, list(self.plugins.values()))
+
+    async def _plugins_search_list(self, request: web.Request) -> web.Response:
+        plugins = [
+            p
+            for p in self.plugins.values()
+            if p["name"] == request.query.get("name", p["name"])
+            and p["version"] == request.query.get("version", p["version"])
+        ]
+        return _paginate(request, plugins)
+
+    async def _plugins_parameters_list(self, request: web.Request) -> web.Response:
+        parameters = self.plugin_parameters.get(int(request.match_info["id"]), None)
+        if parameters is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        return _paginate(request, parameters)
+
+    async def _pipelines_list(self, request: web.Request) -> web.Response:
+        return _paginate(request, list(self.pipelines.values()))
+
+    async def _plugins_instances_create(self, request: web.Request) -> web.Response:
+        plugin = self.plugins.get(int(request.match_info["id"]), None)
+        if plugin is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        body = await request.json()
+        previous_id = body.get("previous_id", None)
+        if previous_id is None:
+            feed_id = len(self.feeds) + 1
+            self.feeds[feed_id] = _resource(Feed, id=feed_id, name="")
+        else:
+            feed_id = self.plugin_instances[previous_id]["feed_id"]
+        inst_id = len(self.plugin_instances) + 1
+        inst = _resource(
+            PluginInstance,
+            id=inst_id,
+            previous_id=previous_id,
+            plugin_id=plugin["id"],
+            plugin_name=plugin["name"],
+            plugin_version=plugin["version"],
+            plugin_type=plugin["type"],
+            feed_id=feed_id,
+            feed=f"{self.url}/api/v1/{feed_id}/",
+        )
+        self.plugin_instances[inst_id] = inst
+        self.request_bodies[("plugins_instances_create", inst_id)] = body
+        return web.json_response(inst, status=201)
+
+    async def _pipelines_workflows_create(self, request: web.Request) -> web.Response:
+        pipeline = self.pipelines.get(int(request.match_info["id"]), None)
+        if pipeline is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        body = await request.json()
+        workflow_id = len(self.workflows) + 1
+        workflow = _resource(
+            Workflow,
+            id=workflow_id,
+            title=body.get("title", None),
+            pipeline_id=pipeline["id"],
+            pipeline_name=pipeline["name"],
+        )
+        self.workflows[workflow_id] = workflow
+        self.request_bodies[("pipelines_workflows_create", workflow_id)] = body
+        return web.json_response(workflow, status=201)
+
+    async def _root_update(self, request: web.Request) -> web.Response:
+        feed = self.feeds.get(int(request.match_info["id"]), None)
+        if feed is None:
+            return web.json_response({"detail": "Not found."}, status=404)
+        feed["name"] = (await request.json())["name"]
+        return web.json_response(feed)
+
+
+def _get_or_404(resources: Mapping[int, dict], request: web.Request) -> web.Response:
+    resource = resources.get(int(request.match_info["id"]), None)
+    if resource is None:
+        return web.json_response({"detail": "Not found."}, status=404)
+    return web.json_response(resource)
+
+
+def _paginate(request: web.Request, items: list[dict]) -> web.Response:
+    limit = int(request.query.get("limit", 10))
+    offset = int(request.query.get("offset", 0))
+    end = offset + limit
+    next_url = (
+        str(request.url.update_query(offset=end)) if end < len(items) else None
+    )
+    return web.json_response(
+        {
+            "count": len(items),
+            "next": next_url,
+            "previous": None,
+            "results": items[offset:end],
+        }
+    )
+
+
+def _parse_date(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _resource(model: type[BaseModel], **values) -> dict:
+    """
+    Create the JSON representation of a *CUBE* resource, filling in the
+    fields which were not given with placeholder values.
+    """
+    return {**_template(model), **values}
+
+
+_TEMPLATES: dict[type[BaseModel], dict] = {}
+
+
+def _template(model: type[BaseModel]) -> dict:
+    template = _TEMPLATES.get(model, None)
+    if template is None:
+        template = {
+            field.alias or name: _placeholder(field.annotation)
+            for name, field in model.model_fields.items()
+        }
+        _TEMPLATES[model] = template
+    return template
+
+
+def _placeholder(annotation: Any) -> Any:
+    if typing.get_origin(annotation) is typing.Annotated:
+        return _placeholder(typing.get_args(annotation)[0])
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        if type(None) in typing.get_args(annotation):
+            return None
+        return _placeholder(typing.get_args(annotation)[0])
+    if annotation is datetime.datetime:
+        return _CREATION_DATE
+    if annotation is datetime.date:
+        return _CREATION_DATE[:10]
+    if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+        return next(iter(annotation)).value
+    if annotation is bool:
+        return False
+    if annotation is int:
+        return 0
+    return ""
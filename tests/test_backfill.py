@@ -0,0 +1,122 @@
+"""
+Tests of :mod:`serie.backfill` against :class:`FakeCube`.
+"""
+
+import datetime
+import json
+
+import pytest
+import pytest_asyncio
+from fastapi import status
+
+from serie.backfill import BackfillInterrupted, Checkpoint, backfill
+from serie.handler import EventHandler
+from serie.settings import Settings
+from tests.fake_cube import FakeCube
+
+_SINCE = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+_UNTIL = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest_asyncio.fixture
+async def cube(tmp_path) -> FakeCube:
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        for i in range(7):
+            cube.add_series(SeriesDescription="Chest" if i % 2 else "SAG MPRAGE")
+        # outside the range of creation dates
+        cube.add_series(creation_date="2023-07-25T11:59:49.004096-04:00")
+        yield cube
+
+
+@pytest_asyncio.fixture
+async def handler(cube, tmp_path) -> EventHandler:
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "rules": [
+                    {
+                        "name": "mprage",
+                        "match": [{"tag": "SeriesDescription", "regex": ".*MPRAGE.*"}],
+                        "jobs": [{"type": "plugin", "name": "pl-dcm2niix"}],
+                        "feed_name_template": "{SeriesInstanceUID}",
+                    }
+                ]
+            }
+        )
+    )
+    handler = EventHandler(Settings(chris_host=cube.url + "/", rules_file=rules_file))
+    yield handler
+    await handler.close()
+
+
+@pytest.mark.asyncio
+async def test_backfill(cube, handler, tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint = Checkpoint.load_or_create(checkpoint_path, _SINCE, _UNTIL)
+    await backfill(handler, "Basic x", checkpoint, checkpoint_path, page_size=3)
+    assert len(cube.feeds) == 4
+    assert cube.calls["pacs_series_search_list"] == 3
+
+    saved = Checkpoint.load_or_create(checkpoint_path, _SINCE, datetime.datetime.now())
+    assert saved == Checkpoint(_SINCE, _UNTIL, offset=7, handled=7, matched=4)
+
+
+@pytest.mark.asyncio
+async def test_backfill_skips_handled_series(cube, handler):
+    await backfill(handler, "Basic x", Checkpoint(_SINCE, _UNTIL))
+    creates = cube.calls["plugins_instances_create"]
+    await backfill(handler, "Basic x", Checkpoint(_SINCE, _UNTIL))
+    assert cube.calls["plugins_instances_create"] == creates
+    assert len(cube.feeds) == 4
+
+
+@pytest.mark.asyncio
+async def test_backfill_after_id(cube, handler):
+    await backfill(handler, "Basic x", Checkpoint(_SINCE, _UNTIL), after_id=4)
+    assert len(cube.feeds) == 2
+
+
+@pytest.mark.asyncio
+async def test_backfill_stops_before_unhandled_page(cube, handler, tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.json"
+    cube.errors["plugins_instances_create"] = status.HTTP_503_SERVICE_UNAVAILABLE
+    checkpoint = Checkpoint.load_or_create(checkpoint_path, _SINCE, _UNTIL)
+    with pytest.raises(BackfillInterrupted):
+        await backfill(handler, "Basic x", checkpoint, checkpoint_path, page_size=3)
+    assert not checkpoint_path.exists()
+
+    del cube.errors["plugins_instances_create"]
+    checkpoint = Checkpoint.load_or_create(checkpoint_path, _SINCE, _UNTIL)
+    await backfill(handler, "Basic x", checkpoint, checkpoint_path, page_size=3)
+    assert checkpoint.offset == 7
+    assert len(cube.feeds) == 4
+
+
+@pytest.mark.asyncio
+async def test_backfill_rejects_study_rules(cube, tmp_path):
+    rules_file = tmp_path / "study_rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "rules": [
+                    {
+                        "name": "study",
+                        "match": [{"tag": "SeriesDescription", "regex": ".*MPRAGE.*"}],
+                        "jobs": [{"type": "plugin", "name": "pl-dcm2niix"}],
+                        "feed_name_template": "{StudyInstanceUID}",
+                        "study_quiet_period": 0.01,
+                    }
+                ]
+            }
+        )
+    )
+    handler = EventHandler(Settings(chris_host=cube.url + "/", rules_file=rules_file))
+    try:
+        with pytest.raises(ValueError, match=r"study_quiet_period.*\['study'\]"):
+            await backfill(handler, "Basic x", Checkpoint(_SINCE, _UNTIL), page_size=3)
+    finally:
+        await handler.close()
+    assert len(cube.feeds) == 0
+    assert cube.calls["pacs_series_search_list"] == 0
@@ -0,0 +1,107 @@
+"""
+Tests of the pool of API clients of :class:`Clients`.
+"""
+
+import asyncio
+
+import pytest
+
+from serie.clients import Clients
+
+
+def _closed(api_client) -> bool:
+    return api_client.rest_client.pool_manager.closed
+
+
+async def _settle():
+    # closing is done by a task
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_clients_are_reused():
+    clients = Clients()
+    try:
+        a = clients.get_api_client("http://cube", "Basic a")
+        assert clients.get_api_client("http://cube", "Basic a") is a
+        assert clients.get_api_client("http://cube", "Basic b") is not a
+    finally:
+        await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_client_is_evicted():
+    clients = Clients(max_clients=2)
+    try:
+        a = clients.get_api_client("http://cube", "Basic a")
+        b = clients.get_api_client("http://cube", "Basic b")
+        clients.get_api_client("http://cube", "Basic a")
+        clients.get_api_client("http://cube", "Basic c")
+        await _settle()
+        assert _closed(b)
+        assert not _closed(a)
+        assert clients.get_api_client("http://cube", "Basic b") is not b
+    finally:
+        await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_client_is_evicted():
+    clients = Clients(idle_timeout=0.01)
+    try:
+        a = clients.get_api_client("http://cube", "Basic a")
+        await asyncio.sleep(0.02)
+        b = clients.get_api_client("http://cube", "Basic b")
+        await _settle()
+        assert _closed(a)
+        assert not _closed(b)
+    finally:
+        await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_evicted_client_is_closed_when_no_longer_used():
+    clients = Clients(max_clients=1)
+    used = asyncio.Queue()
+    release = asyncio.Event()
+
+    async def long_request(api_client):
+        await used.put(api_client)
+        await release.wait()
+
+    try:
+        request = asyncio.create_task(
+            clients.read("http://cube", "Basic a", long_request)
+        )
+        a = await used.get()
+        clients.get_api_client("http://cube", "Basic b")
+        await _settle()
+        assert not _closed(a)
+        release.set()
+        await request
+        await _settle()
+        assert _closed(a)
+    finally:
+        await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_close_closes_pooled_and_evicted_clients():
+    clients = Clients(max_clients=1)
+    release = asyncio.Event()
+
+    async def long_request(api_client):
+        await release.wait()
+
+    request = asyncio.create_task(
+        clients.read("http://cube", "Basic a", long_request)
+    )
+    await asyncio.sleep(0)
+    a = clients.get_api_client("http://cube", "Basic a")
+    b = clients.get_api_client("http://cube", "Basic b")
+    await clients.close()
+    assert _closed(a)
+    assert _closed(b)
+    release.set()
+    await request
@@ -0,0 +1,117 @@
+"""
+Tests of matching on DICOM header tags, see :mod:`serie.dicom_header`.
+"""
+
+import io
+
+import pytest
+from pydantic import ValidationError
+
+from aiochris_oag.exceptions import ServiceException
+from serie.clients import Clients
+from serie.dicom_header import parse_header
+from serie.handler import EventHandler
+from serie.models import DicomSeriesEvent, DicomSeriesMatcher, RoutingRule
+from serie.resilience import Resilience
+from serie.rules import RuleIndex
+from serie.settings import Settings
+from tests.fake_cube import FakeCube
+
+pydicom = pytest.importorskip("pydicom")
+
+
+def _dicom_file(**tags) -> bytes:
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian
+
+    ds = Dataset()
+    for keyword, value in tags.items():
+        setattr(ds, keyword, value)
+    ds.Rows = 512
+    ds.Columns = 512
+    ds.BitsAllocated = 16
+    ds.PixelData = bytes(512 * 512 * 2)
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+    ds.file_meta.MediaStorageSOPInstanceUID = "1.2.3"
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def test_parse_header_from_prefix():
+    data = _dicom_file(
+        BodyPartExamined="CHEST",
+        Manufacturer="SIEMENS",
+        ImageType=["ORIGINAL", "PRIMARY"],
+    )
+    header = parse_header(data[:4096])
+    assert header["BodyPartExamined"] == "CHEST"
+    assert header["Manufacturer"] == "SIEMENS"
+    assert header["ImageType"] == "ORIGINAL\\PRIMARY"
+    assert "PixelData" not in header
+
+
+def test_tag_must_be_dicom_keyword():
+    matcher = DicomSeriesMatcher(tag="BodyPartExamined", regex="CHEST")
+    assert matcher.tag == "BodyPartExamined"
+    with pytest.raises(ValidationError):
+        DicomSeriesMatcher(tag="BodyPartExamine", regex="CHEST")
+
+
+@pytest.mark.asyncio
+async def test_rules_share_one_read_of_header():
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        chest = cube.add_series()
+        cube.add_file(chest["folder_id"], _dicom_file(BodyPartExamined="CHEST"))
+        head = cube.add_series()
+        cube.add_file(head["folder_id"], _dicom_file(BodyPartExamined="HEAD"))
+
+        settings = Settings(chris_host=cube.url + "/", dicom_header_bytes=2048)
+        handler = EventHandler(settings)
+        handler.rule_index = RuleIndex(
+            [
+                RoutingRule(
+                    name=name,
+                    match=[
+                        {"tag": "Modality", "regex": "MR"},
+                        {"tag": "BodyPartExamined", "regex": "chest"},
+                    ],
+                    jobs=[{"type": "plugin", "name": "pl-dcm2niix"}],
+                    feed_name_template=name,
+                )
+                for name in ("a", "b")
+            ]
+        )
+        try:
+            chest_outcomes = await handler.handle_rules(
+                DicomSeriesEvent(hasura_id="1", data=chest), "Basic x"
+            )
+            head_outcomes = await handler.handle_rules(
+                DicomSeriesEvent(hasura_id="2", data=head), "Basic x"
+            )
+        finally:
+            await handler.close()
+    assert [o.status_code for o in chest_outcomes] == [201, 201]
+    assert [o.status_code for o in head_outcomes] == [204, 204]
+    assert cube.calls["file_resource"] == 2
+    assert cube.calls["filebrowser_files_list"] == 2
+
+
+@pytest.mark.asyncio
+async def test_error_reading_header_is_retried():
+    async with FakeCube() as cube:
+        series = cube.add_series()
+        cube.add_file(series["folder_id"], _dicom_file(BodyPartExamined="CHEST"))
+        cube.errors["file_resource"] = 503
+        clients = Clients(resilience=Resilience(attempts=2, base_delay=0.001))
+        try:
+            with pytest.raises(ServiceException):
+                await clients.get_dicom_header(
+                    cube.url, "Basic x", series["folder_id"], "1.2.3"
+                )
+        finally:
+            await clients.close()
+    assert cube.calls["file_resource"] == 2
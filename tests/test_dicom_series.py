@@ -0,0 +1,336 @@
+"""
+Tests of ``/dicom_series/`` against :class:`FakeCube`, which do not need miniChRIS.
+"""
+
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import status
+
+from aiochris_oag import Pipeline, PluginInstance
+
+from serie.actions import FoundPipeline
+from serie.clients import Clients
+from serie.handler import EventHandler
+from serie.models import ChrisRunnableRequest
+from serie.settings import get_settings
+from tests.benchmark import create_app, make_payloads, replay
+from tests.fake_cube import FakeCube
+
+
+@pytest_asyncio.fixture
+async def cube(monkeypatch) -> FakeCube:
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        monkeypatch.setenv("CHRIS_HOST", cube.url + "/")
+        yield cube
+    get_settings.cache_clear()
+
+
+async def post(payload: dict, path: str = "/dicom_series/") -> httpx.Response:
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            return await client.post(
+                path, json=payload, headers={"Authorization": "Basic x"}
+            )
+
+
+@pytest.mark.asyncio
+async def test_creates_feed(cube):
+    row = cube.add_series()
+    payload = make_payloads([row], ".*MPRAGE.*")[0]
+    res = await post(payload)
+    assert res.status_code == status.HTTP_201_CREATED
+    assert res.json()["feed"] == f"{cube.url}/api/v1/1/"
+    assert cube.feeds[1]["name"] == f"SERIE benchmark {row['SeriesInstanceUID']}"
+    assert [inst["plugin_name"] for inst in cube.plugin_instances.values()] == [
+        "pl-dircopy",
+        "pl-unstack-folders",
+        "pl-dcm2niix",
+    ]
+    assert cube.request_bodies[("plugins_instances_create", 1)]["dir"].endswith(
+        row["SeriesInstanceUID"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_does_not_call_cube_if_not_matched(cube):
+    payload = make_payloads([cube.add_series()], ".*Chest.*")[0]
+    res = await post(payload)
+    assert res.status_code == status.HTTP_204_NO_CONTENT
+    assert sum(cube.calls.values()) == 0
+
+
+@pytest.mark.asyncio
+async def test_creates_pipeline_as_one_workflow(cube):
+    cube.add_pipeline("Leg Length Discrepency inference")
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["jobs"] = [{"type": "pipeline", "name": "Leg Length Discrepency inference"}]
+    res = await post(payload)
+    assert res.status_code == status.HTTP_201_CREATED
+    assert cube.calls["pipelines_workflows_create"] == 1
+    assert cube.request_bodies[("pipelines_workflows_create", 1)] == {
+        "title": "Leg Length Discrepency inference",
+        "previous_plugin_inst_id": 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_missing_plugin(cube):
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["jobs"] = [{"type": "plugin", "name": "pl-i-do-not-exist"}]
+    res = await post(payload)
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+    assert res.json()["data"]["errors"][0]["reason"] == "plugin not found"
+    assert cube.calls["plugins_instances_create"] == 0
+
+
+@pytest.mark.asyncio
+async def test_invalid_plugin_parameters(cube):
+    cube.add_plugin("pl-threshold", "1.0.0", parameters={"threshold": "float"})
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["jobs"] = [
+        {"type": "plugin", "name": "pl-threshold", "params": {"threshold": "high"}},
+        {"type": "plugin", "name": "pl-threshold", "params": {"treshold": 0.5}},
+    ]
+    res = await post(payload)
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+    assert [e["reason"] for e in res.json()["data"]["errors"]] == [
+        "`high` is not a valid argument for parameter `threshold` of type float",
+        "`treshold` is not a valid parameter",
+    ]
+    assert cube.calls["plugins_instances_create"] == 0
+
+
+@pytest.mark.asyncio
+async def test_valid_plugin_parameters(cube):
+    cube.add_plugin("pl-threshold", "1.0.0", parameters={"threshold": "float"})
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["jobs"] = [
+        {"type": "plugin", "name": "pl-threshold", "params": {"threshold": 1}}
+    ]
+    res = await post(payload)
+    assert res.status_code == status.HTTP_201_CREATED
+    assert cube.request_bodies[("plugins_instances_create", 3)] == {
+        "previous_id": 2,
+        "threshold": 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_rejected_credentials(cube):
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            res = await client.post(
+                "/dicom_series/", json=payload, headers={"Authorization": "Basic x"}
+            )
+            assert res.status_code == status.HTTP_201_CREATED
+            cube.errors["plugins_instances_create"] = status.HTTP_401_UNAUTHORIZED
+            res = await client.post(
+                "/dicom_series/",
+                json={**payload, "hasura_id": "again"},
+                headers={"Authorization": "Basic rejected"},
+            )
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_series_not_found(cube):
+    row = cube.add_series()
+    row["id"] = 404
+    res = await post(make_payloads([row], ".*MPRAGE.*")[0])
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+    assert res.json()["error"] == "DICOM series not found"
+
+
+@pytest.mark.asyncio
+async def test_replay(cube):
+    rows = [cube.add_series() for _ in range(20)]
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        result = await replay("match", app, make_payloads(rows, ".*MPRAGE.*"), 8)
+    assert result.status_codes == {status.HTTP_201_CREATED: 20}
+    assert len(cube.feeds) == 20
+    assert result.percentile(50) <= result.percentile(99)
+
+
+@pytest.mark.asyncio
+async def test_batch(cube):
+    rows = [
+        cube.add_series(),
+        cube.add_series(SeriesDescription="Chest"),
+        cube.add_series(),
+    ]
+    payload = make_payloads(rows, ".*MPRAGE.*")[0]
+    payload.update(hasura_id="batch", data=rows)
+    res = await post(payload, "/dicom_series/batch/")
+    assert res.status_code == status.HTTP_200_OK
+    assert [(r["id"], r["status_code"]) for r in res.json()] == [
+        (1, status.HTTP_201_CREATED),
+        (2, status.HTTP_204_NO_CONTENT),
+        (3, status.HTTP_201_CREATED),
+    ]
+    assert len(cube.feeds) == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_errors_per_series(cube, monkeypatch):
+    handle_matched = EventHandler.handle_matched
+
+    async def fail_for_first_series(self, payload, matcher, authorization):
+        if payload.data.id == 1:
+            raise RuntimeError("bug")
+        return await handle_matched(self, payload, matcher, authorization)
+
+    monkeypatch.setattr(EventHandler, "handle_matched", fail_for_first_series)
+    rows = [cube.add_series(), cube.add_series()]
+    payload = make_payloads(rows, ".*MPRAGE.*")[0]
+    payload.update(hasura_id="batch", data=rows)
+    res = await post(payload, "/dicom_series/batch/")
+    assert res.status_code == status.HTTP_200_OK
+    assert [(r["id"], r["status_code"]) for r in res.json()] == [
+        (1, status.HTTP_500_INTERNAL_SERVER_ERROR),
+        (2, status.HTTP_201_CREATED),
+    ]
+    assert len(cube.feeds) == 1
+
+
+@pytest.mark.asyncio
+async def test_resumes_partially_created_feed(cube):
+    cube.add_pipeline("Leg Length Discrepency inference")
+    cube.errors["pipelines_workflows_create"] = status.HTTP_503_SERVICE_UNAVAILABLE
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["jobs"] = [{"type": "pipeline", "name": "Leg Length Discrepency inference"}]
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            headers = {"Authorization": "Basic x"}
+            res = await client.post("/dicom_series/", json=payload, headers=headers)
+            assert res.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+            del cube.errors["pipelines_workflows_create"]
+            res = await client.post("/dicom_series/", json=payload, headers=headers)
+    assert res.status_code == status.HTTP_201_CREATED
+    assert len(cube.feeds) == 1
+    assert len(cube.plugin_instances) == 2
+    assert len(cube.workflows) == 1
+
+
+@pytest.mark.asyncio
+async def test_sheds_load_with_retry_after(cube, monkeypatch):
+    cube.latency = 0.05
+    monkeypatch.setenv("ADMISSION_MAX_CONCURRENT", "1")
+    monkeypatch.setenv("ADMISSION_MAX_QUEUE", "0")
+    rows = [cube.add_series() for _ in range(3)]
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            responses = await asyncio.gather(
+                *(
+                    client.post(
+                        "/dicom_series/",
+                        json=payload,
+                        headers={"Authorization": "Basic x"},
+                    )
+                    for payload in make_payloads(rows, ".*MPRAGE.*")
+                )
+            )
+    codes = sorted(res.status_code for res in responses)
+    assert codes == [
+        status.HTTP_201_CREATED,
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+    ]
+    rejected = [res for res in responses if res.status_code == 503]
+    assert all(int(res.headers["Retry-After"]) >= 1 for res in rejected)
+    assert len(cube.feeds) == 1
+
+
+@pytest.mark.asyncio
+async def test_invalid_payload(cube):
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    assert (await post(payload)).status_code == status.HTTP_201_CREATED
+    payload["data"]["PatientSex"] = "not a sex"
+    res = await post(payload)
+    assert res.status_code == 422
+    assert res.json()["detail"][0]["loc"] == ["body", "data", "PatientSex"]
+
+
+def test_payload_is_documented(monkeypatch):
+    monkeypatch.setenv("CHRIS_HOST", "http://example.com/")
+    schema = create_app().openapi()
+    body = schema["paths"]["/dicom_series/"]["post"]["requestBody"]
+    payload_schema = body["content"]["application/json"]["schema"]
+    assert set(payload_schema["required"]) >= {"hasura_id", "data", "match", "jobs"}
+    refs = re.findall(r"#/components/schemas/(\w+)", json.dumps(payload_schema))
+    assert set(refs) <= set(schema["components"]["schemas"].keys())
+    get_settings.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_study_quiet_period_requires_async_jobs(cube):
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["study_quiet_period"] = 30.0
+    res = await post(payload)
+    assert res.status_code == 422
+    assert res.json()["detail"][0]["loc"] == ["body", "study_quiet_period"]
+    assert sum(cube.calls.values()) == 0
+
+
+def test_study_rules_require_async_jobs(tmp_path, monkeypatch):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "rules": [
+                    {
+                        "name": "study",
+                        "match": [{"tag": "Modality", "regex": "MR"}],
+                        "jobs": [{"type": "plugin", "name": "pl-dcm2niix"}],
+                        "feed_name_template": "{StudyInstanceUID}",
+                        "study_quiet_period": 30.0,
+                    }
+                ]
+            }
+        )
+    )
+    monkeypatch.setenv("CHRIS_HOST", "http://cube.example/")
+    monkeypatch.setenv("RULES_FILE", str(rules_file))
+    with pytest.raises(ValueError, match="requires ASYNC_JOBS"):
+        create_app()
+    monkeypatch.setenv("ASYNC_JOBS", "true")
+    create_app()
+    get_settings.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_workflow_title_is_truncated(cube):
+    name = "Leg Length Discrepency inference " * 4
+    cube.add_pipeline(name[:100])
+    pipeline = Pipeline.model_construct(id=1, name=name)
+    found = FoundPipeline(
+        pipeline, ChrisRunnableRequest(runnable_type="pipeline", name=name)
+    )
+    clients = Clients()
+    try:
+        await clients.write(
+            cube.url,
+            "Basic x",
+            lambda api_client: found.create_instance(
+                api_client, PluginInstance.model_construct(id=2)
+            ),
+        )
+    finally:
+        await clients.close()
+    body = cube.request_bodies[("pipelines_workflows_create", 1)]
+    assert body["title"] == name[:100]
@@ -0,0 +1,98 @@
+"""
+Tests of :mod:`serie.dry_run` against :class:`FakeCube`.
+"""
+
+import asyncio
+import datetime
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from serie.clients import Clients
+from serie.dry_run import dry_run
+from serie.models import DryRunRequest
+from serie.settings import get_settings
+from tests.benchmark import create_app
+from tests.fake_cube import FakeCube
+
+_MPRAGE = [{"tag": "SeriesDescription", "regex": ".*MPRAGE.*"}]
+
+
+@pytest_asyncio.fixture
+async def cube(monkeypatch) -> FakeCube:
+    async with FakeCube() as cube:
+        for i in range(25):
+            cube.add_series(SeriesDescription="Chest" if i % 2 else "SAG MPRAGE")
+        # outside the range of creation dates
+        cube.add_series(creation_date="2023-07-25T11:59:49.004096-04:00")
+        monkeypatch.setenv("CHRIS_HOST", cube.url + "/")
+        yield cube
+    get_settings.cache_clear()
+
+
+@pytest.mark.asyncio
+async def test_dry_run(cube):
+    request = DryRunRequest(
+        match=_MPRAGE,
+        since=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+        sample_size=5,
+    )
+    clients = Clients()
+    try:
+        result = await dry_run(clients, cube.url, "Basic x", request, page_size=10)
+    finally:
+        await clients.close()
+    assert result.scanned == 25
+    assert result.matched == 13
+    assert [s.id for s in result.sample] == [1, 3, 5, 7, 9]
+    assert result.unevaluated == []
+    assert cube.calls["pacs_series_search_list"] == 3
+    assert set(cube.calls.keys()) == {"pacs_series_search_list"}
+
+
+@pytest.mark.asyncio
+async def test_dry_run_endpoint(cube):
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            res = await client.post(
+                "/dicom_series/dry_run/",
+                json={
+                    "match": _MPRAGE + [{"tag": "BodyPartExamined", "regex": "HEAD"}],
+                    "jobs": [{"type": "plugin", "name": "pl-dcm2niix"}],
+                    "sample_size": 1,
+                },
+                headers={"Authorization": "Basic x"},
+            )
+    assert res.status_code == 200
+    result = res.json()
+    assert result["scanned"] == 26
+    assert result["matched"] == 14
+    assert result["sample"][0]["SeriesInstanceUID"].endswith(".1")
+    assert result["unevaluated"] == ["BodyPartExamined"]
+    assert set(cube.calls.keys()) == {"pacs_series_search_list"}
+
+
+@pytest.mark.asyncio
+async def test_dry_run_endpoint_is_admitted(cube, monkeypatch):
+    cube.latency = 0.05
+    monkeypatch.setenv("ADMISSION_MAX_CONCURRENT", "1")
+    monkeypatch.setenv("ADMISSION_MAX_QUEUE", "0")
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            responses = await asyncio.gather(
+                *(
+                    client.post(
+                        "/dicom_series/dry_run/",
+                        json={"match": _MPRAGE},
+                        headers={"Authorization": "Basic x"},
+                    )
+                    for _ in range(2)
+                )
+            )
+    codes = sorted(res.status_code for res in responses)
+    assert codes == [200, 503]
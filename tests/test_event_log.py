@@ -0,0 +1,169 @@
+"""
+Tests of :mod:`serie.event_log` against :class:`FakeCube`.
+"""
+
+import asyncio
+import io
+import json
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from serie import event_log
+from serie.settings import get_settings
+from tests.benchmark import create_app, make_payloads
+from tests.fake_cube import FakeCube
+
+
+@pytest_asyncio.fixture
+async def cube(monkeypatch) -> FakeCube:
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        monkeypatch.setenv("CHRIS_HOST", cube.url + "/")
+        yield cube
+    get_settings.cache_clear()
+
+
+async def post_and_read_log(
+    capsys, payload: dict, wait_for_job: bool = False, path: str = "/dicom_series/"
+) -> tuple[httpx.Response, list[dict]]:
+    capsys.readouterr()
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            res = await client.post(
+                path, json=payload, headers={"Authorization": "Basic x"}
+            )
+            while wait_for_job:
+                job = await client.get(
+                    res.json()["status"], headers={"Authorization": "Basic x"}
+                )
+                wait_for_job = job.json()["state"] in ("queued", "running")
+                await asyncio.sleep(0.01)
+    lines = capsys.readouterr().err.splitlines()
+    return res, [json.loads(line) for line in lines if line.startswith("{")]
+
+
+@pytest.mark.asyncio
+async def test_logs_created_feed(cube, capsys):
+    row = cube.add_series()
+    res, records = await post_and_read_log(capsys, make_payloads([row], ".*MPRAGE.*")[0])
+    assert res.status_code == 201
+    assert len(records) == 1
+    record = records[0]
+    assert record["hasura_id"] == make_payloads([row], ".*MPRAGE.*")[0]["hasura_id"]
+    assert record["series_id"] == row["id"]
+    assert record["matched"] is True
+    assert record["status_code"] == 201
+    assert record["feed"] == f"{cube.url}/api/v1/1/"
+    assert record["error"] is None
+    calls = {(c["method"], c["path"]): c["status"] for c in record["cube_calls"]}
+    assert calls[("GET", f"/api/v1/pacs/series/{row['id']}/")] == 200
+    assert calls[("POST", "/api/v1/plugins/3/instances/")] == 201
+    assert all(c["duration"] >= 0 for c in record["cube_calls"])
+    assert record["cache"]["series"] == {"miss": 1}
+
+
+@pytest.mark.asyncio
+async def test_logs_unmatched_series(cube, capsys):
+    payload = make_payloads([cube.add_series()], ".*Chest.*")[0]
+    res, records = await post_and_read_log(capsys, payload)
+    assert res.status_code == 204
+    assert len(records) == 1
+    assert records[0]["matched"] is False
+    assert records[0]["status_code"] == 204
+    assert records[0]["cube_calls"] == []
+
+
+@pytest.mark.asyncio
+async def test_logs_async_job_when_done(cube, capsys, monkeypatch):
+    monkeypatch.setenv("ASYNC_JOBS", "true")
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    res, records = await post_and_read_log(capsys, payload, wait_for_job=True)
+    assert res.status_code == 202
+    assert len(records) == 1
+    assert records[0]["status_code"] == 201
+    assert records[0]["feed"] == f"{cube.url}/api/v1/1/"
+    assert len(records[0]["cube_calls"]) > 0
+
+
+
+@pytest.mark.asyncio
+async def test_logs_every_row_of_batch(cube, capsys):
+    rows = [cube.add_series(), cube.add_series(SeriesDescription="Chest")]
+    payload = make_payloads(rows, ".*MPRAGE.*")[0]
+    payload.update(hasura_id="batch", data=rows)
+    res, records = await post_and_read_log(capsys, payload, path="/dicom_series/batch/")
+    assert res.status_code == 200
+    records.sort(key=lambda r: r["series_id"])
+    assert [(r["hasura_id"], r["matched"], r["status_code"]) for r in records] == [
+        (f"batch:{rows[0]['id']}", True, 201),
+        (f"batch:{rows[1]['id']}", False, 204),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_logs_every_rule(cube, capsys, tmp_path, monkeypatch):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "rules": [
+                    {
+                        "name": name,
+                        "match": [{"tag": "SeriesDescription", "regex": regex}],
+                        "jobs": [{"type": "plugin", "name": "pl-dcm2niix"}],
+                        "feed_name_template": name,
+                    }
+                    for name, regex in (("mprage", ".*MPRAGE.*"), ("sag", "SAG.*"))
+                ]
+            }
+        )
+    )
+    monkeypatch.setenv("RULES_FILE", str(rules_file))
+    row = cube.add_series()
+    res, records = await post_and_read_log(
+        capsys, {"hasura_id": "e1", "data": row}, path="/dicom_series/rules/"
+    )
+    assert res.status_code == 200
+    records.sort(key=lambda r: r["hasura_id"])
+    assert [(r["hasura_id"], r["status_code"]) for r in records] == [
+        ("e1:mprage", 201),
+        ("e1:sag", 201),
+    ]
+    assert all(r["series_id"] == row["id"] for r in records)
+
+    chest = cube.add_series(SeriesDescription="Chest")
+    res, records = await post_and_read_log(
+        capsys, {"hasura_id": "e2", "data": chest}, path="/dicom_series/rules/"
+    )
+    assert res.status_code == 204
+    assert [(r["hasura_id"], r["matched"], r["status_code"]) for r in records] == [
+        ("e2", False, 204)
+    ]
+
+
+def test_does_not_trace_if_disabled():
+    with event_log.trace_event("abc", 1) as trace:
+        assert trace is None
+
+
+def test_writes_json_lines():
+    stream = io.StringIO()
+    listener = event_log.EventLogListener(stream)
+    listener.start()
+    try:
+        with event_log.trace_event("abc", 1):
+            event_log.record_cube_call("GET", "http://cube/api/v1/?limit=1", 200, 0.5)
+            event_log.record_cache("plugin", "hit", 2)
+            event_log.record_outcome(204, None)
+    finally:
+        listener.stop()
+    record = json.loads(stream.getvalue())
+    assert record["event"] == "dicom_series"
+    assert record["cube_calls"] == [
+        {"method": "GET", "path": "/api/v1/", "status": 200, "duration": 0.5}
+    ]
+    assert record["cache"] == {"plugin": {"hit": 2}}
@@ -0,0 +1,44 @@
+"""
+Unit tests for recording handled events.
+"""
+
+import pytest
+import pytest_asyncio
+
+from serie.idempotency import (
+    IdempotencyStore,
+    MemoryIdempotencyStore,
+    SqliteIdempotencyStore,
+    fingerprint,
+)
+from serie.models import ChrisRunnableRequest, CreatedFeed
+
+_FEED = CreatedFeed(feed="https://example.com/api/v1/100/")
+
+
+@pytest_asyncio.fixture(params=["memory", "sqlite"])
+async def store(request, tmp_path) -> IdempotencyStore:
+    if request.param == "memory":
+        store = MemoryIdempotencyStore()
+    else:
+        store = SqliteIdempotencyStore(tmp_path / "idempotency.sqlite3")
+    yield store
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_repeats_return_original_feed(store: IdempotencyStore):
+    fp = fingerprint("1.2.3", [ChrisRunnableRequest(name="pl-dcm2niix")])
+    assert await store.get("event-1", fp) is None
+    await store.put("event-1", fp, _FEED)
+    assert await store.get("event-1", "other") == _FEED
+    assert await store.get("event-2", fp) == _FEED
+    assert await store.get("event-2", "other") is None
+
+
+def test_fingerprint_ignores_job_order():
+    a = ChrisRunnableRequest(name="pl-a", params={"x": 1, "y": "z"})
+    b = ChrisRunnableRequest(name="pl-b")
+    assert fingerprint("1.2.3", [a, b]) == fingerprint("1.2.3", [b, a])
+    assert fingerprint("1.2.3", [a]) != fingerprint("1.2.3", [b])
+    assert fingerprint("1.2.3", [a], "Basic x") != fingerprint("1.2.3", [a], "Basic y")
@@ -0,0 +1,186 @@
+"""
+Tests of ingesting rows from a SQLite stand-in for the database of *CUBE*.
+"""
+
+import asyncio
+import json
+import sqlite3
+import sys
+
+import pytest
+
+from serie.ingest import Ingester, RowNotHandled, SqliteRowSource, open_row_source
+from serie.settings import get_settings
+from tests.benchmark import create_app
+from tests.fake_cube import FakeCube
+from tests.test_match import _EXAMPLE_ROW
+
+
+def _create_table(path):
+    with sqlite3.connect(path) as conn:
+        columns = ", ".join(f'"{k}"' for k in _EXAMPLE_ROW.keys() if k != "id")
+        conn.execute(f"CREATE TABLE pacsfiles_pacsseries (id INTEGER PRIMARY KEY, {columns})")
+
+
+def _insert(path, row: dict):
+    with sqlite3.connect(path) as conn:
+        columns = ", ".join(f'"{k}"' for k in row.keys())
+        placeholders = ", ".join("?" for _ in row)
+        conn.execute(
+            f"INSERT INTO pacsfiles_pacsseries ({columns}) VALUES ({placeholders})",
+            tuple(row.values()),
+        )
+
+
+@pytest.mark.asyncio
+async def test_ingests_new_rows_in_order(tmp_path):
+    db = tmp_path / "chris.sqlite3"
+    _create_table(db)
+    _insert(db, {**_EXAMPLE_ROW, "id": 1})
+    handled = []
+
+    async def handle(series):
+        handled.append(series.id)
+
+    ingester = Ingester(SqliteRowSource(db), handle, batch_size=2)
+    assert await ingester.ingest_once() == 0  # row 1 existed before starting
+    for i in range(2, 6):
+        _insert(db, {**_EXAMPLE_ROW, "id": i})
+    assert await ingester.ingest_once() == 2
+    assert await ingester.ingest_once() == 2
+    assert await ingester.ingest_once() == 0
+    assert handled == [2, 3, 4, 5]
+    await ingester.close()
+
+
+@pytest.mark.asyncio
+async def test_invalid_rows_are_skipped(tmp_path):
+    db = tmp_path / "chris.sqlite3"
+    _create_table(db)
+    _insert(db, {**_EXAMPLE_ROW, "id": 1, "PatientSex": "not a sex"})
+    _insert(db, {**_EXAMPLE_ROW, "id": 2})
+    handled = []
+
+    async def handle(series):
+        handled.append(series.id)
+
+    ingester = Ingester(SqliteRowSource(db), handle, start_after=0)
+    assert await ingester.ingest_once() == 2
+    assert handled == [2]
+    await ingester.close()
+
+
+@pytest.mark.asyncio
+async def test_rows_are_handled_again_after_a_failure(tmp_path):
+    db = tmp_path / "chris.sqlite3"
+    _create_table(db)
+    for i in range(1, 5):
+        _insert(db, {**_EXAMPLE_ROW, "id": i})
+    handled = []
+    failures = {2: RowNotHandled("CUBE is down")}
+
+    async def handle(series):
+        if (failure := failures.pop(series.id, None)) is not None:
+            raise failure
+        handled.append(series.id)
+
+    ingester = Ingester(SqliteRowSource(db), handle, start_after=0)
+    assert await ingester.ingest_once() == 1
+    assert ingester.last_id == 1
+    assert await ingester.ingest_once() == 3
+    assert ingester.last_id == 4
+    # rows after a failed row are handled again, and skipped by the idempotency store
+    assert handled == [1, 3, 4, 2, 3, 4]
+    await ingester.close()
+
+
+@pytest.mark.asyncio
+async def test_rows_which_raise_are_skipped(tmp_path):
+    db = tmp_path / "chris.sqlite3"
+    _create_table(db)
+    for i in range(1, 4):
+        _insert(db, {**_EXAMPLE_ROW, "id": i})
+    handled = []
+
+    async def handle(series):
+        handled.append(series.id)
+        if series.id == 2:
+            raise KeyError("PatientAge")
+
+    ingester = Ingester(SqliteRowSource(db), handle, start_after=0)
+    assert await ingester.ingest_once() == 3
+    assert ingester.last_id == 3
+    assert await ingester.ingest_once() == 0
+    assert handled == [1, 2, 3]
+    await ingester.close()
+
+
+@pytest.mark.asyncio
+async def test_resumes_from_saved_state(tmp_path):
+    db = tmp_path / "chris.sqlite3"
+    state = tmp_path / "ingest.state"
+    _create_table(db)
+    _insert(db, {**_EXAMPLE_ROW, "id": 1})
+    handled = []
+
+    async def handle(series):
+        handled.append(series.id)
+
+    ingester = Ingester(SqliteRowSource(db), handle, state_path=state)
+    assert await ingester.ingest_once() == 0
+    assert state.read_text() == "1"
+    await ingester.close()
+
+    # rows inserted while restarting are not skipped
+    _insert(db, {**_EXAMPLE_ROW, "id": 2})
+    _insert(db, {**_EXAMPLE_ROW, "id": 3})
+    ingester = Ingester(SqliteRowSource(db), handle, start_after=100, state_path=state)
+    assert await ingester.ingest_once() == 2
+    assert handled == [2, 3]
+    assert state.read_text() == "3"
+    await ingester.close()
+
+
+@pytest.mark.asyncio
+async def test_creates_feeds_for_ingested_rows(tmp_path, monkeypatch):
+    db = tmp_path / "chris.sqlite3"
+    _create_table(db)
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(
+        json.dumps(
+            {
+                "rules": [
+                    {
+                        "name": "mprage",
+                        "match": [{"tag": "SeriesDescription", "regex": ".*MPRAGE.*"}],
+                        "jobs": [{"type": "plugin", "name": "pl-dcm2niix"}],
+                        "feed_name_template": "{SeriesInstanceUID}",
+                    }
+                ]
+            }
+        )
+    )
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        monkeypatch.setenv("CHRIS_HOST", cube.url + "/")
+        monkeypatch.setenv("RULES_FILE", str(rules_file))
+        monkeypatch.setenv("INGEST_DATABASE_URL", f"sqlite://{db}")
+        monkeypatch.setenv("INGEST_AUTHORIZATION", "Basic x")
+        monkeypatch.setenv("INGEST_POLL_INTERVAL", "0.01")
+        app = create_app()
+        async with app.router.lifespan_context(app):
+            await asyncio.sleep(0.05)
+            _insert(db, cube.add_series())
+            _insert(db, cube.add_series(SeriesDescription="Chest"))
+            for _ in range(100):
+                if len(cube.feeds) > 0 and cube.calls["root_update"] > 0:
+                    break
+                await asyncio.sleep(0.01)
+        assert len(cube.feeds) == 1
+    get_settings.cache_clear()
+
+
+def test_postgres_requires_asyncpg(monkeypatch):
+    monkeypatch.setitem(sys.modules, "asyncpg", None)
+    with pytest.raises(ImportError, match=r"serie\[postgres\]"):
+        open_row_source("postgresql://chris:chris1234@db/chris", "serie_pacsseries")
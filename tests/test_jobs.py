@@ -0,0 +1,154 @@
+"""
+Tests of asynchronous jobs, see ``ASYNC_JOBS`` and :class:`serie.jobs.JobQueue`.
+"""
+
+import asyncio
+import contextlib
+import logging
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi import status
+
+from serie.jobs import JobQueue
+from serie.models import JobState
+from serie.settings import get_settings
+from tests.benchmark import create_app, make_payloads
+from tests.fake_cube import FakeCube
+
+_AUTH = {"Authorization": "Basic x"}
+
+
+@pytest_asyncio.fixture
+async def cube(monkeypatch) -> FakeCube:
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        monkeypatch.setenv("CHRIS_HOST", cube.url + "/")
+        monkeypatch.setenv("ASYNC_JOBS", "true")
+        yield cube
+    get_settings.cache_clear()
+
+
+@contextlib.asynccontextmanager
+async def serie_client():
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://serie") as client:
+            yield client
+
+
+async def wait_for_job(client: httpx.AsyncClient, path: str) -> dict:
+    while True:
+        res = await client.get(path, headers=_AUTH)
+        assert res.status_code == status.HTTP_200_OK
+        if res.json()["state"] not in ("queued", "running"):
+            return res.json()
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_job_status(cube):
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    async with serie_client() as client:
+        res = await client.post("/dicom_series/", json=payload, headers=_AUTH)
+        assert res.status_code == status.HTTP_202_ACCEPTED
+        assert res.json()["hasura_id"] == payload["hasura_id"]
+        job = await wait_for_job(client, res.json()["status"])
+        assert job["state"] == "finished"
+        assert job["status_code"] == status.HTTP_201_CREATED
+        assert job["result"]["feed"] == f"{cube.url}/api/v1/1/"
+
+        other = await client.get(
+            res.json()["status"], headers={"Authorization": "Basic y"}
+        )
+        assert other.status_code == status.HTTP_404_NOT_FOUND
+        unknown = await client.get("/dicom_series/jobs/unknown", headers=_AUTH)
+        assert unknown.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_queue_full(cube, monkeypatch):
+    cube.latency = 0.2
+    monkeypatch.setenv("JOB_WORKERS", "1")
+    monkeypatch.setenv("JOB_QUEUE_SIZE", "1")
+    payloads = make_payloads([cube.add_series() for _ in range(3)], ".*MPRAGE.*")
+    async with serie_client() as client:
+        responses = [
+            await client.post("/dicom_series/", json=payload, headers=_AUTH)
+            for payload in payloads
+        ]
+    assert responses[0].status_code == status.HTTP_202_ACCEPTED
+    # at most one job is running and one is queued
+    assert responses[-1].status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_resubmits_job_which_returned_503(cube, monkeypatch):
+    monkeypatch.setenv("CUBE_RETRY_ATTEMPTS", "1")
+    cube.errors["pacs_series_retrieve"] = status.HTTP_500_INTERNAL_SERVER_ERROR
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    async with serie_client() as client:
+        res = await client.post("/dicom_series/", json=payload, headers=_AUTH)
+        job = await wait_for_job(client, res.json()["status"])
+        assert job["status_code"] == status.HTTP_503_SERVICE_UNAVAILABLE
+
+        del cube.errors["pacs_series_retrieve"]
+        res = await client.post("/dicom_series/", json=payload, headers=_AUTH)
+        assert res.status_code == status.HTTP_202_ACCEPTED
+        job = await wait_for_job(client, res.json()["status"])
+        assert job["status_code"] == status.HTTP_201_CREATED
+
+
+@pytest.mark.asyncio
+async def test_close_waits_for_jobs():
+    jobs = JobQueue(workers=1)
+
+    async def job():
+        await asyncio.sleep(0.05)
+        return status.HTTP_201_CREATED, None
+
+    assert jobs.submit("a", job)
+    assert jobs.submit("b", job)
+    await jobs.close(timeout=5)
+    assert jobs.status("a").state == JobState.finished
+    assert jobs.status("b").state == JobState.finished
+    assert not jobs.submit("c", job)
+
+
+@pytest.mark.asyncio
+async def test_close_logs_abandoned_jobs(caplog):
+    jobs = JobQueue(workers=1)
+
+    async def job():
+        await asyncio.sleep(10)
+        return status.HTTP_201_CREATED, None
+
+    jobs.submit("a", job)
+    jobs.submit("b", job)
+    with caplog.at_level(logging.ERROR, logger="serie.jobs"):
+        await jobs.close(timeout=0.01)
+    assert sorted(r.args for r in caplog.records) == [("a",), ("b",)]
+
+
+@pytest.mark.asyncio
+async def test_redelivered_study_member_is_not_grouped_again(cube, monkeypatch):
+    monkeypatch.setenv("PLUGIN_CACHE_NEGATIVE_TTL", "0.01")
+    payload = make_payloads([cube.add_series()], ".*MPRAGE.*")[0]
+    payload["jobs"] = [{"type": "plugin", "name": "pl-late"}]
+    payload["study_quiet_period"] = 0.01
+    async with serie_client() as client:
+        res = await client.post("/dicom_series/", json=payload, headers=_AUTH)
+        job = await wait_for_job(client, res.json()["status"])
+        assert job["status_code"] == status.HTTP_400_BAD_REQUEST
+
+        # the event is finished, so it is not processed again even if it would succeed now
+        cube.add_plugin("pl-late", "1.0.0")
+        await asyncio.sleep(0.02)
+        res = await client.post("/dicom_series/", json=payload, headers=_AUTH)
+        assert res.status_code == status.HTTP_202_ACCEPTED
+        await asyncio.sleep(0.05)
+        job = await wait_for_job(client, res.json()["status"])
+    assert job["status_code"] == status.HTTP_400_BAD_REQUEST
+    assert len(cube.feeds) == 0
@@ -0,0 +1,70 @@
+"""
+Unit tests of :mod:`serie.limits`.
+"""
+
+import asyncio
+
+import pytest
+
+from serie.limits import AdmissionController, Overloaded, RequestLimiter
+
+
+@pytest.mark.asyncio
+async def test_limits_requests_per_credential_and_host():
+    limiter = RequestLimiter(per_host=3, per_credential=2)
+    outstanding = {"a": 0, "b": 0, "host": 0}
+    peak = {"a": 0, "b": 0, "host": 0}
+
+    async def request(auth: str):
+        async with limiter.limit("cube", auth):
+            for key in (auth, "host"):
+                outstanding[key] += 1
+                peak[key] = max(peak[key], outstanding[key])
+            await asyncio.sleep(0.01)
+            for key in (auth, "host"):
+                outstanding[key] -= 1
+
+    await asyncio.gather(*(request(auth) for auth in "ab" * 5))
+    assert peak == {"a": 2, "b": 2, "host": 3}
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_queue_is_full():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, max_wait=10.0)
+    release = asyncio.Event()
+
+    async def hold():
+        async with admission.admit():
+            await release.wait()
+
+    first = asyncio.create_task(hold())
+    queued = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded) as e:
+        async with admission.admit():
+            pass
+    assert e.value.reason == "queue"
+    assert e.value.retry_after >= 1
+    release.set()
+    await asyncio.gather(first, queued)
+
+
+@pytest.mark.asyncio
+async def test_rejects_after_waiting_too_long():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, max_wait=0.01)
+    release = asyncio.Event()
+
+    async def hold():
+        async with admission.admit():
+            await release.wait()
+
+    first = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    with pytest.raises(Overloaded) as e:
+        async with admission.admit():
+            pass
+    assert e.value.reason == "wait"
+    release.set()
+    await first
+    async with admission.admit():
+        pass
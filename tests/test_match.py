@@ -0,0 +1,115 @@
+"""
+Unit tests for matching DICOM series metadata against conditions.
+"""
+
+import re
+import sys
+
+import pytest
+from pydantic import ValidationError
+
+from serie.dicom_series_metadata import DicomSeriesMetadataName
+from serie.match import compile_matcher, required_literals
+from serie.models import RawPacsSeries, DicomSeriesMatcher
+
+_EXAMPLE_ROW = {
+    "id": 6,
+    "creation_date": "2024-07-25T11:59:49.004096-04:00",
+    "PatientID": "1449c1d",
+    "PatientName": "anonymized",
+    "PatientBirthDate": "2009-07-01",
+    "PatientAge": 1096,
+    "PatientSex": "M",
+    "StudyDate": "2013-03-08",
+    "AccessionNumber": "98edede8b2",
+    "Modality": "MR",
+    "ProtocolName": "SAG MPRAGE 220 FOV",
+    "StudyInstanceUID": "1.2.840.113845.11.1000000001785349915.20130308061609.6346698",
+    "StudyDescription": "MR-Brain w/o Contrast",
+    "SeriesInstanceUID": "1.3.12.2.1107.5.2.19.45152.2013030808061520200285270.0.0.0",
+    "SeriesDescription": "SAG MPRAGE 220 FOV",
+    "folder_id": 11,
+    "pacs_id": 3,
+}
+
+
+@pytest.fixture
+def example_row() -> RawPacsSeries:
+    return RawPacsSeries.model_validate(_EXAMPLE_ROW)
+
+
+@pytest.mark.parametrize(
+    "tag, regex, expected",
+    [
+        (DicomSeriesMetadataName.SeriesDescription, r".*MPRAGE.*", True),
+        (DicomSeriesMetadataName.SeriesDescription, r".*Chest.*", False),
+        (DicomSeriesMetadataName.StudyDate, r"2013-03-.*", True),
+        (DicomSeriesMetadataName.PatientSex, r"M", True),
+        # cannot be evaluated without resolving the series, so it is skipped
+        (DicomSeriesMetadataName.series_dir, r"nothing", True),
+    ],
+)
+def test_prematch(example_row, tag, regex, expected):
+    condition = DicomSeriesMatcher(tag=tag, regex=regex)
+    assert compile_matcher([condition]).prematch(example_row) is expected
+
+
+@pytest.mark.parametrize(
+    "regex, case_sensitive, expected",
+    [
+        (r".*mprage.*", False, True),
+        (r".*mprage.*", True, False),
+        (r".*MPRAGE.*", True, True),
+    ],
+)
+def test_case_sensitivity(example_row, regex, case_sensitive, expected):
+    condition = DicomSeriesMatcher(
+        tag="SeriesDescription", regex=regex, case_sensitive=case_sensitive
+    )
+    assert compile_matcher([condition]).prematch(example_row) is expected
+
+
+
+@pytest.mark.parametrize(
+    "value, regex",
+    [
+        ("\u017fAG MPRAGE", r".*sag.*"),  # LATIN SMALL LETTER LONG S
+        ("\u212aNEE", r".*knee.*"),  # KELVIN SIGN
+    ],
+)
+def test_ignore_case_of_non_ascii_values(value, regex):
+    row = RawPacsSeries.model_validate({**_EXAMPLE_ROW, "SeriesDescription": value})
+    condition = DicomSeriesMatcher(tag="SeriesDescription", regex=regex)
+    assert compile_matcher([condition]).prematch(row)
+
+
+@pytest.mark.parametrize(
+    "regex, expected",
+    [
+        (r".*(Chest CT).*", ("Chest CT",)),
+        (r"SAG (MPRAGE|T1) \d+ FOV", ("SAG ", " FOV")),
+        (r"(MR|CT)", ()),
+        (r"(?:XR )?Posteroanterior.*", ("Posteroanterior",)),
+        (r"a(bc)+d", ("bc", "a", "d")),
+    ],
+)
+def test_required_literals(regex, expected):
+    assert required_literals(re.compile(regex)) == expected
+
+
+def test_matcher_orders_conditions_by_cost(example_row):
+    matcher = compile_matcher(
+        [
+            DicomSeriesMatcher(tag="Modality", regex="MR"),
+            DicomSeriesMatcher(tag="StudyDescription", regex=".*brain.*"),
+            DicomSeriesMatcher(tag="PatientSex", regex="F"),
+        ]
+    )
+    assert not matcher.prematch(example_row)
+    assert matcher.conditions[0].tag.value == "StudyDescription"
+
+
+def test_header_tags_require_pydicom(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pydicom.datadict", None)
+    with pytest.raises(ValidationError, match=r"serie\[dicom\]"):
+        DicomSeriesMatcher(tag="BodyPartExamined", regex="CHEST")
@@ -0,0 +1,165 @@
+"""
+Unit tests for the caching behavior of :class:`PluginCatalog`.
+"""
+
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+
+from serie.clients import Clients
+from serie.plugin_catalog import PluginCatalog
+
+_HOST = "http://chris:8000/api/v1"
+
+
+def _plugin(name: str, version: str, day: int):
+    return SimpleNamespace(
+        name=name, version=version, creation_date=datetime.datetime(2024, 1, day)
+    )
+
+
+class _CountingFetcher:
+    def __init__(self, *plugins):
+        self.plugins = list(plugins)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        return self.plugins
+
+
+@pytest.mark.asyncio
+async def test_one_listing_resolves_many_plugins():
+    dircopy = _plugin("pl-dircopy", "2.1.1", 1)
+    old_unstack = _plugin("pl-unstack-folders", "1.0.0", 1)
+    new_unstack = _plugin("pl-unstack-folders", "1.1.0", 2)
+    fetch = _CountingFetcher(dircopy, new_unstack, old_unstack)
+    catalog = PluginCatalog()
+    found = await catalog.get_many(
+        _HOST,
+        [
+            ("pl-dircopy", None),
+            ("pl-unstack-folders", None),
+            ("pl-unstack-folders", "1.0.0"),
+            ("pl-i-do-not-exist", None),
+        ],
+        fetch,
+    )
+    assert found == [dircopy, new_unstack, old_unstack, None]
+    assert fetch.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_are_coalesced():
+    catalog = PluginCatalog()
+    plugin = _plugin("pl-dircopy", "2.1.1", 1)
+    fetch = _CountingFetcher(plugin)
+    specs = [("pl-dircopy", None)]
+    results = await asyncio.gather(
+        *(catalog.get_many(_HOST, specs, fetch) for _ in range(10))
+    )
+    assert results == [[plugin]] * 10
+    assert fetch.calls == 1
+    assert await catalog.get_many(_HOST, specs, fetch) == [plugin]
+    assert fetch.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_negative_entries_expire():
+    catalog = PluginCatalog(negative_ttl=0.01)
+    fetch = _CountingFetcher()
+    specs = [("pl-dcm2niix", None)]
+    assert await catalog.get_many(_HOST, specs, fetch) == [None]
+    assert await catalog.get_many(_HOST, specs, fetch) == [None]
+    assert fetch.calls == 1
+    await asyncio.sleep(0.02)
+    registered = _plugin("pl-dcm2niix", "0.1.0", 1)
+    fetch.plugins.append(registered)
+    assert await catalog.get_many(_HOST, specs, fetch) == [registered]
+    assert fetch.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_refreshing():
+    catalog = PluginCatalog(ttl=0.01, max_stale=60)
+    v1 = _plugin("pl-dylld", "1.0.0", 1)
+    v2 = _plugin("pl-dylld", "2.0.0", 2)
+    fetch = _CountingFetcher(v1)
+    specs = [("pl-dylld", None)]
+    assert await catalog.get_many(_HOST, specs, fetch) == [v1]
+    await asyncio.sleep(0.02)
+    fetch.plugins.append(v2)
+    assert await catalog.get_many(_HOST, specs, fetch) == [v1]
+    await asyncio.sleep(0.01)
+    assert await catalog.get_many(_HOST, specs, fetch) == [v2]
+    assert fetch.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_pipelines_are_found_by_name_only():
+    pipeline = SimpleNamespace(
+        name="Leg Length Discrepency inference",
+        creation_date=datetime.datetime(2024, 1, 1),
+    )
+    catalog = PluginCatalog()
+    found = await catalog.get_many(
+        _HOST,
+        [(pipeline.name, None), (pipeline.name, "1.0.0")],
+        _CountingFetcher(pipeline),
+    )
+    assert found == [pipeline, None]
+
+
+@pytest.mark.asyncio
+async def test_only_looked_up_plugins_are_cached():
+    plugins = [_plugin(f"pl-{i}", "1.0.0", 1) for i in range(10)]
+    fetch = _CountingFetcher(*plugins)
+    catalog = PluginCatalog(maxsize=3)
+    await catalog.get_many(_HOST, [("pl-0", None), ("pl-1", None)], fetch)
+    await catalog.get_many(_HOST, [("pl-2", None)], fetch)
+    # the rest of the catalog did not evict the plugins which were looked up
+    assert await catalog.get_many(_HOST, [("pl-0", None)], fetch) == [plugins[0]]
+    assert fetch.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_pipelines_are_cached_by_credentials():
+    locked = SimpleNamespace(
+        name="Leg Length Discrepency inference",
+        creation_date=datetime.datetime(2024, 1, 1),
+        locked=True,
+    )
+
+    async def list_pipelines(host, auth):
+        return [locked] if auth == "Basic owner" else []
+
+    clients = Clients()
+    clients._list_pipelines = list_pipelines
+    specs = [(locked.name, None)]
+    try:
+        assert await clients.get_pipelines(_HOST, "Basic owner", specs) == [locked]
+        assert await clients.get_pipelines(_HOST, "Basic other", specs) == [None]
+        assert await clients.get_pipelines(_HOST, "Basic owner", specs) == [locked]
+    finally:
+        await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_lookups_are_counted():
+    def lookups(result: str) -> float:
+        value = REGISTRY.get_sample_value(
+            "serie_catalog_lookups_total", {"kind": "test", "result": result}
+        )
+        return value or 0.0
+
+    catalog = PluginCatalog(kind="test")
+    fetch = _CountingFetcher(_plugin("pl-dircopy", "2.1.1", 1))
+    specs = [("pl-dircopy", None)]
+    await catalog.get_many(_HOST, specs, fetch)
+    await catalog.get_many(_HOST, specs * 2, fetch)
+    assert lookups("miss") == 1
+    assert lookups("hit") == 2
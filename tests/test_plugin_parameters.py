@@ -0,0 +1,38 @@
+import pytest
+
+from serie.plugin_parameters import ParameterSpec, check_params
+
+_SCHEMA = {
+    "name": ParameterSpec(name="name", type="string", required=True),
+    "size": ParameterSpec(name="size", type="integer", required=False),
+    "ratio": ParameterSpec(name="ratio", type="float", required=False),
+    "verbose": ParameterSpec(name="verbose", type="boolean", required=False),
+}
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"name": "a"},
+        {"name": "a", "size": 3, "ratio": 0.5, "verbose": True},
+        {"name": "a", "ratio": 2},
+    ],
+)
+def test_valid_params(params):
+    assert check_params(params, _SCHEMA) == []
+
+
+@pytest.mark.parametrize(
+    "params, expected",
+    [
+        ({"name": "a", "size": "3"}, ["`3` is not a valid argument for parameter `size` of type integer"]),
+        ({"name": "a", "size": 1.5}, ["`1.5` is not a valid argument for parameter `size` of type integer"]),
+        ({"name": "a", "size": True}, ["`True` is not a valid argument for parameter `size` of type integer"]),
+        ({"name": "a", "verbose": 1}, ["`1` is not a valid argument for parameter `verbose` of type boolean"]),
+        ({"name": 1}, ["`1` is not a valid argument for parameter `name` of type string"]),
+        ({"name": "a", "sise": 3}, ["`sise` is not a valid parameter"]),
+        ({}, ["parameter `name` is required"]),
+    ],
+)
+def test_invalid_params(params, expected):
+    assert check_params(params, _SCHEMA) == expected
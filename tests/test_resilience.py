@@ -0,0 +1,109 @@
+"""
+Unit tests of :mod:`serie.resilience`.
+"""
+
+import asyncio
+
+import pytest
+
+from aiochris_oag.exceptions import NotFoundException, ServiceException
+from serie.resilience import CircuitBreaker, CircuitOpenError, Resilience
+
+
+class _Flaky:
+    def __init__(self, failures: int, error: Exception = ServiceException(status=503)):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+@pytest.mark.asyncio
+async def test_read_is_retried():
+    resilience = Resilience(attempts=3, base_delay=0.001)
+    flaky = _Flaky(failures=2)
+    assert await resilience.read("cube", flaky) == "ok"
+    assert flaky.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_read_gives_up():
+    resilience = Resilience(attempts=2, base_delay=0.001)
+    flaky = _Flaky(failures=2)
+    with pytest.raises(ServiceException):
+        await resilience.read("cube", flaky)
+    assert flaky.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried():
+    resilience = Resilience(attempts=3, base_delay=0.001)
+    flaky = _Flaky(failures=1, error=NotFoundException(status=404))
+    with pytest.raises(NotFoundException):
+        await resilience.read("cube", flaky)
+    assert flaky.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_write_is_not_retried():
+    resilience = Resilience(attempts=3, base_delay=0.001)
+    flaky = _Flaky(failures=1)
+    with pytest.raises(ServiceException):
+        await resilience.write("cube", flaky)
+    assert flaky.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_recovers():
+    breaker = CircuitBreaker("cube", failure_threshold=2, reset_timeout=0.0)
+    flaky = _Flaky(failures=3)
+    for _ in range(2):
+        with pytest.raises(ServiceException):
+            await breaker.call(flaky)
+    # half-open: the trial call fails, so the circuit opens again
+    with pytest.raises(ServiceException):
+        await breaker.call(flaky)
+    assert await breaker.call(flaky) == "ok"
+    assert flaky.calls == 4
+
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_call_does_not_close_breaker():
+    breaker = CircuitBreaker("cube", failure_threshold=2, reset_timeout=0.05)
+    flaky = _Flaky(failures=10)
+    for _ in range(2):
+        with pytest.raises(ServiceException):
+            await breaker.call(flaky)
+    await asyncio.sleep(0.05)
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        await breaker.call(cancelled)
+    # another trial call is let through, and it fails, so the circuit opens again
+    with pytest.raises(ServiceException):
+        await breaker.call(flaky)
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(flaky)
+    assert flaky.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_fails_fast():
+    resilience = Resilience(attempts=3, failure_threshold=1, reset_timeout=60.0)
+    flaky = _Flaky(failures=10)
+    with pytest.raises(CircuitOpenError) as e:
+        await resilience.read("cube", flaky)
+    assert flaky.calls == 1
+    assert 0 < e.value.retry_after <= 60.0
+    with pytest.raises(CircuitOpenError):
+        await resilience.write("cube", flaky)
+    assert flaky.calls == 1
+    assert await resilience.read("other", _Flaky(failures=0)) == "ok"
@@ -0,0 +1,63 @@
+"""
+Tests of caching resolved series, see :attr:`Clients.resolved_series`.
+"""
+
+import asyncio
+import dataclasses
+
+import pytest
+
+from aiochris_oag.exceptions import NotFoundException
+
+from serie.handler import EventHandler
+from serie.models import RawPacsSeries
+from serie.settings import Settings
+from serie.ttl_cache import TtlCache
+from tests.fake_cube import FakeCube
+
+
+@pytest.mark.asyncio
+async def test_resolved_series_are_cached():
+    async with FakeCube() as cube:
+        row = RawPacsSeries.model_validate(cube.add_series())
+        handler = EventHandler(Settings(chris_host=cube.url + "/"))
+        try:
+            first = await handler._actions("Basic x").resolve_series(row)
+            second = await handler._actions("Basic x").resolve_series(row)
+            other = await handler._actions("Basic y").resolve_series(row)
+        finally:
+            await handler.close()
+    assert first is second
+    assert other is not first
+    assert cube.calls["pacs_series_retrieve"] == 2
+    assert cube.calls["filebrowser_retrieve"] == 2
+    assert first.to_dicom_metadata()["series_dir"] == cube.folders[1]["path"]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        first.folder_path = "elsewhere"
+
+
+@pytest.mark.asyncio
+async def test_series_which_are_not_found_are_not_cached():
+    async with FakeCube() as cube:
+        row = RawPacsSeries.model_validate({**cube.add_series(), "id": 404})
+        handler = EventHandler(Settings(chris_host=cube.url + "/"))
+        try:
+            for _ in range(2):
+                with pytest.raises(NotFoundException):
+                    await handler._actions("Basic x").resolve_series(row)
+        finally:
+            await handler.close()
+    assert cube.calls["pacs_series_retrieve"] == 2
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_expires():
+    cache = TtlCache(maxsize=2, ttl=0.01)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    await asyncio.sleep(0.02)
+    assert cache.get("a") is None
+    for key in "abc":
+        cache.put(key, key)
+    assert len(cache) == 2
+    assert cache.get("a") is None
@@ -0,0 +1,76 @@
+"""
+Unit tests for routing DICOM series to many rules.
+"""
+
+import re
+
+import pytest
+from pydantic import ValidationError
+
+from serie.models import RawPacsSeries, RoutingRule, RuleTable
+from serie.match import literal_prefix
+from serie.rules import RuleIndex
+from tests.test_match import _EXAMPLE_ROW
+
+
+def _rule(name: str, *conditions: tuple[str, str]) -> RoutingRule:
+    return RoutingRule(
+        name=name,
+        match=[{"tag": tag, "regex": regex} for tag, regex in conditions],
+        jobs=[{"name": "pl-dcm2niix"}],
+        feed_name_template=name,
+    )
+
+
+@pytest.mark.parametrize(
+    "regex, expected",
+    [
+        (r"CR", "CR"),
+        (r"SAG MPRAGE.*", "SAG MPRAGE"),
+        (r"(SAG) (MPRAGE).*", "SAG MPRAGE"),
+        (r".*(Chest).*", ""),
+        (r"ab?c", "a"),
+        (r"(MR|CT).*", ""),
+    ],
+)
+def test_literal_prefix(regex, expected):
+    assert literal_prefix(re.compile(regex)) == expected
+
+
+def test_rule_index():
+    rules = [
+        _rule("mprage", ("SeriesDescription", "SAG MPRAGE.*")),
+        _rule("chest", ("SeriesDescription", "Chest.*")),
+        _rule("mr", ("Modality", "MR"), ("StudyDescription", ".*Brain.*")),
+        _rule("mr-spine", ("Modality", "MR"), ("StudyDescription", ".*Spine.*")),
+        _rule("anything", ("PatientID", ".*")),
+        _rule("case", ("SeriesDescription", "(?i)sag.*")),
+        _rule("pacs", ("Modality", "MR"), ("pacs_identifier", "ORTHANC")),
+    ]
+    index = RuleIndex(rules)
+    data = RawPacsSeries.model_validate(_EXAMPLE_ROW)
+    hits = [rule.name for rule, _ in index.prematch(data)]
+    assert hits == ["mprage", "mr", "anything", "case", "pacs"]
+
+
+
+def test_rule_index_ignores_case_of_non_ascii_values():
+    rules = [
+        _rule("mprage", ("SeriesDescription", "(?i)sag mprage.*")),
+        _rule("chest", ("SeriesDescription", "(?i)chest.*")),
+    ]
+    index = RuleIndex(rules)
+    # LATIN SMALL LETTER LONG S, which re.IGNORECASE matches to "s"
+    row = {**_EXAMPLE_ROW, "SeriesDescription": "\u017fAG MPRAGE 220 FOV"}
+    data = RawPacsSeries.model_validate(row)
+    assert [rule.name for rule, _ in index.prematch(data)] == ["mprage"]
+
+
+def test_rule_names_must_be_unique():
+    rules = [
+        _rule("mprage", ("SeriesDescription", "SAG MPRAGE.*")),
+        _rule("chest", ("SeriesDescription", "Chest.*")),
+        _rule("mprage", ("SeriesDescription", ".*MPRAGE.*")),
+    ]
+    with pytest.raises(ValidationError, match="duplicates: \\['mprage'\\]"):
+        RuleTable(rules=rules)
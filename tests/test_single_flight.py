@@ -0,0 +1,42 @@
+"""
+Unit tests for coalescing concurrent calls.
+"""
+
+import asyncio
+
+import pytest
+
+from serie.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_outcome():
+    flights = SingleFlight()
+    calls = []
+
+    async def create_feed():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return f"https://example.com/api/v1/{len(calls)}/"
+
+    results = await asyncio.gather(
+        *(flights.do(("series", 1), create_feed) for _ in range(5))
+    )
+    assert results == ["https://example.com/api/v1/1/"] * 5
+    assert len(flights) == 0
+    assert await flights.do(("series", 1), create_feed) == "https://example.com/api/v1/2/"
+
+
+@pytest.mark.asyncio
+async def test_exception_is_shared():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("CUBE is down")
+
+    results = await asyncio.gather(
+        flights.do("key", fail), flights.do("key", fail), return_exceptions=True
+    )
+    assert all(isinstance(r, ValueError) for r in results)
+    assert results[0] is results[1]
@@ -0,0 +1,59 @@
+"""
+Unit tests for :class:`SpecCache`.
+"""
+
+import copy
+
+import pytest
+from pydantic import ValidationError
+
+from serie.spec_cache import SpecCache
+from tests.benchmark import make_payloads
+from tests.test_match import _EXAMPLE_ROW
+
+
+def test_spec_is_compiled_once():
+    specs = SpecCache()
+    first, second = make_payloads(
+        [_EXAMPLE_ROW, {**_EXAMPLE_ROW, "id": 2}], ".*MPRAGE.*"
+    )
+    payload1, matcher1 = specs.parse(first)
+    payload2, matcher2 = specs.parse(second)
+    assert len(specs) == 1
+    assert matcher1 is matcher2
+    assert payload1.match is payload2.match
+    assert payload2.data.id == 2
+    assert payload2.hasura_id == second["hasura_id"]
+
+
+def test_different_specs_are_cached_separately():
+    specs = SpecCache(maxsize=1)
+    payload, matcher = specs.parse(make_payloads([_EXAMPLE_ROW], ".*MPRAGE.*")[0])
+    assert matcher.prematch(payload.data)
+    payload, matcher = specs.parse(make_payloads([_EXAMPLE_ROW], ".*Chest.*")[0])
+    assert not matcher.prematch(payload.data)
+    assert len(specs) == 1
+
+
+def test_data_is_validated_when_spec_is_cached():
+    specs = SpecCache()
+    payload = make_payloads([_EXAMPLE_ROW], ".*MPRAGE.*")[0]
+    specs.parse(payload)
+    invalid = copy.deepcopy(payload)
+    invalid["data"]["PatientSex"] = "not a sex"
+    with pytest.raises(ValidationError) as e:
+        specs.parse(invalid)
+    assert e.value.errors()[0]["loc"] == ("data", "PatientSex")
+    del invalid["hasura_id"]
+    with pytest.raises(ValidationError):
+        specs.parse(invalid)
+
+
+def test_invalid_spec_is_not_cached():
+    specs = SpecCache()
+    payload = make_payloads([_EXAMPLE_ROW], "(unbalanced")[0]
+    with pytest.raises(ValidationError):
+        specs.parse(payload)
+    assert len(specs) == 0
+    with pytest.raises(ValidationError):
+        specs.parse([payload])
@@ -0,0 +1,100 @@
+"""
+Tests of creating one feed per study, see :class:`StudyGrouper`.
+"""
+
+import asyncio
+
+import pytest
+
+from serie.handler import EventHandler
+from serie.models import DicomSeriesEvent, RoutingRule
+from serie.rules import RuleIndex
+from serie.settings import Settings
+from serie.study_groups import StudyGrouper
+from tests.fake_cube import FakeCube
+
+
+@pytest.mark.asyncio
+async def test_groups_are_handled_after_quiet_period():
+    flushed = []
+
+    async def flush(key, items):
+        flushed.append((key, items))
+        return len(items)
+
+    grouper = StudyGrouper(flush)
+    first = grouper.add("study", "a", 1, quiet_period=0.05)
+    await asyncio.sleep(0.03)
+    second = grouper.add("study", "b", 2, quiet_period=0.05)
+    assert grouper.add("study", "a", 1, quiet_period=0.05) is first
+    other = grouper.add("other", "c", 3, quiet_period=0.01)
+    await asyncio.sleep(0.03)
+    assert flushed == [("other", [3])]
+    assert first is second
+    assert await first == 2
+    assert flushed == [("other", [3]), ("study", [1, 2])]
+    assert await other == 1
+    assert len(grouper) == 0
+
+
+@pytest.mark.asyncio
+async def test_groups_are_not_delayed_past_max_delay():
+    async def flush(key, items):
+        return items
+
+    grouper = StudyGrouper(flush, max_delay=0.05)
+    outcome = grouper.add("study", "a", 1, quiet_period=60.0)
+    for i in range(10):
+        grouper.add("study", str(i), i, quiet_period=60.0)
+        await asyncio.sleep(0.01)
+    assert outcome.done()
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_groups():
+    async def flush(key, items):
+        return items
+
+    grouper = StudyGrouper(flush)
+    outcome = grouper.add("study", "a", 1, quiet_period=60.0)
+    await grouper.close()
+    assert await outcome == [1]
+
+
+@pytest.mark.asyncio
+async def test_creates_one_feed_per_study():
+    async with FakeCube() as cube:
+        cube.add_plugin("pl-dcm2niix", "1.0.0")
+        rows = [cube.add_series(SeriesDescription=f"View {i}") for i in range(3)]
+        rows.append(cube.add_series(SeriesDescription="Scout"))
+        handler = EventHandler(Settings(chris_host=cube.url + "/"))
+        handler.rule_index = RuleIndex(
+            [
+                RoutingRule(
+                    name="views",
+                    match=[{"tag": "SeriesDescription", "regex": "View.*"}],
+                    jobs=[{"type": "plugin", "name": "pl-dcm2niix"}],
+                    feed_name_template="{StudyInstanceUID}",
+                    study_quiet_period=0.05,
+                )
+            ]
+        )
+        try:
+            outcomes = await asyncio.gather(
+                *(
+                    handler.handle_rules(
+                        DicomSeriesEvent(hasura_id=str(row["id"]), data=row),
+                        "Basic x",
+                    )
+                    for row in rows
+                )
+            )
+        finally:
+            await handler.close()
+    assert outcomes[3] is None
+    feeds = {str(outcome[0].result.feed) for outcome in outcomes[:3]}
+    assert feeds == {f"{cube.url}/api/v1/1/"}
+    assert len(cube.feeds) == 1
+    assert cube.calls["plugins_instances_create"] == 3
+    dirs = cube.request_bodies[("plugins_instances_create", 1)]["dir"].split(",")
+    assert [d.rsplit(".", 1)[1] for d in dirs] == ["1", "2", "3"]
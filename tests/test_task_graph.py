@@ -0,0 +1,109 @@
+"""
+Unit tests for :class:`TaskGraph`.
+"""
+
+import asyncio
+
+import pytest
+
+from serie.task_graph import TaskGraph
+
+
+@pytest.mark.asyncio
+async def test_operations_start_when_dependencies_finish():
+    events = []
+    unstack_may_finish = asyncio.Event()
+
+    async def dircopy():
+        events.append("dircopy")
+        return 1
+
+    async def unstack(previous):
+        await unstack_may_finish.wait()
+        events.append("unstack")
+        return previous + 1
+
+    async def set_feed_name(previous):
+        events.append("set_feed_name")
+        unstack_may_finish.set()
+
+    graph = TaskGraph()
+    graph.add("dircopy", dircopy)
+    graph.add("unstack", unstack, "dircopy")
+    graph.add("set_feed_name", set_feed_name, "dircopy")
+    results = await graph.run()
+
+    assert events == ["dircopy", "set_feed_name", "unstack"]
+    assert results == {"dircopy": 1, "unstack": 2, "set_feed_name": None}
+    assert set(graph.latencies.keys()) == {"dircopy", "unstack", "set_feed_name"}
+
+
+@pytest.mark.asyncio
+async def test_failure_lets_started_operations_finish():
+    calls = []
+
+    async def root():
+        return 0
+
+    async def fail(_):
+        await asyncio.sleep(0.01)
+        raise ValueError("bad")
+
+    async def parallel_write(_):
+        await asyncio.sleep(0.05)
+        calls.append("parallel_write")
+        return "created"
+
+    async def after(_):
+        calls.append("after")
+
+    graph = TaskGraph()
+    graph.add("root", root)
+    graph.add("fail", fail, "root")
+    graph.add("parallel_write", parallel_write, "root")
+    graph.add("after", after, "parallel_write")
+    with pytest.raises(ValueError):
+        await graph.run()
+    assert calls == ["parallel_write"]
+    assert graph.results == {"root": 0, "parallel_write": "created"}
+
+
+def test_dependencies_must_exist():
+    graph = TaskGraph()
+    with pytest.raises(ValueError):
+        graph.add("unstack", lambda _: asyncio.sleep(0), "dircopy")
+
+
+@pytest.mark.asyncio
+async def test_resume_from_completed_operations():
+    calls = []
+
+    async def dircopy():
+        calls.append("dircopy")
+        return 1
+
+    async def unstack(previous):
+        calls.append("unstack")
+        return previous + 1
+
+    async def branch(previous):
+        calls.append("branch")
+        if len(calls) < 4:
+            raise ValueError("CUBE is down")
+        return previous + 1
+
+    def build() -> TaskGraph:
+        graph = TaskGraph()
+        graph.add("dircopy", dircopy)
+        graph.add("unstack", unstack, "dircopy")
+        graph.add("branch", branch, "unstack")
+        return graph
+
+    failed = build()
+    with pytest.raises(ValueError):
+        await failed.run()
+    assert failed.results == {"dircopy": 1, "unstack": 2}
+
+    results = await build().run(completed=failed.results)
+    assert results == {"dircopy": 1, "unstack": 2, "branch": 3}
+    assert calls == ["dircopy", "unstack", "branch", "branch"]